@@ -1,95 +1,109 @@
+import os
 import streamlit as st
 import pandas as pd
 import numpy as np
 import pydeck as pdk
-from src.score import score_week
-import joblib
+from src.features import FEATURES_PATH
+from src.model_store import resolve_model_path
+from src.predictions import features_sig
+from src.score import PORTS
+from src.session import ScoringSession
+from src.tiles import build_pyramid
 
 st.set_page_config(page_title="Artisanal Fishing Hotspots", layout="wide")
 
 st.title("Artisanal Fishing Hotspots (Weekly)")
 st.caption("Demo MVP: XGBoost hotspot predictions using SST + Chl (synthetic data). Replace with real BI and satellite feeds for production.")
 
-# Port presets (approx coords)
-PORTS = {
-    "Paita": (-5.09, -81.11),
-    "Chimbote": (-9.07, -78.59),
-    "Callao": (-12.06, -77.15),
-    "Pisco": (-13.71, -76.22),
-    "Matarani": (-17.00, -72.10),
-}
-
-col1, col2, col3 = st.columns([1.2,1,1])
+col1, col2, col3, col4 = st.columns([1.2,1,1,1])
 with col1:
     port = st.selectbox("Port", list(PORTS.keys()), index=2)
 with col2:
     week = st.text_input("ISO Week (e.g., 2024-W30)", value="2024-W30")
 with col3:
     lam = st.slider("Distance penalty (λ)", 0.0, 0.1, 0.02, 0.01)
+with col4:
+    max_range = st.number_input("Max range (km, 0 = unlimited)", min_value=0, value=0, step=25)
+
+# Load features and model once per process; new files on disk (or weeks appended by
+# src.update under features_weeks/) start a fresh session
+@st.cache_resource(max_entries=2)
+def get_session(features_sig, model_sig) -> ScoringSession:
+    return ScoringSession(FEATURES_PATH, resolve_model_path())
+
+def _sig(path):
+    info = os.stat(path)
+    return (info.st_size, info.st_mtime_ns)
+
+# Map pyramid per week, rebuilt only when the week, features or model change
+@st.cache_data(max_entries=16)
+def get_pyramid(week, features_sig, model_sig, _session: ScoringSession):
+    dfw = _session.week_frame(week)
+    p = np.clip(np.nan_to_num(np.asarray(_session.probabilities(week), dtype=float), nan=0.0), 0.0, 1.0)
+    return build_pyramid(_session.grid, dfw["lat"].to_numpy(), dfw["lon"].to_numpy(), p)
 
-# Load features and model
 try:
-    feats = pd.read_parquet("data/processed/features.parquet")
-except Exception:
-    st.error("Features parquet not found. Run data_gen.py first.")
+    sigs = (tuple(features_sig(FEATURES_PATH)), _sig(resolve_model_path()))
+    session = get_session(*sigs)
+except FileNotFoundError:
+    st.error("Features parquet or model not found. Run data_gen.py and train.py first.")
     st.stop()
 
-model_path = "models/hotspot_xgb.pkl"
-
-# --- Build df for the selected week ---
-dfw = feats[feats["week"] == week].copy()
+# --- Ocean-side rows for the selected week (land already masked by the grid index) ---
+dfw = session.week_frame(week).copy()
 if dfw.empty:
     st.warning("No data for that ISO week. Try a week between 2024-W19 and 2024-W40 (synthetic range).")
     st.stop()
 
-# --- Lat-aware coastline cutoff (drop land points) ---
-_lats = np.array([-18.0, -15.0, -12.0, -9.0, -6.0, -3.0])
-_lons = np.array([-72.5, -75.0, -77.2, -78.5, -80.0, -80.9])  # approx coast
-cut = np.interp(dfw["lat"].to_numpy(), _lats, _lons)
-dfw = dfw[dfw["lon"].to_numpy() < cut].copy()
-if dfw.empty:
-    st.warning("All cells masked as land for this week. Loosen the cutoff.")
-    st.stop()
-
-# --- Top-10 (distance-aware) computed on the masked ocean cells ---
+# --- Top-10 (distance-aware): p cached per week, distances cached per port ---
 plat, plon = PORTS[port]
-top10 = score_week(model_path, dfw, plat, plon, lam=lam)
+top10 = session.top_k(week, plat, plon, lam=lam, max_range_km=max_range or None)
 
 # --- Per-cell probability for the heatmap ---
-model = joblib.load(model_path)
-dfw["p"] = model.predict_proba(dfw[["sst","chl","sst_anom","month"]])[:, 1]
+dfw["p"] = session.probabilities(week)
 dfw["p"] = dfw["p"].astype(float).fillna(0.0).clip(0.0, 1.0)
 
-# --- Explicit color columns (deck.gl-friendly) ---
-dfw["r"] = (255 * dfw["p"]).round().astype(int)
-dfw["g"] = 50
-dfw["b"] = (200 * (1.0 - dfw["p"])).round().astype(int)
-
 st.subheader("Top-10 Recommended Cells (Distance-aware)")
 st.dataframe(top10.style.format({"p":"{:.2f}","dist_km":"{:.1f}","score":"{:.2f}"}))
 
 # --- Map ---
 st.subheader("Hotspot Probability Map")
 
+# Coarser levels merge 2^L x 2^L cells per tile: fewer, larger points to draw
+levels = get_pyramid(week, *sigs, session)
+mcol1, mcol2 = st.columns([2, 1])
+with mcol1:
+    level = st.selectbox("Map resolution", range(len(levels)),
+                         format_func=lambda i: f"{levels[i].step:g}° tiles ({levels[i].i.size} points)")
+with mcol2:
+    stat = st.radio("Tile value", ["max", "mean"], horizontal=True, disabled=level == 0)
+tiles = levels[level].frame()
+tiles["p"] = tiles["p_max"] if stat == "max" else tiles["p_mean"]
+
+# --- Explicit color columns (deck.gl-friendly) ---
+tiles["r"] = (255 * tiles["p"]).round().astype(int)
+tiles["g"] = 50
+tiles["b"] = (200 * (1.0 - tiles["p"])).round().astype(int)
+
 mid_lat = float(dfw["lat"].mean())
 mid_lon = float((dfw["lon"].min() + dfw["lon"].max()) / 2)
 
 layer = pdk.Layer(
     "ScatterplotLayer",
-    data=dfw,
+    data=tiles,
     get_position='[lon, lat]',
     get_fill_color='[r, g, b, 200]',  # <- use the columns we created
     get_line_color='[20,20,20,80]',
     stroked=True,
     pickable=True,
-    get_radius=15000,
+    get_radius=levels[level].step * 111_320 / 2,  # half a tile, in meters
     opacity=0.9,
 )
 
 r = pdk.Deck(
     layers=[layer],
     initial_view_state=pdk.ViewState(latitude=mid_lat, longitude=mid_lon, zoom=5.3, pitch=0),
-    tooltip={"text": "lat: {lat}\nlon: {lon}\np: {p}"},
+    tooltip={"text": "lat: {lat}\nlon: {lon}\np: {p}\ncells: {n}"},
 )
 st.pydeck_chart(r)
 
@@ -11,6 +11,18 @@ type Feature = {
 };
 type FeatureCollection = { type: "FeatureCollection"; features: Feature[] };
 
+// ranked/<week>/<port>.json from `export_geojson.py --ranked`: every cell that can make the
+// top k for some lam >= 0, sorted by p descending, with its distance to the port precomputed
+type Ranked = {
+  week: string;
+  port: string;
+  k: number;
+  columns: ["lat", "lon", "p", "dist_km"];
+  rows: [number, number, number, number][];
+  top: Record<string, number[]>; // top k (row indices) for the default lam values
+};
+type Top = { lat: number; lon: number; p: number; score: number; dist_km: number };
+
 function haversineKm(lat1: number, lon1: number, lat2: number, lon2: number) {
   const R = 6371;
   const toRad = (d: number) => (d * Math.PI) / 180;
@@ -30,15 +42,62 @@ const PORTS: Record<string, [number, number]> = {
   Matarani: [-17.0, -72.1],
 };
 
+async function readRanked(week: string, port: string): Promise<Ranked | null> {
+  const filePath = path.join(process.cwd(), "public", "predictions", "ranked", week, `${port}.json`);
+  try {
+    return JSON.parse(await fs.readFile(filePath, "utf-8"));
+  } catch {
+    return null;
+  }
+}
+
+// Top-k by p - lam * dist_km from a ranked file; score <= p, so the scan stops at the
+// first row whose p cannot beat the current k-th best score
+function rankTop(ranked: Ranked, lam: number, k: number): Top[] {
+  let idx = ranked.top[String(lam)];
+  if (!idx) {
+    const best: { i: number; score: number }[] = [];
+    for (let i = 0; i < ranked.rows.length; i++) {
+      const [, , p, dist] = ranked.rows[i];
+      if (best.length === k && p <= best[k - 1].score) break;
+      const score = p - lam * dist;
+      if (best.length === k && score <= best[k - 1].score) continue;
+      let at = best.length;
+      while (at > 0 && best[at - 1].score < score) at--;
+      best.splice(at, 0, { i, score });
+      if (best.length > k) best.pop();
+    }
+    idx = best.map((b) => b.i);
+  }
+  return idx.map((i) => {
+    const [lat, lon, raw, dist_km] = ranked.rows[i];
+    const p = Math.max(0, Math.min(1, raw));
+    return { lat, lon, p, score: Math.max(0, Math.min(1, p - lam * dist_km)), dist_km };
+  });
+}
+
+// GET /api/predict?week=2024-W30&port=Callao&lam=0.02[&geojson=1]
+// Always { week, port, lam, top10 }; the scored FeatureCollection (properties p, dist_km,
+// score, color) is added as `geojson` only for ?geojson=1. The shape depends on the query
+// alone, not on whether the ranked files were exported.
 export async function GET(req: NextRequest) {
   const { searchParams } = new URL(req.url);
   const week = searchParams.get("week") || "2024-W30";
   const port = searchParams.get("port") || "Callao";
   const lam = Number(searchParams.get("lam") || "0.02");
+  const withGeojson = searchParams.get("geojson") === "1";
 
   const portCoords = PORTS[port] ?? PORTS["Callao"];
   const [plat, plon] = portCoords;
 
+  // Fast path: a few KB of pre-ranked cells; the full GeoJSON only when asked for (?geojson=1)
+  if (!withGeojson && lam >= 0) {
+    const ranked = await readRanked(week, PORTS[port] ? port : "Callao");
+    if (ranked && ranked.k >= 10) {
+      return NextResponse.json({ week, port, lam, top10: rankTop(ranked, lam, 10) });
+    }
+  }
+
   // Precomputed file: put your Python-generated file here
   const filePath = path.join(process.cwd(), "public", "predictions", `${week}.geojson`);
 
@@ -82,5 +141,5 @@ export async function GET(req: NextRequest) {
     dist_km: f.properties.dist_km,
   }));
 
-  return NextResponse.json({ week, port, lam, top10, geojson: fc });
+  return NextResponse.json(withGeojson ? { week, port, lam, top10, geojson: fc } : { week, port, lam, top10 });
 }
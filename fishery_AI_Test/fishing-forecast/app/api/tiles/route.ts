@@ -0,0 +1,91 @@
+import { NextRequest, NextResponse } from "next/server";
+import path from "path";
+import fs from "fs/promises";
+
+export const runtime = "nodejs"; // we need fs, not edge
+
+// Header written by src/tiles.py next to <week>.geojson
+type Level = {
+  level: number;
+  lat0: number;
+  lon0: number;
+  step: number;
+  n_rows: number;
+  n_cols: number;
+  tiles: number;
+  min_zoom: number;
+  row_ptr: number[];
+  columns: Record<"i" | "j" | "p_max" | "p_mean" | "n", [number, number]>; // [byte offset, byte length]
+};
+type Header = { format: string; week: string; bin: string; p_scale: number; levels: Level[] };
+
+// Finest level whose tiles are still a few pixels wide at this zoom (the coarsest if none)
+function pickLevel(levels: Level[], zoom: number): Level {
+  const sorted = [...levels].sort((a, b) => a.level - b.level);
+  return sorted.find((l) => l.min_zoom <= zoom) ?? sorted[sorted.length - 1];
+}
+
+// GET /api/tiles?week=2024-W30&zoom=6&bbox=minLon,minLat,maxLon,maxLat  (or &level=2)
+export async function GET(req: NextRequest) {
+  const { searchParams } = new URL(req.url);
+  const week = searchParams.get("week") || "2024-W30";
+  const zoom = Number(searchParams.get("zoom") || "5");
+  const levelParam = searchParams.get("level");
+  const bbox = (searchParams.get("bbox") || "").split(",").map(Number);
+  const hasBbox = bbox.length === 4 && bbox.every(Number.isFinite);
+
+  const dir = path.join(process.cwd(), "public", "predictions");
+  let header: Header;
+  try {
+    header = JSON.parse(await fs.readFile(path.join(dir, `${week}.tiles.json`), "utf-8"));
+  } catch {
+    return NextResponse.json({ error: `Tiles not found for week ${week}` }, { status: 404 });
+  }
+
+  const level =
+    levelParam !== null
+      ? header.levels.find((l) => l.level === Number(levelParam))
+      : pickLevel(header.levels, zoom);
+  if (!level) {
+    return NextResponse.json({ error: `No level ${levelParam} for week ${week}` }, { status: 400 });
+  }
+
+  // Tiles are sorted row-major: a latitude band is one contiguous slice of every column
+  let r0 = 0;
+  let r1 = level.n_rows;
+  if (hasBbox) {
+    const row = (lat: number) => Math.floor((lat - level.lat0) / level.step + 0.5);
+    r0 = Math.min(Math.max(row(Math.min(bbox[1], bbox[3])), 0), level.n_rows);
+    r1 = Math.min(Math.max(row(Math.max(bbox[1], bbox[3])) + 1, 0), level.n_rows);
+  }
+  const t0 = level.row_ptr[r0];
+  const count = level.row_ptr[r1] - t0;
+
+  const cols: Record<string, Uint16Array> = {};
+  const fh = await fs.open(path.join(dir, header.bin), "r");
+  try {
+    for (const name of ["i", "j", "p_max", "p_mean", "n"] as const) {
+      const buf = Buffer.alloc(count * 2);
+      await fh.read(buf, 0, buf.length, level.columns[name][0] + t0 * 2);
+      cols[name] = new Uint16Array(buf.buffer, buf.byteOffset, count); // little-endian, as written
+    }
+  } finally {
+    await fh.close();
+  }
+
+  const out = { lat: [] as number[], lon: [] as number[], p_max: [] as number[], p_mean: [] as number[], n: [] as number[] };
+  for (let k = 0; k < count; k++) {
+    const lat = level.lat0 + level.step * cols.i[k];
+    const lon = level.lon0 + level.step * cols.j[k];
+    if (hasBbox && (lon < Math.min(bbox[0], bbox[2]) - level.step / 2 || lon > Math.max(bbox[0], bbox[2]) + level.step / 2)) {
+      continue;
+    }
+    out.lat.push(lat);
+    out.lon.push(lon);
+    out.p_max.push(cols.p_max[k] / header.p_scale);
+    out.p_mean.push(cols.p_mean[k] / header.p_scale);
+    out.n.push(cols.n[k]);
+  }
+
+  return NextResponse.json({ week, level: level.level, step: level.step, tiles: out });
+}
@@ -0,0 +1,75 @@
+"""Pickle vs native UBJSON hotspot model: cold load time and per-week inference.
+
+Cold load runs in a fresh interpreter per repeat (libraries imported before the
+clock starts, so only deserialization is timed). Per-week latency scores one
+week of features the old way (joblib pickle + predict_proba on float64) and the
+new way (model_store: inplace_predict on contiguous float32).
+
+    python -m benchmarks.bench_model_format [--week 2024-W30] [--repeats 5]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+import joblib
+import numpy as np
+
+from src.features import load_features
+from src.model_store import FEATS, NATIVE_PATH, PICKLE_PATH, load_hotspot
+
+_COLD = {
+    "pickle": "import joblib, xgboost, time; t=time.perf_counter(); joblib.load({path!r}); print(time.perf_counter()-t)",
+    "native": ("import xgboost, time; from src.model_store import load_hotspot; "
+               "t=time.perf_counter(); load_hotspot({path!r}); print(time.perf_counter()-t)"),
+}
+
+def cold_load_s(kind: str, path: str, repeats: int) -> float:
+    code = _COLD[kind].format(path=path)
+    runs = [float(subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                                 text=True).stdout.strip().splitlines()[-1]) for _ in range(repeats)]
+    return statistics.median(runs)
+
+def _median_ms(fn, repeats: int) -> float:
+    fn()  # warm-up
+    runs = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t)
+    return 1000 * statistics.median(runs)
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark pickle vs native hotspot model loading and inference.")
+    ap.add_argument("--week", default=None, help="ISO week to score (default: first stored week)")
+    ap.add_argument("--pickle", default=PICKLE_PATH)
+    ap.add_argument("--native", default=NATIVE_PATH)
+    ap.add_argument("--repeats", type=int, default=5)
+    args = ap.parse_args()
+
+    feats = load_features(columns=["week"] + FEATS)
+    week = args.week or feats["week"].min()
+    dfw = feats[feats["week"] == week].dropna(subset=FEATS)
+    if dfw.empty:
+        raise SystemExit(f"No features for {week}")
+
+    pkl = joblib.load(args.pickle)
+    native = load_hotspot(args.native)
+    p_old = pkl.predict_proba(dfw[FEATS].to_numpy())[:, 1]
+    p_new = native.predict_frame(dfw)
+
+    rows = [
+        ("cold load (s)", cold_load_s("pickle", args.pickle, args.repeats),
+         cold_load_s("native", args.native, args.repeats)),
+        (f"score {week} (ms, {len(dfw)} rows)",
+         _median_ms(lambda: pkl.predict_proba(dfw[FEATS].to_numpy())[:, 1], args.repeats),
+         _median_ms(lambda: native.predict_frame(dfw), args.repeats)),
+    ]
+    print(f"{'':32s}{'pickle':>12s}{'native':>12s}{'speedup':>10s}")
+    for name, old, new in rows:
+        print(f"{name:32s}{old:12.4f}{new:12.4f}{old / max(new, 1e-12):9.1f}x")
+    print(f"max |p_pickle - p_native| = {np.abs(p_old - p_new).max():.2e}")
+
+if __name__ == "__main__":
+    main()
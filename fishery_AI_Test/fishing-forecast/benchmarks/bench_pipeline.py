@@ -0,0 +1,284 @@
+"""Pipeline benchmark over grid resolution x number of weeks, with a JSON history.
+
+Each case (grid step, weeks) runs every stage on synthetic data inside a scratch
+directory, so real data/models/outputs are never touched:
+
+    synth_env -> build_weekly_features -> train_hotspot -> score_week -> export_week
+    price_features.build_features -> train_and_forecast
+
+Wall time is the best of `--repeats` runs; memory comes from one extra run under
+tracemalloc (peak Python/numpy allocations) plus the growth of the process's
+peak RSS, which also catches native allocations (xgboost, sklearn). Every run is
+appended to the history file; `compare` diffs two runs case by case and exits 1
+when a stage got slower or hungrier than the threshold.
+
+    python -m benchmarks.bench_pipeline run [--steps 0.5,0.25,0.1] [--weeks 12,24] [--label v1.2]
+    python -m benchmarks.bench_pipeline compare [--base -2] [--head -1] [--threshold 0.15]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src import isoweek
+from src.data_gen import synth_env, synth_labels
+from src.export_geojson import export_week
+from src.features import FEATURES_PATH, build_weekly_features
+from src.grid import GridIndex
+from src.instrument import peak_rss_mb
+from src.price_features import build_features
+from src.price_train import train_and_forecast
+from src.score import PORTS, score_week
+from src.train import train_hotspot
+
+HISTORY_PATH = "benchmarks/bench_history.json"
+START_WEEK = "2024-W01"
+STAGES = ["synth_env", "build_weekly_features", "train_hotspot", "score_week", "export_week",
+          "price_features.build_features", "train_and_forecast"]
+
+@contextlib.contextmanager
+def _quiet():
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        yield
+
+def measure(fn, repeats: int = 1, memory: bool = True) -> dict:
+    """Best-of-`repeats` wall/CPU seconds, then one traced run for peak memory."""
+    wall, cpu = [], []
+    for _ in range(repeats):
+        t, c = time.perf_counter(), time.process_time()
+        with _quiet():
+            fn()
+        wall.append(time.perf_counter() - t)
+        cpu.append(time.process_time() - c)
+    out = {"seconds": min(wall), "cpu_seconds": min(cpu)}
+    if memory:
+        rss0 = peak_rss_mb()
+        tracemalloc.start()
+        try:
+            with _quiet():
+                fn()
+            out["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+        rss1 = peak_rss_mb()
+        out["rss_growth_mb"] = None if rss1 is None else max(0.0, rss1 - rss0)
+    return out
+
+def synth_prices(weeks: list[str], out_dir: Path, species: str = "bench", seed: int = 0) -> tuple[Path, Path, Path]:
+    """Random-walk price / landings / predicted-landings CSVs for every port and week."""
+    rng = np.random.default_rng(seed)
+    n_w, n_p = len(weeks), len(PORTS)
+    keys = {"week": np.repeat(weeks, n_p), "port": np.tile(list(PORTS), n_w)}
+    price = 2.0 + np.cumsum(rng.normal(0, 0.05, (n_w, n_p)), axis=0)
+    land = np.maximum(0, 250 + np.cumsum(rng.normal(0, 15, (n_w, n_p)), axis=0))
+    pred = land + rng.normal(0, 10, land.shape)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = (out_dir / f"{species}_prices.csv", out_dir / f"{species}_landings.csv",
+             out_dir / "predicted_landings.csv")
+    for path, col, vals in zip(paths, ("price_pen_perkg", "landings_tons", "pred_landings_t1"),
+                               (price, land, pred)):
+        pd.DataFrame({**keys, col: np.round(vals.ravel(), 3)}).to_csv(path, index=False)
+    return paths
+
+def run_case(step: float, n_weeks: int, repeats: int = 1, memory: bool = True) -> list[dict]:
+    """Time every stage for one (grid step, weeks) case. Runs inside a scratch cwd."""
+    grid = GridIndex.build(step=step)
+    grid_df = grid.frame()
+    weeks = isoweek.week_range(START_WEEK, isoweek.add_weeks(START_WEEK, n_weeks - 1))
+    week = weeks[-1]
+    port_lat, port_lon = PORTS["Callao"]
+    state: dict = {}
+    os.makedirs(os.path.dirname(FEATURES_PATH), exist_ok=True)
+    grid.save()
+
+    def _synth():
+        state["sst"], state["chl"] = synth_env(grid_df, weeks)
+
+    def _features():
+        state["feats"] = build_weekly_features(state["sst"], state["chl"])
+
+    def _train():
+        train_hotspot(state["feats"], state["labels"], save_to="models/hotspot_xgb.pkl")
+
+    def _score():
+        score_week("models/hotspot_xgb.ubj", state["week_feats"], port_lat, port_lon)
+
+    def _export():
+        export_week(week, "outputs/predictions")
+
+    def _price_features():
+        build_features(*state["price_csvs"], Path("data/processed/bench_price_features.csv"), cache_dir=None)
+
+    def _price_train():
+        train_and_forecast(Path("data/processed/bench_price_features.csv"), "bench",
+                           model_dir=Path("models"), out_dir=Path("outputs"))
+
+    def _before_train():
+        state["labels"] = synth_labels(state["feats"])
+
+    def _before_score():
+        state["week_feats"] = state["feats"][state["feats"]["week"] == week]
+        grid.attach(state["feats"]).to_parquet(FEATURES_PATH, index=False)
+        from src.predictions import refresh
+        with _quiet():
+            refresh(FEATURES_PATH)  # score the store up front: export_week times the export only
+
+    def _before_prices():
+        state["price_csvs"] = synth_prices(weeks, Path("data/bench"))
+
+    stages = [
+        ("synth_env", _synth, None, lambda: len(state["sst"])),
+        ("build_weekly_features", _features, None, lambda: len(state["feats"])),
+        ("train_hotspot", _train, _before_train, lambda: len(state["labels"])),
+        ("score_week", _score, _before_score, lambda: len(state["week_feats"])),
+        ("export_week", _export, None, lambda: int(grid.ocean.sum())),
+        ("price_features.build_features", _price_features, _before_prices, lambda: len(weeks) * len(PORTS)),
+        ("train_and_forecast", _price_train, None, lambda: len(weeks) * len(PORTS)),
+    ]
+    results = []
+    for name, fn, setup, rows in stages:
+        if setup:
+            setup()
+        r = measure(fn, repeats, memory)
+        results.append({"stage": name, "step": step, "weeks": n_weeks, "cells": grid.n_cells,
+                        "rows": rows(), **r})
+        mem = f"  peak {r['peak_mb']:8.1f} MB" if memory else ""
+        if memory and r["rss_growth_mb"] is not None:
+            mem += f"  rss +{r['rss_growth_mb']:7.1f} MB"
+        print(f"  {name:30s}{r['seconds']:9.3f} s{mem}", flush=True)
+    return results
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def read_history(path: str = HISTORY_PATH) -> list[dict]:
+    p = Path(path)
+    return json.loads(p.read_text()) if p.exists() else []
+
+def append_history(run: dict, path: str = HISTORY_PATH) -> None:
+    history = read_history(path) + [run]
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(json.dumps(history, indent=1))
+    os.replace(tmp, p)
+
+def run(steps: list[float], weeks: list[int], repeats: int = 1, memory: bool = True,
+        label: str | None = None) -> dict:
+    """Benchmark every (step, weeks) case; returns the history record."""
+    results = []
+    cwd = os.getcwd()
+    for step in steps:
+        for n in weeks:
+            print(f"case step={step} weeks={n}", flush=True)
+            with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as scratch:
+                os.chdir(scratch)
+                try:
+                    results += run_case(step, n, repeats, memory)
+                finally:
+                    os.chdir(cwd)
+    return {
+        "label": label, "git_rev": _git_rev(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+        "repeats": repeats, "results": results,
+    }
+
+def _pick(history: list[dict], ref: str) -> dict:
+    """A run by list index (e.g. -1 = latest) or by label."""
+    try:
+        return history[int(ref)]
+    except ValueError:
+        pass
+    except IndexError:
+        raise SystemExit(f"No run {ref} (history has {len(history)})") from None
+    hits = [r for r in history if r.get("label") == ref]
+    if not hits:
+        raise SystemExit(f"No run labelled {ref!r}")
+    return hits[-1]
+
+def compare(base: dict, head: dict, threshold: float = 0.15, min_seconds: float = 0.05,
+            min_mb: float = 1.0) -> pd.DataFrame:
+    """Per-case ratios head/base. A stage regresses when it is more than `threshold`
+    slower (and by at least `min_seconds`) or its peak memory grew by more than
+    `threshold` (and by at least `min_mb`); the floors keep tiny stages from flapping.
+    """
+    key = ["stage", "step", "weeks"]
+    b, h = pd.DataFrame(base["results"]), pd.DataFrame(head["results"])
+    df = b.merge(h, on=key, suffixes=("_base", "_head"))
+    df["time_ratio"] = df["seconds_head"] / df["seconds_base"]
+    slower = (df["time_ratio"] > 1 + threshold) & (df["seconds_head"] - df["seconds_base"] >= min_seconds)
+    if "peak_mb_base" in df and "peak_mb_head" in df:
+        df["mem_ratio"] = df["peak_mb_head"] / df["peak_mb_base"]
+        hungrier = (df["mem_ratio"] > 1 + threshold) & (df["peak_mb_head"] - df["peak_mb_base"] >= min_mb)
+    else:
+        df["mem_ratio"], hungrier = np.nan, False
+    df["regression"] = np.where(slower & hungrier, "time+memory",
+                                np.where(slower, "time", np.where(hungrier, "memory", "")))
+    df["stage"] = pd.Categorical(df["stage"], categories=STAGES, ordered=True)
+    return df.sort_values(["step", "weeks", "stage"], ascending=[False, True, True]).reset_index(drop=True)
+
+def _run_name(r: dict) -> str:
+    return r.get("label") or f"{r['timestamp']} ({r.get('git_rev') or 'no git'})"
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the forecasting pipeline over grid sizes and weeks.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="Benchmark every stage and append the results to the history")
+    r.add_argument("--steps", default="0.5,0.25,0.1", help="Comma-separated coastal_grid steps (0.5 .. 0.05)")
+    r.add_argument("--weeks", default="12,24", help="Comma-separated week counts (>= 10 for the price lags)")
+    r.add_argument("--repeats", type=int, default=1, help="Timed runs per stage (best is kept)")
+    r.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run")
+    r.add_argument("--label", default=None, help="Name for this run, e.g. a release tag")
+    r.add_argument("--history", default=HISTORY_PATH)
+    c = sub.add_parser("compare", help="Compare two runs from the history and flag regressions")
+    c.add_argument("--base", default="-2", help="Run index or label (default: previous run)")
+    c.add_argument("--head", default="-1", help="Run index or label (default: latest run)")
+    c.add_argument("--threshold", type=float, default=0.15, help="Relative slowdown / memory growth that counts")
+    c.add_argument("--min-seconds", type=float, default=0.05)
+    c.add_argument("--history", default=HISTORY_PATH)
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        steps = [float(s) for s in args.steps.split(",") if s.strip()]
+        weeks = [int(w) for w in args.weeks.split(",") if w.strip()]
+        if min(weeks) < 10:
+            raise SystemExit("--weeks must be >= 10 so the price features have a full lag window")
+        record = run(steps, weeks, args.repeats, not args.no_memory, args.label)
+        append_history(record, args.history)
+        print(f"Appended run {_run_name(record)} -> {args.history}")
+        return
+
+    history = read_history(args.history)
+    if len(history) < 2 and (args.base, args.head) == ("-2", "-1"):
+        raise SystemExit(f"Need two runs in {args.history} to compare")
+    base, head = _pick(history, args.base), _pick(history, args.head)
+    df = compare(base, head, args.threshold, args.min_seconds)
+    print(f"base: {_run_name(base)}\nhead: {_run_name(head)}\n")
+    print(f"{'step':>6s}{'weeks':>6s}  {'stage':30s}{'base s':>9s}{'head s':>9s}{'x time':>8s}{'x mem':>8s}")
+    for row in df.itertuples():
+        print(f"{row.step:6.2f}{row.weeks:6d}  {row.stage:30s}{row.seconds_base:9.3f}{row.seconds_head:9.3f}"
+              f"{row.time_ratio:8.2f}{row.mem_ratio:8.2f}  {'REGRESSION: ' + row.regression if row.regression else ''}")
+    n_bad = int((df["regression"] != "").sum())
+    if n_bad:
+        print(f"\n{n_bad} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1)
+    print("\nNo regressions.")
+
+if __name__ == "__main__":
+    main()
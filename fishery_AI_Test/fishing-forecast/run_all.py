@@ -1,5 +1,9 @@
-# Convenience script: generate synthetic data, then train model
-import subprocess, sys
-subprocess.check_call([sys.executable, "src/data_gen.py"])
-subprocess.check_call([sys.executable, "src/train.py"])
+# Convenience script: run the stale stages of the pipeline (synthetic data, hotspot model,
+# GeoJSON export, price features + models per species). Extra arguments go to src.pipeline,
+# e.g. --dry-run, --only price_train, --from train, --no-synth.
+# (FF_TRACE=outputs/trace.json records per-stage timings; a summary is printed at the end)
+import os, subprocess, sys
+subprocess.check_call([sys.executable, "-m", "src.pipeline", *sys.argv[1:]])
+if os.environ.get("FF_TRACE"):
+    subprocess.check_call([sys.executable, "-m", "src.instrument", os.environ["FF_TRACE"]])
 print("\nDone. Launch the app with:  streamlit run app/App.py\n")
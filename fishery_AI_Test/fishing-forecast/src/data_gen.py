@@ -1,11 +1,22 @@
 """Synthetic weekly SST/Chl features + hotspot labels for demo.
 This lets you run end-to-end without external data.
+
+Fields are generated as whole (week x cell) arrays and streamed to parquet in
+week chunks (one row group per week), so multi-year runs on fine grids keep a
+bounded memory footprint. Every week draws from its own seeded
+``numpy.random.Generator``, so output is reproducible for a given seed no
+matter how the weeks are chunked.
 """
+import argparse
+import shutil
 import numpy as np
 import pandas as pd
-from datetime import date, timedelta
-from src.grid import coastal_grid
-from src.features import build_weekly_features
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src import isoweek
+from src.grid import GRID_PATH, GridIndex
+from src.features import PREV_STATE_PATH, STATE_PATH, AnomalyState, partition_dir, week_months
+from src.instrument import file_bytes, stage
 
 from pathlib import Path
 Path("data/processed").mkdir(parents=True, exist_ok=True)
@@ -14,67 +25,145 @@ Path("data/processed").mkdir(parents=True, exist_ok=True)
 FEATURES_OUT = "data/processed/features.parquet"
 LABELS_OUT   = "data/processed/labels.parquet"
 
+FEATURES_SCHEMA = pa.schema([
+    ("week", pa.string()), ("cell_id", pa.int32()), ("lat", pa.float64()), ("lon", pa.float64()),
+    ("sst", pa.float64()), ("chl", pa.float64()), ("sst_anom", pa.float64()),
+    ("month", pa.int64()),
+])
+LABELS_SCHEMA = pa.schema([
+    ("week", pa.string()), ("cell_id", pa.int32()), ("lat", pa.float64()), ("lon", pa.float64()),
+    ("hotspot", pa.int64()),
+])
+
 def iso_weeks(start="2024-05-01", end="2024-10-01"):
-    d0 = pd.to_datetime(start).date()
-    d1 = pd.to_datetime(end).date()
-    # Mondays only
-    cur = d0 - timedelta(days=d0.weekday())
-    weeks = []
-    while cur <= d1:
-        weeks.append(f"{cur.isocalendar().year}-W{cur.isocalendar().week:02d}")
-        cur += timedelta(days=7)
-    return sorted(list(dict.fromkeys(weeks)))
-
-def synth_env(grid_df: pd.DataFrame, weeks: list[int]) -> tuple[pd.DataFrame, pd.DataFrame]:
-    """Create synthetic SST and Chl fields varying by lat/lon and season."""
-    rows_sst, rows_chl = [], []
-    for w in weeks:
-        # seasonal driver: warmest around W30
-        wknum = int(w.split("-W")[1])
-        season = np.cos((wknum-30)/12.0)  # rough seasonal variation
-        for la, lo in zip(grid_df["lat"].values, grid_df["lon"].values):
-            # Base fields: SST colder in south, warmer in north; offshore slightly warmer
-            sst = 16.0 + 0.25*(la + 18) + 0.4*(lo + 82) + 1.5*season + np.random.normal(0, 0.4)
-            # Chlorophyll: higher near coast (smaller lon), higher in south (upwelling proxy)
-            chl = 1.5 + 0.05*(18 + la) + 0.15*( - (lo + 82)) + 0.3*(-season) + np.random.normal(0, 0.1)
-            rows_sst.append((w, la, lo, float(sst)))
-            rows_chl.append((w, la, lo, max(0.01, float(chl))))
-    sst_df = pd.DataFrame(rows_sst, columns=["week","lat","lon","value"])
-    chl_df = pd.DataFrame(rows_chl, columns=["week","lat","lon","value"])
+    # every ISO week touching [start, end], as consecutive calendar indices
+    i0, i1 = isoweek.from_dates([start, end])
+    return isoweek.to_str(np.arange(i0, i1 + 1)).tolist()
+
+def week_rngs(weeks: list[str], seed: int) -> list[np.random.Generator]:
+    """One generator per week keyed on (seed, year, week), so a week's draws do not
+    depend on how the range is chunked (or on being generated alone, as src.update does)."""
+    idx = isoweek.to_index(weeks)
+    return [np.random.default_rng([seed, int(y), int(w)])
+            for y, w in zip(isoweek.iso_year(idx), isoweek.week_of_year(idx))]
+
+def synth_fields(lat: np.ndarray, lon: np.ndarray, weeks: list[str],
+                 rngs: list[np.random.Generator]) -> tuple[np.ndarray, np.ndarray]:
+    """Synthetic SST and Chl as (n_weeks, n_cells) arrays."""
+    wknum = isoweek.week_of_year(isoweek.to_index(weeks)).astype(float)
+    season = np.cos((wknum - 30) / 12.0)[:, None]  # rough seasonal variation, warmest around W30
+    noise = np.stack([r.normal(0.0, 1.0, size=(2, lat.size)) for r in rngs], axis=1)
+    # Base fields: SST colder in south, warmer in north; offshore slightly warmer
+    sst = 16.0 + 0.25*(lat + 18) + 0.4*(lon + 82) + 1.5*season + 0.4*noise[0]
+    # Chlorophyll: higher near coast (smaller lon), higher in south (upwelling proxy)
+    chl = 1.5 + 0.05*(18 + lat) + 0.15*(-(lon + 82)) + 0.3*(-season) + 0.1*noise[1]
+    return sst, np.maximum(0.01, chl)
+
+def synth_env(grid_df: pd.DataFrame, weeks: list[str], seed: int = 0) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Create synthetic SST and Chl fields varying by lat/lon and season.
+    Returns long-format [week, lat, lon, value] frames for build_weekly_features.
+    """
+    lat = grid_df["lat"].to_numpy(dtype=float)
+    lon = grid_df["lon"].to_numpy(dtype=float)
+    sst, chl = synth_fields(lat, lon, weeks, week_rngs(weeks, seed))
+    keys = {
+        "week": np.repeat(np.asarray(weeks, dtype=object), lat.size),
+        "lat": np.tile(lat, len(weeks)),
+        "lon": np.tile(lon, len(weeks)),
+    }
+    sst_df = pd.DataFrame({**keys, "value": sst.ravel()})
+    chl_df = pd.DataFrame({**keys, "value": chl.ravel()})
     return sst_df, chl_df
 
-def synth_labels(feats: pd.DataFrame) -> pd.DataFrame:
+def _suitability(sst: np.ndarray, chl: np.ndarray, sst_anom: np.ndarray, jitter: np.ndarray) -> np.ndarray:
+    # A smooth suitability function: fish prefer SST ~18-21C, Chl ~1.0-2.0, positive anomaly
+    sst_pref = np.exp(-((sst - 19.5)/2.0)**2)
+    chl_pref = np.exp(-((chl - 1.4)/0.6)**2)
+    anom_boost = 0.5 * (sst_anom > 0)
+    return 0.5*sst_pref + 0.4*chl_pref + 0.1*anom_boost + 0.05*jitter
+
+def synth_labels(feats: pd.DataFrame, seed: int = 0) -> pd.DataFrame:
     """Create synthetic hotspot labels: fish prefer SST ~18-21C, Chl ~1.0-2.0, positive anomaly."""
-    df = feats.copy()
-    # A smooth suitability function
-    sst_pref = np.exp(-((df["sst"] - 19.5)/2.0)**2)
-    chl_pref = np.exp(-((df["chl"] - 1.4)/0.6)**2)
-    anom_boost = 0.5 * (df["sst_anom"] > 0).astype(float)
-    raw = 0.5*sst_pref + 0.4*chl_pref + 0.1*anom_boost + 0.05*np.random.rand(len(df))
+    rng = np.random.default_rng(seed)
+    raw = pd.Series(_suitability(feats["sst"].to_numpy(), feats["chl"].to_numpy(),
+                                 feats["sst_anom"].to_numpy(), rng.random(len(feats))),
+                    index=feats.index)
     # Threshold top 30% per week as hotspots
-    labels = []
-    for w, g in df.groupby("week"):
-        thr = np.quantile(raw[g.index], 0.7)
-        hot = (raw[g.index] >= thr).astype(int)
-        labels.append(pd.DataFrame({
-            "week": g["week"].values,
-            "lat": g["lat"].values,
-            "lon": g["lon"].values,
-            "hotspot": hot
-        }))
-    labels_df = pd.concat(labels, ignore_index=True)
-    return labels_df
+    thr = raw.groupby(feats["week"]).transform("quantile", 0.7)
+    return pd.DataFrame({
+        "week": feats["week"].to_numpy(),
+        "lat": feats["lat"].to_numpy(),
+        "lon": feats["lon"].to_numpy(),
+        "hotspot": (raw >= thr).astype(int).to_numpy(),
+    })
+
+def generate(grid: GridIndex, weeks: list[str], features_out: str = FEATURES_OUT,
+             labels_out: str = LABELS_OUT, seed: int = 0, chunk_weeks: int = 8,
+             state_out: str | None = STATE_PATH) -> tuple[int, int]:
+    """Stream synthetic features + labels to parquet, `chunk_weeks` weeks at a time.
+    Peak memory is O(chunk_weeks x n_cells) regardless of how many weeks are requested.
+    The final SST anomaly window is saved to `state_out` for incremental appends.
+    Returns (feature rows, label rows) written.
+    """
+    if chunk_weeks < 1:
+        raise ValueError(f"chunk_weeks must be >= 1, got {chunk_weeks}")
+    lat, lon = grid.lat, grid.lon
+    n = grid.n_cells
+    cell_id = np.arange(n, dtype=np.int32)
+    state = AnomalyState.empty(n)
+    rows = 0
+    with stage("data_gen.generate") as st:
+        with pq.ParquetWriter(features_out, FEATURES_SCHEMA) as fw, pq.ParquetWriter(labels_out, LABELS_SCHEMA) as lw:
+            for i in range(0, len(weeks), chunk_weeks):
+                chunk = weeks[i:i + chunk_weeks]
+                with stage("data_gen.fields", rows_out=len(chunk) * n):
+                    rngs = week_rngs(chunk, seed)
+                    sst, chl = synth_fields(lat, lon, chunk, rngs)
+                    sst_anom = state.update(chunk, sst)
+                    jitter = np.stack([r.random(n) for r in rngs])
+                    raw = _suitability(sst, chl, sst_anom, jitter)
+                    hot = (raw >= np.quantile(raw, 0.7, axis=1, keepdims=True)).astype(np.int64)
+
+                with stage("data_gen.write", rows_in=len(chunk) * n):
+                    keys = {
+                        "week": pa.array(np.repeat(np.asarray(chunk, dtype=object), n), pa.string()),
+                        "cell_id": np.tile(cell_id, len(chunk)),
+                        "lat": np.tile(lat, len(chunk)),
+                        "lon": np.tile(lon, len(chunk)),
+                    }
+                    fw.write_table(pa.table({
+                        **keys, "sst": sst.ravel(), "chl": chl.ravel(), "sst_anom": sst_anom.ravel(),
+                        "month": np.repeat(week_months(chunk), n),
+                    }, schema=FEATURES_SCHEMA), row_group_size=n)
+                    lw.write_table(pa.table({**keys, "hotspot": hot.ravel()}, schema=LABELS_SCHEMA),
+                                   row_group_size=n)
+                rows += len(chunk) * n
+        st.add(rows_out=2 * rows, bytes_written=lambda: file_bytes(features_out, labels_out))
+    if state_out:
+        state.save(state_out)
+        Path(PREV_STATE_PATH).unlink(missing_ok=True)
+    # a regenerated history supersedes weeks appended by src.update
+    shutil.rmtree(partition_dir(features_out), ignore_errors=True)
+    return rows, rows
 
 def main():
-    grid = coastal_grid(step=0.5)  # coarser grid for demo speed
-    weeks = iso_weeks("2024-05-01", "2024-10-01")
-    sst_df, chl_df = synth_env(grid, weeks)
-    feats = build_weekly_features(sst_df, chl_df)
-    feats.to_parquet(FEATURES_OUT, index=False)
-    labels = synth_labels(feats)
-    labels.to_parquet(LABELS_OUT, index=False)
-    print(f"Wrote features -> {FEATURES_OUT}  rows={len(feats)}")
-    print(f"Wrote labels   -> {LABELS_OUT}  rows={len(labels)}")
+    ap = argparse.ArgumentParser(description="Generate synthetic weekly features + hotspot labels.")
+    ap.add_argument("--start", default="2024-05-01")
+    ap.add_argument("--end", default="2024-10-01")
+    ap.add_argument("--step", type=float, default=0.5, help="Grid step in degrees (coarser = faster demo)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--chunk-weeks", type=int, default=8, help="Weeks generated per streamed chunk")
+    args = ap.parse_args()
+    if args.chunk_weeks < 1:
+        ap.error("--chunk-weeks must be >= 1")
+
+    grid = GridIndex.build(step=args.step)
+    grid.save(GRID_PATH)
+    weeks = iso_weeks(args.start, args.end)
+    n_feats, n_labels = generate(grid, weeks, FEATURES_OUT, LABELS_OUT,
+                                 seed=args.seed, chunk_weeks=args.chunk_weeks)
+    print(f"Wrote features -> {FEATURES_OUT}  rows={n_feats}")
+    print(f"Wrote labels   -> {LABELS_OUT}  rows={n_labels}")
 
 if __name__ == "__main__":
     main()
@@ -2,71 +2,174 @@
 import os
 import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import joblib
 
-FEATURES_PATH = "data/processed/features.parquet"
-MODEL_PATH = "models/hotspot_xgb.pkl"
+from src import isoweek
+from src.features import FEATURES_PATH
+from src.grid import load_grid
+from src.instrument import file_bytes, stage
+from src.predictions import load_predictions
+from src.score import PORTS, port_distances, port_ranking
+from src.tiles import build_pyramid, grid_spec, tile_paths, write_tiles
 
-# Approx coastline (lon at given lats) for a quick land mask
-_LATS = np.array([-18.0, -15.0, -12.0, -9.0, -6.0, -3.0])
-_LONS = np.array([-72.5, -75.0, -77.2, -78.5, -80.0, -80.9])
+# One Feature per cell, same layout json.dump produces with default separators
+_FEATURE_TMPL = '{{"type": "Feature", "geometry": {{"type": "Point", "coordinates": [{!r}, {!r}]}}, "properties": {{"p": {!r}}}}}'
+_CHUNK = 50_000  # features formatted per write
+RANK_K = 10      # cells per ranked list (the API's Top-10)
 
 def df_to_fc(df: pd.DataFrame) -> dict:
-    feats = []
-    for _, r in df.iterrows():
-        feats.append({
-            "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [float(r["lon"]), float(r["lat"])]},
-            "properties": {"p": float(r["p"])}
-        })
+    lon, lat, p = (df[c].astype(float).tolist() for c in ("lon", "lat", "p"))
+    feats = [{
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [x, y]},
+        "properties": {"p": v}
+    } for x, y, v in zip(lon, lat, p)]
     return {"type": "FeatureCollection", "features": feats}
 
-def export_week(week: str, out_dir: str):
-    feats = pd.read_parquet(FEATURES_PATH)
-    model = joblib.load(MODEL_PATH)
+def write_fc(path: Path, lon: np.ndarray, lat: np.ndarray, p: np.ndarray) -> None:
+    """Stream a Point FeatureCollection to disk in chunks, without building dicts."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"type": "FeatureCollection", "features": [')
+        for i in range(0, len(p), _CHUNK):
+            if i:
+                f.write(", ")
+            f.write(", ".join(map(_FEATURE_TMPL.format,
+                                  lon[i:i + _CHUNK].tolist(), lat[i:i + _CHUNK].tolist(), p[i:i + _CHUNK].tolist())))
+        f.write("]}")
 
-    dfw = feats[feats["week"] == week].copy()
-    if dfw.empty:
-        raise SystemExit(f"No features for {week}. Try one between your generated range (e.g., 2024-W19 .. 2024-W40).")
+def ranked_path(out_dir, week: str, port: str) -> Path:
+    return Path(out_dir) / "ranked" / week / f"{port}.json"
 
-    # land mask: keep ocean-side only
-    cut = np.interp(dfw["lat"].to_numpy(), _LATS, _LONS)
-    dfw = dfw[dfw["lon"].to_numpy() < cut].copy()
-    if dfw.empty:
-        raise SystemExit("All cells masked as land—adjust the coastline arrays if needed.")
+def write_ranked(path, week: str, port: str, port_ll: tuple[float, float], lon: np.ndarray,
+                 lat: np.ndarray, p: np.ndarray, dist: np.ndarray, k: int = RANK_K) -> int:
+    """One (week, port) file for the API: the cells that can reach the top k for some
+    λ >= 0, by p descending with their distance (km) to the port, and the top k (as
+    row indices) for the default λs. Returns the number of rows kept."""
+    rows, top = port_ranking(p, dist, k)
+    doc = {
+        "week": week, "port": port, "port_lat": port_ll[0], "port_lon": port_ll[1], "k": k,
+        "cells": int(p.size), "columns": ["lat", "lon", "p", "dist_km"],
+        "rows": np.column_stack([lat[rows], lon[rows], p[rows], dist[rows]]).tolist(),
+        "top": {lam: t.tolist() for lam, t in top.items()},
+    }
+    Path(path).write_text(json.dumps(doc, separators=(",", ":")))
+    return int(rows.size)
 
-    # predict p
-    dfw["p"] = model.predict_proba(dfw[["sst", "chl", "sst_anom", "month"]])[:, 1].clip(0, 1)
+_port_dist: np.ndarray | None = None  # (ports, n_cells), set once per writer process
 
-    # write GeoJSON
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
+def _init_writer(port_dist: np.ndarray | None) -> None:
+    global _port_dist
+    _port_dist = port_dist
+
+def _write_week(job: tuple) -> str:
+    week, out_dir, lon, lat, p, spec, ids = job
     out_path = Path(out_dir) / f"{week}.geojson"
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(df_to_fc(dfw), f)
-    print(f"Wrote {out_path}  (features: {len(dfw)})")
+    write_fc(out_path, lon, lat, p)
+    msg = f"Wrote {out_path}  (features: {len(p)})"
+    if spec is not None:
+        levels = build_pyramid(spec, lat, lon, p)
+        header, blob = tile_paths(out_dir, week)
+        write_tiles(header, blob, week, levels)
+        msg += f" + {blob.name} ({len(levels)} levels)"
+    if ids is not None:
+        (Path(out_dir) / "ranked" / week).mkdir(parents=True, exist_ok=True)
+        kept = [write_ranked(ranked_path(out_dir, week, port), week, port, ll, lon, lat, p, d[ids])
+                for (port, ll), d in zip(PORTS.items(), _port_dist)]
+        msg += f" + ranked lists for {len(kept)} ports ({max(kept)} rows max)"
+    return msg
+
+def export_weeks(weeks: list[str] | None, out_dir: str, workers: int | None = None,
+                 tiles: bool = False, ranked: bool = False) -> list[str]:
+    """Export several weeks in one pass from the prediction store (refreshed first if
+    stale), then write per-week files across a process pool.
+    weeks=None exports every week in the features table. With tiles, each week also
+    gets a zoom-level pyramid (src.tiles) next to its GeoJSON; with ranked, a
+    pre-ranked list per port (ranked/<week>/<port>.json). Returns the weeks written.
+    """
+    with stage("export.load_predictions") as st:
+        preds = load_predictions(weeks)
+        st.add(rows_out=len(preds))
+    if preds.empty:
+        raise SystemExit(f"No features for {weeks}. Try one between your generated range (e.g., 2024-W19 .. 2024-W40).")
+    if weeks is not None:
+        missing = sorted(set(weeks) - set(preds["week"].unique()))
+        if missing:
+            print(f"Skipping weeks with no features: {', '.join(missing)}")
+
+    # land mask: keep ocean-side only (precomputed in the grid index)
+    grid = load_grid()
+    preds = preds[grid.ocean[preds["cell_id"].to_numpy()]]
+    if preds.empty:
+        raise SystemExit("All cells masked as land—adjust the coastline arrays if needed.")
+
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    # split rows by week once: stable sort on the calendar categorical codes
+    cat = isoweek.categorical(preds["week"])
+    order = np.argsort(cat.codes, kind="stable")
+    codes, ids = cat.codes[order], preds["cell_id"].to_numpy()[order]
+    lon, lat, p = grid.lon[ids], grid.lat[ids], preds["p"].to_numpy(dtype=float)[order]
+    present = np.unique(codes)
+    bounds = np.append(np.searchsorted(codes, present), len(codes))
+    spec = grid_spec(grid) if tiles else None
+    # distances depend on the cell only: ship the cached (ports, cells) matrix once per writer
+    port_dist = port_distances(grid) if ranked else None
+    jobs = [(cat.categories[c], out_dir, lon[a:b], lat[a:b], p[a:b], spec,
+             ids[a:b] if ranked else None)
+            for c, a, b in zip(present, bounds[:-1], bounds[1:])]
+
+    workers = min(len(jobs), workers or os.cpu_count() or 1)
+    with stage("export.write", rows_in=len(p)) as st:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_writer,
+                                     initargs=(port_dist,)) as pool:
+                for msg in pool.map(_write_week, jobs):
+                    print(msg)
+        else:
+            _init_writer(port_dist)
+            for job in jobs:
+                print(_write_week(job))
+        def written():
+            paths = [Path(out_dir) / f"{j[0]}.geojson" for j in jobs]
+            if tiles:
+                paths += [path for j in jobs for path in tile_paths(out_dir, j[0])]
+            if ranked:
+                paths += [ranked_path(out_dir, j[0], port) for j in jobs for port in PORTS]
+            return file_bytes(*paths)
+        st.add(bytes_written=written)
+    return [j[0] for j in jobs]
+
+def export_week(week: str, out_dir: str):
+    export_weeks([week], out_dir, workers=1)
 
 def main():
     ap = argparse.ArgumentParser(description="Export weekly predictions to GeoJSON for Next.js public/predictions.")
     ap.add_argument("--week", help="ISO week like 2024-W30")
     ap.add_argument("--weeks", help="Comma-separated ISO weeks (e.g. 2024-W30,2024-W31)")
+    ap.add_argument("--all-weeks", action="store_true", help=f"Export every week in {FEATURES_PATH}")
+    ap.add_argument("--workers", type=int, default=None, help="Parallel file writers (default: CPU count)")
+    ap.add_argument("--tiles", action="store_true",
+                    help="Also write <week>.tiles.json/.bin zoom pyramids (max/mean p per tile)")
+    ap.add_argument("--ranked", action="store_true",
+                    help="Also write ranked/<week>/<port>.json pre-ranked lists for the API")
     ap.add_argument("--out", required=True, help="Output folder (e.g., ../your-next-app/public/predictions)")
     args = ap.parse_args()
 
-    if not args.week and not args.weeks:
-        raise SystemExit("Provide --week or --weeks")
+    if not args.week and not args.weeks and not args.all_weeks:
+        raise SystemExit("Provide --week, --weeks or --all-weeks")
 
-    weeks = []
-    if args.week:
-        weeks.append(args.week)
-    if args.weeks:
-        weeks.extend([w.strip() for w in args.weeks.split(",") if w.strip()])
+    weeks = None
+    if not args.all_weeks:
+        weeks = []
+        if args.week:
+            weeks.append(args.week)
+        if args.weeks:
+            weeks.extend([w.strip() for w in args.weeks.split(",") if w.strip()])
 
-    for w in weeks:
-        export_week(w, args.out)
+    export_weeks(weeks, args.out, workers=args.workers, tiles=args.tiles, ranked=args.ranked)
 
 if __name__ == "__main__":
     main()
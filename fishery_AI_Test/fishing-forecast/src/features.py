@@ -1,29 +1,168 @@
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 
-def _iso_week_to_month(week_str: str) -> int:
-    # Convert ISO week like '2024-W30' to a representative date -> month
-    # We pick Monday of that ISO week.
-    return pd.to_datetime(week_str + "-1", format="%G-W%V-%u").month
+from src import isoweek
+from src.instrument import file_bytes, stage
+
+FEATURES_PATH = "data/processed/features.parquet"
+ANOM_WINDOW = 8  # weeks in the SST rolling mean
+STATE_PATH = "data/processed/sst_state.npz"
+PREV_STATE_PATH = "data/processed/sst_state.prev.npz"  # state before the newest appended week
+
+def week_months(weeks) -> np.ndarray:
+    """Month of each ISO week string (Monday's month), from the calendar table."""
+    return isoweek.month(isoweek.to_index(weeks)).astype(np.int64)
+
+def rolling_anomaly(sst: np.ndarray, tail: np.ndarray | None = None,
+                    window: int = ANOM_WINDOW) -> tuple[np.ndarray, np.ndarray]:
+    """SST minus its trailing `window`-week mean along axis 0, per cell.
+    `sst` is a (weeks, cells) array; `tail` holds up to window-1 preceding weeks.
+    Like pandas' rolling(min_periods=1).mean(), NaNs are skipped.
+    Returns (anomaly, new tail).
+    """
+    if tail is None:
+        tail = np.empty((0, sst.shape[1]))
+    full = np.concatenate([tail, sst], axis=0)
+    ok = np.isfinite(full)
+    zero = np.zeros((1, full.shape[1]))
+    csum = np.concatenate([zero, np.cumsum(np.where(ok, full, 0.0), axis=0)], axis=0)
+    ccnt = np.concatenate([zero, np.cumsum(ok, axis=0)], axis=0)
+    end = np.arange(tail.shape[0], full.shape[0]) + 1
+    start = np.maximum(end - window, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (csum[end] - csum[start]) / (ccnt[end] - ccnt[start])
+    return sst - mean, full[max(full.shape[0] - (window - 1), 0):]
+
+class AnomalyState:
+    """Trailing per-cell SST window carried between weekly feature runs.
+    `tail` is a (<= window-1, n_cells) array indexed by cell_id.
+    """
+
+    def __init__(self, tail: np.ndarray, last_week: str | None = None, window: int = ANOM_WINDOW):
+        self.tail, self.last_week, self.window = tail, last_week, window
+
+    @classmethod
+    def empty(cls, n_cells: int, window: int = ANOM_WINDOW) -> "AnomalyState":
+        return cls(np.empty((0, n_cells)), None, window)
+
+    @classmethod
+    def from_features(cls, feats: pd.DataFrame, n_cells: int, window: int = ANOM_WINDOW) -> "AnomalyState":
+        """Seed the state from the last window-1 weeks of an existing features table (needs cell_id)."""
+        weeks = np.sort(feats["week"].unique())[-(window - 1):]
+        recent = feats[feats["week"].isin(weeks)]
+        tail = np.full((len(weeks), n_cells), np.nan)
+        tail[np.searchsorted(weeks, recent["week"].to_numpy()), recent["cell_id"].to_numpy()] = recent["sst"].to_numpy()
+        return cls(tail, weeks[-1] if len(weeks) else None, window)
+
+    def update(self, weeks: list[str], sst: np.ndarray) -> np.ndarray:
+        """Append consecutive `weeks` of (weeks, n_cells) SST; returns their anomalies.
+        Skipped weeks since the last update enter the window as missing values.
+        """
+        if self.last_week is not None:
+            gap = isoweek.weeks_between(self.last_week, weeks[0])
+            if gap < 1:
+                raise ValueError(f"{weeks[0]} is not after the last appended week {self.last_week}")
+            if gap > 1:
+                missing = np.full((min(gap - 1, self.window - 1), sst.shape[1]), np.nan)
+                self.tail = np.concatenate([self.tail, missing])[-(self.window - 1):]
+        anom, self.tail = rolling_anomaly(sst, self.tail, self.window)
+        self.last_week = weeks[-1]
+        return anom
+
+    def save(self, path: str = STATE_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, tail=self.tail, last_week=np.array(self.last_week or ""), window=self.window)
+
+    @classmethod
+    def load(cls, path: str = STATE_PATH) -> "AnomalyState":
+        with np.load(path) as z:
+            return cls(z["tail"], str(z["last_week"]) or None, int(z["window"]))
+
+def partition_dir(path: str = FEATURES_PATH) -> Path:
+    """Folder of one-parquet-per-week partitions appended after `path` (features_weeks/)."""
+    p = Path(path)
+    return p.parent / f"{p.stem}_weeks"
+
+def partition_path(week: str, path: str = FEATURES_PATH) -> Path:
+    return partition_dir(path) / f"{week}.parquet"
+
+def appended_weeks(path: str = FEATURES_PATH) -> list[str]:
+    d = partition_dir(path)
+    return sorted(f.stem for f in d.glob("*.parquet")) if d.exists() else []
+
+def load_features(weeks: list[str] | None = None, columns: list[str] | None = None,
+                  path: str = FEATURES_PATH) -> pd.DataFrame:
+    """Read the features table plus any appended week partitions, pushing the week
+    filter down to parquet row groups (and to partition file names)."""
+    filters = [("week", "in", list(weeks))] if weeks is not None else None
+    extra = appended_weeks(path)
+    if weeks is not None:
+        extra = sorted(set(extra).intersection(weeks))
+    paths = [path] + [partition_path(w, path) for w in extra]
+    with stage("features.load", bytes_read=lambda: file_bytes(*paths)) as st:
+        df = pd.read_parquet(path, columns=columns, filters=filters)
+        if extra:
+            parts = [pd.read_parquet(p, columns=columns) for p in paths[1:]]
+            df = pd.concat([df, *parts], ignore_index=True)
+        st.add(rows_out=len(df))
+    return df
 
 def build_weekly_features(sst_df: pd.DataFrame, chl_df: pd.DataFrame) -> pd.DataFrame:
     """Combine SST and Chl to a weekly feature table.
-    Inputs require columns: [week, lat, lon, value].
-    Returns columns: [week, lat, lon, sst, chl, sst_anom, month].
+    Inputs require columns: [week, lat, lon, value] (plus cell_id, used as join key when present).
+    Returns columns: [week, lat, lon, sst, chl, sst_anom, month] (plus cell_id).
     """
-    sst = sst_df.rename(columns={"value":"sst"})
-    chl = chl_df.rename(columns={"value":"chl"})
-    df = sst.merge(chl, on=["week","lat","lon"], how="inner")
-    # Month from ISO week
-    df["month"] = df["week"].apply(_iso_week_to_month)
-    # SST anomaly: subtract 8-week rolling mean per cell
-    df = df.sort_values(["lat","lon","week"]).reset_index(drop=True)
-    df["week_dt"] = pd.to_datetime(df["week"] + "-1", format="%G-W%V-%u")
-    df["sst_anom"] = (df
-        .groupby(["lat","lon"], group_keys=False)
-        .apply(lambda g: g.assign(sst_anom=g["sst"] - g["sst"].rolling(window=8, min_periods=1).mean()))
-        ["sst_anom"]
-    )
-    # Clean up
-    df = df.drop(columns=["week_dt"]).dropna(subset=["sst","chl"]).reset_index(drop=True)
-    return df[["week","lat","lon","sst","chl","sst_anom","month"]]
+    with stage("features.build_weekly", rows_in=len(sst_df) + len(chl_df)) as st:
+        keys = ["cell_id"] if "cell_id" in sst_df.columns and "cell_id" in chl_df.columns else ["lat","lon"]
+        sst = sst_df.rename(columns={"value":"sst"})
+        chl = chl_df.rename(columns={"value":"chl"})[["week"] + keys + ["chl"]]
+        df = sst.merge(chl, on=["week"] + keys, how="inner")
+        # Month from ISO week
+        df["month"] = week_months(df["week"])
+        # SST anomaly: subtract 8-week rolling mean per cell, over a dense (week x cell) array
+        # whose rows are consecutive calendar weeks (missing weeks stay NaN, as in AnomalyState)
+        df = df.sort_values(["week"] + keys).reset_index(drop=True)
+        wcode = isoweek.to_index(df["week"])
+        wcode = wcode - (wcode.min() if len(df) else 0)
+        ccode = df.groupby(keys, sort=False).ngroup().to_numpy()
+        arr = np.full((wcode.max() + 1 if len(df) else 0, ccode.max() + 1 if len(df) else 0), np.nan)
+        arr[wcode, ccode] = df["sst"].to_numpy()
+        anom, _ = rolling_anomaly(arr)
+        df["sst_anom"] = anom[wcode, ccode]
+        # Clean up
+        df = df.dropna(subset=["sst","chl"]).reset_index(drop=True)
+        cols = ["week","cell_id","lat","lon","sst","chl","sst_anom","month"]
+        st.add(rows_out=len(df))
+    return df[[c for c in cols if c in df.columns]]
+
+def append_week_features(state: AnomalyState, week: str, sst_df: pd.DataFrame,
+                         chl_df: pd.DataFrame, grid) -> pd.DataFrame:
+    """Incremental mode: features for one new week, advancing `state` in place.
+    Cost is O(grid cells) whatever the history length. Inputs are [lat, lon, value]
+    (or cell_id, value) rows for `week`; `grid` is the GridIndex the state is aligned to.
+    """
+    n = grid.n_cells
+    fields = {}
+    for name, src in (("sst", sst_df), ("chl", chl_df)):
+        if "week" in src.columns:
+            src = src[src["week"] == week]
+        src = grid.attach(src)
+        src = src[src["cell_id"] >= 0]
+        vec = np.full(n, np.nan)
+        vec[src["cell_id"].to_numpy()] = src["value"].to_numpy()
+        fields[name] = vec
+    return append_week_fields(state, week, fields["sst"], fields["chl"], grid)
+
+def append_week_fields(state: AnomalyState, week: str, sst: np.ndarray, chl: np.ndarray,
+                       grid) -> pd.DataFrame:
+    """append_week_features for fields already on the grid: (n_cells,) SST and Chl
+    vectors indexed by cell_id, NaN where missing. Rows are the cells with both."""
+    anom = state.update([week], sst[None, :])[0]
+    ids = np.flatnonzero(np.isfinite(sst) & np.isfinite(chl)).astype(np.int32)
+    return pd.DataFrame({
+        "week": week, "cell_id": ids, "lat": grid.lat[ids], "lon": grid.lon[ids],
+        "sst": sst[ids], "chl": chl[ids], "sst_anom": anom[ids],
+        "month": week_months([week])[0],
+    })
@@ -1,6 +1,15 @@
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
 
+GRID_PATH = "data/processed/grid.npz"
+EARTH_R_KM = 6371.0
+
+# Approx coastline (lon at given lats) for a quick land mask
+COAST_LATS = np.array([-18.0, -15.0, -12.0, -9.0, -6.0, -3.0])
+COAST_LONS = np.array([-72.5, -75.0, -77.2, -78.5, -80.0, -80.9])
+
 def coastal_grid(lat_min: float=-18.0, lat_max: float=-3.0,
                  lon_min: float=-86.0, lon_max: float=-70.0,   # was -84 to -70
                  step: float=0.25,
@@ -11,9 +20,151 @@ def coastal_grid(lat_min: float=-18.0, lat_max: float=-3.0,
     """
     lats = np.arange(lat_min, lat_max + 1e-9, step)
     lons = np.arange(lon_min, lon_max + 1e-9, step)
-    cells = []
-    for la in lats:
-        for lo in lons:
-            if coast_lon_band[0] <= lo <= coast_lon_band[1]:
-                cells.append((round(float(la), 6), round(float(lo), 6)))
-    return pd.DataFrame(cells, columns=["lat", "lon"])
+    la, lo = np.meshgrid(lats, lons, indexing="ij")
+    keep = (lo >= coast_lon_band[0] - 1e-9) & (lo <= coast_lon_band[1] + 1e-9)  # tolerate arange drift
+    return pd.DataFrame({"lat": np.round(la[keep], 6), "lon": np.round(lo[keep], 6)})
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    R = EARTH_R_KM
+    p1 = np.radians(lat1)
+    p2 = np.radians(lat2)
+    dlat = p2 - p1
+    dlon = np.radians(lon2 - lon1)
+    a = np.sin(dlat/2.0)**2 + np.cos(p1)*np.cos(p2)*np.sin(dlon/2.0)**2
+    return 2*R*np.arcsin(np.sqrt(a))
+
+def ocean_mask(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """True for points seaward of the approximate coastline."""
+    return np.asarray(lon) < np.interp(np.asarray(lat), COAST_LATS, COAST_LONS)
+
+class GridIndex:
+    """Regular lat/lon grid with stable int32 cell ids and a land mask.
+
+    Cell ids number the coastal-band cells of ``coastal_grid`` in the same
+    row-major (lat, lon) order, so ``cell_id`` is a positional index into
+    ``lat``, ``lon`` and ``ocean``. Lookups go through a dense raster of ids,
+    making lat/lon -> cell_id O(1) per point.
+    """
+
+    def __init__(self, lat_min: float, lon_min: float, step: float, n_lat: int, n_lon: int,
+                 coast_lon_band=(-84.5, -72.0), ocean: np.ndarray | None = None):
+        self.lat_min, self.lon_min, self.step = float(lat_min), float(lon_min), float(step)
+        self.n_lat, self.n_lon = int(n_lat), int(n_lon)
+        self.coast_lon_band = (float(coast_lon_band[0]), float(coast_lon_band[1]))
+
+        lons = self.lon_min + self.step * np.arange(self.n_lon)
+        in_band = (lons >= self.coast_lon_band[0] - 1e-9) & (lons <= self.coast_lon_band[1] + 1e-9)
+        self._raster = np.full((self.n_lat, self.n_lon), -1, dtype=np.int32)
+        self._raster[:, in_band] = np.arange(self.n_lat * int(in_band.sum()), dtype=np.int32).reshape(self.n_lat, -1)
+
+        ii, jj = np.nonzero(self._raster >= 0)
+        self.lat = np.round(self.lat_min + self.step * ii, 6)
+        self.lon = np.round(self.lon_min + self.step * jj, 6)
+        self.ocean = ocean_mask(self.lat, self.lon) if ocean is None else np.asarray(ocean, dtype=bool)
+        self._radius_cache: dict[tuple, np.ndarray] = {}
+
+    @classmethod
+    def build(cls, lat_min: float=-18.0, lat_max: float=-3.0,
+              lon_min: float=-86.0, lon_max: float=-70.0,
+              step: float=0.25, coast_lon_band=(-84.5, -72.0)) -> "GridIndex":
+        """Index over the same cells ``coastal_grid`` returns for these arguments."""
+        n_lat = len(np.arange(lat_min, lat_max + 1e-9, step))
+        n_lon = len(np.arange(lon_min, lon_max + 1e-9, step))
+        return cls(lat_min, lon_min, step, n_lat, n_lon, coast_lon_band)
+
+    @classmethod
+    def infer(cls, lat: np.ndarray, lon: np.ndarray) -> "GridIndex":
+        """Rebuild an index from the cell centers of an existing table (e.g. legacy features)."""
+        ulat, ulon = np.unique(np.round(lat, 6)), np.unique(np.round(lon, 6))
+        diffs = np.concatenate([np.diff(ulat), np.diff(ulon)])
+        step = float(np.round(diffs.min(), 6)) if diffs.size else 1.0
+        n_lat = int(round((ulat[-1] - ulat[0]) / step)) + 1
+        n_lon = int(round((ulon[-1] - ulon[0]) / step)) + 1
+        return cls(ulat[0], ulon[0], step, n_lat, n_lon, (ulon[0], ulon[-1]))
+
+    @property
+    def key(self) -> tuple:
+        """Hashable identity of the grid layout (for caches keyed per grid)."""
+        return (self.lat_min, self.lon_min, self.step, self.n_lat, self.n_lon, self.coast_lon_band)
+
+    @property
+    def n_cells(self) -> int:
+        return self.lat.size
+
+    @property
+    def ocean_ids(self) -> np.ndarray:
+        return np.flatnonzero(self.ocean).astype(np.int32)
+
+    def lookup(self, lat, lon) -> np.ndarray:
+        """Vectorized lat/lon -> cell_id (-1 for points off the grid)."""
+        fi = (np.asarray(lat, dtype=float) - self.lat_min) / self.step
+        fj = (np.asarray(lon, dtype=float) - self.lon_min) / self.step
+        i, j = np.rint(fi).astype(np.int64), np.rint(fj).astype(np.int64)
+        ok = (i >= 0) & (i < self.n_lat) & (j >= 0) & (j < self.n_lon) \
+            & (np.abs(fi - i) < 1e-3) & (np.abs(fj - j) < 1e-3)
+        out = np.full(i.shape, -1, dtype=np.int32)
+        out[ok] = self._raster[i[ok], j[ok]]
+        return out
+
+    def within(self, lat: float, lon: float, radius_km: float, ocean_only: bool = True) -> np.ndarray:
+        """Sorted cell_ids within radius_km of (lat, lon).
+        Only the raster window bounding the circle is visited, then filtered by exact
+        haversine distance; results are cached per (point, radius).
+        """
+        key = (float(lat), float(lon), float(radius_km), ocean_only)
+        if key in self._radius_cache:
+            return self._radius_cache[key]
+        dlat = np.degrees(radius_km / EARTH_R_KM)
+        widest = min(abs(lat) + dlat, 89.0)  # latitude where a degree of lon is shortest
+        dlon = np.degrees(radius_km / (EARTH_R_KM * np.cos(np.radians(widest))))
+        i0 = max(int(np.floor((lat - dlat - self.lat_min) / self.step)), 0)
+        i1 = min(int(np.ceil((lat + dlat - self.lat_min) / self.step)) + 1, self.n_lat)
+        j0 = max(int(np.floor((lon - dlon - self.lon_min) / self.step)), 0)
+        j1 = min(int(np.ceil((lon + dlon - self.lon_min) / self.step)) + 1, self.n_lon)
+        ids = self._raster[i0:i1, j0:j1].ravel() if i0 < i1 and j0 < j1 else np.empty(0, np.int32)
+        ids = ids[ids >= 0]
+        if ocean_only:
+            ids = ids[self.ocean[ids]]
+        ids = np.sort(ids[haversine_km(lat, lon, self.lat[ids], self.lon[ids]) <= radius_km])
+        self._radius_cache[key] = ids
+        return ids
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "cell_id": np.arange(self.n_cells, dtype=np.int32),
+            "lat": self.lat, "lon": self.lon, "ocean": self.ocean,
+        })
+
+    def attach(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Return df with an int32 cell_id column (looked up from lat/lon if absent)."""
+        if "cell_id" in df.columns:
+            return df
+        return df.assign(cell_id=self.lookup(df["lat"].to_numpy(), df["lon"].to_numpy()))
+
+    def ocean_rows(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Keep ocean-side cells only, using the stored land mask."""
+        df = self.attach(df)
+        ids = df["cell_id"].to_numpy()
+        keep = ids >= 0
+        keep[keep] = self.ocean[ids[keep]]
+        return df[keep]
+
+    def save(self, path: str = GRID_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, lat_min=self.lat_min, lon_min=self.lon_min, step=self.step,
+                 n_lat=self.n_lat, n_lon=self.n_lon,
+                 coast_lon_band=np.array(self.coast_lon_band), ocean=self.ocean)
+
+    @classmethod
+    def load(cls, path: str = GRID_PATH) -> "GridIndex":
+        with np.load(path) as z:
+            return cls(float(z["lat_min"]), float(z["lon_min"]), float(z["step"]),
+                       int(z["n_lat"]), int(z["n_lon"]), tuple(z["coast_lon_band"]), z["ocean"])
+
+def load_grid(path: str = GRID_PATH, df: pd.DataFrame | None = None) -> GridIndex:
+    """Load the persisted grid index, or infer one from df's lat/lon if none was saved."""
+    if Path(path).exists():
+        return GridIndex.load(path)
+    if df is None:
+        raise FileNotFoundError(f"Missing grid index {path}. Run data_gen.py first.")
+    return GridIndex.infer(df["lat"].to_numpy(), df["lon"].to_numpy())
@@ -0,0 +1,317 @@
+"""Gridded SST/Chl ingestion: regular lat/lon rasters -> coastal grid cells.
+
+    python -m src.gridded --sst sst.npy --chl chl.npz [--method area] [--weeks 2024-W19,2024-W20]
+
+Sources are (weeks, n_lat, n_lon) stacks opened through ``np.memmap``, so only the
+slab of each week that overlaps the coastal grid is ever read:
+
+- ``.npy``: memory-mapped directly;
+- ``.npz``: arrays ``lat``, ``lon``, ``weeks`` (or a scalar ``start_week``) and the
+  data array; members saved uncompressed (``np.savez``) are mapped in place,
+  compressed ones are read whole;
+- anything else: a raw C-order stack (float32 unless the sidecar says otherwise).
+
+``.npy`` and raw stacks describe their axes in a ``<file>.json`` sidecar::
+
+    {"lat": {"start": -20.0, "step": 0.04, "n": 500}, "lon": [-90.0, -89.96, ...],
+     "weeks": {"start": "2024-W19"}, "shape": [22, 500, 600], "dtype": "float32",
+     "fill_value": -999.0}
+
+(axes as center lists or start/step/n; ``shape``/``dtype`` for raw stacks only).
+
+Once per source grid, a sparse (cells x source pixels) matrix is built and cached
+under ``data/cache/regrid/``: ``nearest`` takes the pixel nearest each cell center,
+``area`` weights pixels by their overlap with the cell. Both are separable in lat
+and lon, so the matrix is the Kronecker product of two small per-axis matrices,
+cropped to the pixel window the coastal grid touches. Regridding a week is then one
+sparse product with the [values, valid] columns of that window, which also
+renormalizes the weights around missing (cloud/land) pixels.
+
+Weeks stream one at a time through the SST anomaly window into the features
+table, one row group per week, as data_gen does; labels are not touched.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy import sparse
+
+from src import isoweek
+from src.data_gen import FEATURES_SCHEMA
+from src.features import (FEATURES_PATH, PREV_STATE_PATH, STATE_PATH, AnomalyState,
+                          append_week_fields, partition_dir)
+from src.grid import GRID_PATH, GridIndex, load_grid
+from src.ingest import CACHE_DIR
+from src.instrument import file_bytes, stage
+
+REGRID_DIR = Path(CACHE_DIR) / "regrid"
+REGRID_VERSION = 1  # bump when the weights change, to invalidate cached matrices
+METHODS = ("nearest", "area")
+_AXIS_NAMES = ("lat", "lon", "weeks", "start_week")
+
+_regrids: dict[str, "Regrid"] = {}
+
+def is_gridded(path) -> bool:
+    """True for raster stacks (anything but the CSV/parquet row formats)."""
+    return Path(path).suffix not in (".csv", ".parquet")
+
+def _axis(spec) -> np.ndarray:
+    if isinstance(spec, dict):
+        return float(spec["start"]) + float(spec["step"]) * np.arange(int(spec["n"]))
+    return np.asarray(spec, dtype=float)
+
+def _weeks(spec, n: int) -> list[str]:
+    if isinstance(spec, dict):
+        return isoweek.to_str(isoweek.to_index(spec["start"]) + np.arange(n)).tolist()
+    weeks = [str(w) for w in spec]
+    isoweek.to_index(weeks)  # validates the labels
+    return weeks
+
+def _npz_member(path: Path, name: str) -> np.ndarray:
+    """Memory-map an uncompressed .npz member in place (read it whole if compressed)."""
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(f"{name}.npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(path) as z:
+            return z[name]
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        local = f.read(30)
+        if local[:4] != b"PK\x03\x04":
+            raise ValueError(f"{path}: bad zip entry for {name}")
+        f.seek(info.header_offset + 30 + int.from_bytes(local[26:28], "little")
+               + int.from_bytes(local[28:30], "little"))
+        version = np.lib.format.read_magic(f)
+        read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                       else np.lib.format.read_array_header_2_0)
+        shape, fortran, dtype = read_header(f)
+        offset = f.tell()
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran else "C")
+
+class GriddedSource:
+    """A (weeks, n_lat, n_lon) raster stack with its axes; `data` is memory-mapped."""
+
+    def __init__(self, data: np.ndarray, lat, lon, weeks: list[str], fill_value: float | None = None):
+        data = data[None] if data.ndim == 2 else data
+        self.lat, self.lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        if data.ndim != 3 or data.shape[1:] != (self.lat.size, self.lon.size):
+            raise ValueError(f"data shape {data.shape} does not match lat/lon axes ({self.lat.size}, {self.lon.size})")
+        if len(weeks) != data.shape[0]:
+            raise ValueError(f"{len(weeks)} week labels for {data.shape[0]} rasters")
+        if self.lat.size < 2 or self.lon.size < 2:
+            raise ValueError("need at least two pixels along each axis")
+        self.data, self.weeks, self.fill_value = data, list(weeks), fill_value
+        self._pos = {w: i for i, w in enumerate(self.weeks)}
+
+    @property
+    def key(self) -> str:
+        """Identity of the source grid (axes only), for the regrid cache."""
+        h = hashlib.sha1()
+        for a in (self.lat, self.lon):
+            h.update(np.ascontiguousarray(a, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    def window(self, week: str, rows: tuple[int, int], cols: tuple[int, int]) -> np.ndarray:
+        """One week's pixels in [rows) x [cols), as float64 with missing values as NaN."""
+        if week not in self._pos:
+            raise KeyError(f"{week} is not in the source ({self.weeks[0]} .. {self.weeks[-1]})")
+        x = np.array(self.data[self._pos[week], rows[0]:rows[1], cols[0]:cols[1]], dtype=np.float64)
+        if self.fill_value is not None:
+            x[x == self.fill_value] = np.nan
+        return x
+
+def open_source(path, var: str | None = None) -> GriddedSource:
+    """Open a .npy / .npz / raw stack (see module docstring) without reading its pixels."""
+    path = Path(path)
+    if path.suffix == ".npz":
+        with np.load(path) as z:
+            names = z.files
+            lat, lon = z["lat"], z["lon"]
+            meta = {"weeks": z["weeks"].astype(str).tolist() if "weeks" in names
+                    else {"start": str(z["start_week"])}}
+            if "fill_value" in names:
+                meta["fill_value"] = float(z["fill_value"])
+        var = var or next((n for n in names if n not in _AXIS_NAMES + ("fill_value",)), None)
+        if var is None:
+            raise ValueError(f"{path} has no data array besides its axes")
+        data = _npz_member(path, var)
+    else:
+        sidecar = Path(f"{path}.json")
+        if not sidecar.exists():
+            raise FileNotFoundError(f"Missing {sidecar} describing the lat/lon/weeks axes of {path}")
+        meta = json.loads(sidecar.read_text())
+        lat, lon = _axis(meta["lat"]), _axis(meta["lon"])
+        if path.suffix == ".npy":
+            data = np.load(path, mmap_mode="r")
+        else:
+            data = np.memmap(path, dtype=meta.get("dtype", "float32"), mode="r", shape=tuple(meta["shape"]))
+    n_weeks = data.shape[0] if data.ndim == 3 else 1
+    return GriddedSource(data, lat, lon, _weeks(meta["weeks"], n_weeks), meta.get("fill_value"))
+
+def _edges(centers: np.ndarray) -> np.ndarray:
+    mid = (centers[1:] + centers[:-1]) / 2
+    return np.concatenate([[2 * centers[0] - mid[0]], mid, [2 * centers[-1] - mid[-1]]])
+
+def _axis_weights(target: np.ndarray, step: float, centers: np.ndarray, method: str) -> sparse.csr_matrix:
+    """(len(target), len(centers)) weights along one axis; centers may be descending."""
+    order = np.argsort(centers, kind="stable")
+    c = centers[order]
+    e = _edges(c)
+    if method == "nearest":
+        k = np.clip(np.searchsorted(c, target), 1, c.size - 1)
+        k -= (target - c[k - 1]) <= (c[k] - target)
+        rows = np.flatnonzero((target >= e[0]) & (target <= e[-1]))
+        cols, w = k[rows], np.ones(rows.size)
+    else:
+        lo, hi = target - step / 2, target + step / 2
+        first = np.clip(np.searchsorted(e, lo, "right") - 1, 0, c.size)
+        stop = np.clip(np.searchsorted(e, hi, "left"), 0, c.size)
+        counts = np.maximum(stop - first, 0)
+        rows = np.repeat(np.arange(target.size), counts)
+        cols = first[rows] + np.arange(rows.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        w = np.minimum(hi[rows], e[cols + 1]) - np.maximum(lo[rows], e[cols])
+        keep = w > 0
+        rows, cols, w = rows[keep], cols[keep], w[keep]
+    return sparse.csr_matrix((w, (rows, order[cols])), shape=(target.size, centers.size))
+
+class Regrid:
+    """Sparse operator from a source pixel window to coastal grid cells."""
+
+    def __init__(self, matrix: sparse.csr_matrix, rows: tuple[int, int], cols: tuple[int, int]):
+        self.matrix, self.rows, self.cols = matrix, rows, cols
+
+    @classmethod
+    def build(cls, source: GriddedSource, grid: GridIndex, method: str = "nearest") -> "Regrid":
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}, got {method!r}")
+        a = _axis_weights(grid.lat_min + grid.step * np.arange(grid.n_lat), grid.step, source.lat, method)
+        b = _axis_weights(grid.lon_min + grid.step * np.arange(grid.n_lon), grid.step, source.lon, method)
+        # crop to the source rows/cols some cell draws from: only that slab is ever read
+        r, c = np.flatnonzero(a.getnnz(axis=0)), np.flatnonzero(b.getnnz(axis=0))
+        if not r.size or not c.size:
+            raise ValueError("The source raster does not overlap the coastal grid")
+        rows, cols = (int(r[0]), int(r[-1]) + 1), (int(c[0]), int(c[-1]) + 1)
+        full = sparse.kron(a[:, rows[0]:rows[1]], b[:, cols[0]:cols[1]], format="csr")
+        ii = np.rint((grid.lat - grid.lat_min) / grid.step).astype(np.int64)
+        jj = np.rint((grid.lon - grid.lon_min) / grid.step).astype(np.int64)
+        return cls(full[ii * grid.n_lon + jj], rows, cols)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.stem}.tmp.npz")
+        m = self.matrix
+        np.savez(tmp, data=m.data, indices=m.indices, indptr=m.indptr, shape=np.array(m.shape),
+                 window=np.array(self.rows + self.cols))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "Regrid":
+        with np.load(path) as z:
+            m = sparse.csr_matrix((z["data"], z["indices"], z["indptr"]), shape=tuple(z["shape"]))
+            r0, r1, c0, c1 = (int(v) for v in z["window"])
+        return cls(m, (r0, r1), (c0, c1))
+
+    def __call__(self, source: GriddedSource, week: str) -> np.ndarray:
+        """(n_cells,) regridded values for `week`; NaN where no valid pixel contributes."""
+        x = source.window(week, self.rows, self.cols).ravel()
+        ok = np.isfinite(x)
+        num, den = (self.matrix @ np.column_stack([np.where(ok, x, 0.0), ok])).T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return num / den
+
+def regridder(source: GriddedSource, grid: GridIndex, method: str = "nearest",
+              cache_dir: str | Path | None = REGRID_DIR) -> Regrid:
+    """The regrid operator for this (source grid, coastal grid, method), built once and cached."""
+    key = hashlib.sha1(repr((source.key, grid.key, method, REGRID_VERSION)).encode()).hexdigest()[:20]
+    if key in _regrids:
+        return _regrids[key]
+    path = Path(cache_dir) / f"{key}.npz" if cache_dir else None
+    with stage("gridded.regrid_matrix") as st:
+        if path is not None and path.exists():
+            op = Regrid.load(path)
+        else:
+            op = Regrid.build(source, grid, method)
+            if path is not None:
+                op.save(path)
+        st.add(rows_out=op.matrix.nnz)
+    _regrids[key] = op
+    return op
+
+def week_frame(path, week: str, grid: GridIndex, method: str = "nearest") -> pd.DataFrame:
+    """One week of a gridded file as [cell_id, value] rows (cells with a value only)."""
+    source = open_source(path)
+    vec = regridder(source, grid, method)(source, week)
+    ids = np.flatnonzero(np.isfinite(vec)).astype(np.int32)
+    return pd.DataFrame({"cell_id": ids, "value": vec[ids]})
+
+def ingest(sst_path, chl_path, grid: GridIndex, method: str = "nearest", weeks: list[str] | None = None,
+           features_out: str = FEATURES_PATH, state_out: str | None = STATE_PATH,
+           sst_var: str | None = None, chl_var: str | None = None) -> tuple[list[str], int]:
+    """Stream every week present in both sources (or `weeks`) into the features table,
+    one row group per week. Returns (weeks written, feature rows)."""
+    sst, chl = open_source(sst_path, sst_var), open_source(chl_path, chl_var)
+    common = sorted(set(sst.weeks) & set(chl.weeks))
+    if weeks is not None:
+        missing = sorted(set(weeks) - set(common))
+        if missing:
+            print(f"Skipping weeks missing from a source: {', '.join(missing)}")
+        common = [w for w in common if w in set(weeks)]
+    if not common:
+        raise ValueError(f"No week is in both {sst_path} and {chl_path}")
+    to_sst, to_chl = regridder(sst, grid, method), regridder(chl, grid, method)
+
+    state = AnomalyState.empty(grid.n_cells)
+    rows = 0
+    Path(features_out).parent.mkdir(parents=True, exist_ok=True)
+    with stage("gridded.ingest", rows_in=len(common)) as st:
+        with pq.ParquetWriter(features_out, FEATURES_SCHEMA) as fw:
+            for week in common:
+                with stage("gridded.week") as s:
+                    feats = append_week_fields(state, week, to_sst(sst, week), to_chl(chl, week), grid)
+                    fw.write_table(pa.Table.from_pandas(feats, schema=FEATURES_SCHEMA, preserve_index=False))
+                    s.add(rows_out=len(feats))
+                rows += len(feats)
+        st.add(rows_out=rows, bytes_written=lambda: file_bytes(features_out))
+    if state_out:
+        state.save(state_out)
+        Path(PREV_STATE_PATH).unlink(missing_ok=True)
+    shutil.rmtree(partition_dir(features_out), ignore_errors=True)
+    return common, rows
+
+def main():
+    ap = argparse.ArgumentParser(description="Regrid gridded SST/Chl stacks onto the coastal grid as weekly features.")
+    ap.add_argument("--sst", required=True, help="SST stack: .npy/.npz or raw float32 (+ <file>.json axes)")
+    ap.add_argument("--chl", required=True, help="Chl stack, same formats (its grid may differ from SST's)")
+    ap.add_argument("--sst-var", default=None, help="Data array name inside an .npz (default: the only one)")
+    ap.add_argument("--chl-var", default=None)
+    ap.add_argument("--method", choices=METHODS, default="nearest")
+    ap.add_argument("--weeks", default=None, help="Comma-separated ISO weeks (default: every week in both)")
+    ap.add_argument("--step", type=float, default=None,
+                    help=f"Build and save a new coastal grid with this step (default: load {GRID_PATH})")
+    ap.add_argument("--out", default=FEATURES_PATH)
+    args = ap.parse_args()
+
+    if args.step is not None:
+        grid = GridIndex.build(step=args.step)
+        grid.save(GRID_PATH)
+    else:
+        grid = load_grid()
+    weeks = [w.strip() for w in args.weeks.split(",") if w.strip()] if args.weeks else None
+    try:
+        written, rows = ingest(args.sst, args.chl, grid, args.method, weeks, args.out,
+                               sst_var=args.sst_var, chl_var=args.chl_var)
+    except (ValueError, KeyError, FileNotFoundError) as e:
+        raise SystemExit(e.args[0])
+    print(f"Wrote features -> {args.out}  weeks={len(written)} ({written[0]} .. {written[-1]})  rows={rows}")
+
+if __name__ == "__main__":
+    main()
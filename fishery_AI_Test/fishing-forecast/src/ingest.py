@@ -0,0 +1,204 @@
+"""Cached ingest of price / landings CSVs into normalized [week, port, ...] frames.
+
+The delimiter and column mapping are sniffed once from a small sample; the file
+is then parsed by the pyarrow (or C) engine reading only the mapped columns
+with explicit dtypes, the ISO week is derived with vectorized ops, and the
+result is cached as parquet under ``data/cache/`` keyed by the file's content
+hash. A stat index next to the cache skips even the hashing for unchanged files.
+"""
+import csv
+import hashlib
+import json
+import os
+import re
+import unicodedata as ud
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src import isoweek
+from src.fileutil import atomic_path, locked
+
+CACHE_DIR = "data/cache"
+SCHEMA_VERSION = 1      # bump when normalization changes, to invalidate cached tables
+SAMPLE_BYTES = 64 * 1024
+
+# canonical name -> accepted (normalized) source names, in priority order
+SYNONYMS = {
+    "port": ["port", "puerto", "port_name", "harbor"],
+    "price_pen_perkg": ["price_pen_perkg", "precio_pen_kg", "precio_pen", "precio", "price"],
+    "landings_tons": ["landings_tons", "desembarques_ton", "capturas_ton", "toneladas", "landings"],
+    "pred_landings_t1": ["pred_landings_t1"],
+}
+# columns the week can be derived from, in ensure_week's order of preference
+WEEK_SOURCES = {
+    "week": ["week"],
+    "target_week": ["target_week"],
+    "date": ["fecha", "date", "week_date", "fecha_semana"],
+    "year": ["year", "anio", "ano"],
+    "weeknum": ["semana", "semana_num", "week_num", "weeknumber", "weekn"],
+}
+# value columns each kind of table must / may carry
+KINDS = {
+    "price": (["price_pen_perkg"], []),
+    "landings": (["landings_tons"], []),
+    "pred_landings": ([], ["pred_landings_t1", "landings_tons"]),
+}
+_ISO_WEEK = re.compile(r"^\d{4}-W\d{2}$")
+
+def _norm(s: str) -> str:
+    # normalize: lowercase, no accents, spaces/dashes -> underscores
+    s = "".join(c for c in ud.normalize("NFKD", s.lstrip("\ufeff")) if not ud.combining(c))
+    return s.strip().lower().replace(" ", "_").replace("-", "_")
+
+def _first(cols, candidates):
+    for c in candidates:
+        if c in cols:
+            return c
+    return None
+
+def sniff(path: Path, sample_bytes: int = SAMPLE_BYTES) -> tuple[str, list[str]]:
+    """(delimiter, raw header names) from the first `sample_bytes` of the file."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        sample = f.read(sample_bytes)
+    try:
+        sep = csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        sep = ","
+    header = next(csv.reader(sample.splitlines()[:1], delimiter=sep), [])
+    return sep, header
+
+def column_mapping(header: list[str], kind: str, source: str = "input") -> dict[str, str]:
+    """raw column -> canonical name, for the columns `kind` needs (week sources included)."""
+    by_norm = {}
+    for raw in header:
+        by_norm.setdefault(_norm(raw), raw)
+    required, optional = KINDS[kind]
+    mapping = {}
+    for canon in ["port", *required, *optional]:
+        src = _first(by_norm, SYNONYMS.get(canon, [canon]))
+        if src is not None:
+            mapping[by_norm[src]] = canon
+    for names in WEEK_SOURCES.values():
+        src = _first(by_norm, names)
+        if src is not None:
+            mapping.setdefault(by_norm[src], src)
+    missing = [c for c in ["port", *required] if c not in mapping.values()]
+    if missing:
+        raise SystemExit(f"{source}: missing column(s) {missing} (accepted: "
+                         + "; ".join(f"{c}: {'|'.join(SYNONYMS[c])}" for c in missing) + ")")
+    return mapping
+
+def _dtypes(mapping: dict[str, str]) -> dict[str, str]:
+    out = {}
+    for raw, canon in mapping.items():
+        if canon in ("port", "week", "target_week") or canon in WEEK_SOURCES["date"]:
+            out[raw] = "string"
+        else:  # values and year/week numbers (float so blanks survive)
+            out[raw] = "float64"
+    return out
+
+def read_csv_fast(path: Path, sep: str, mapping: dict[str, str]) -> pd.DataFrame:
+    """Parse only the mapped columns with explicit dtypes; pyarrow engine, C as fallback."""
+    kw = dict(sep=sep, usecols=list(mapping), dtype=_dtypes(mapping), encoding="utf-8-sig")
+    try:
+        df = pd.read_csv(path, engine="pyarrow", **kw)
+    except (ImportError, ValueError):
+        df = pd.read_csv(path, engine="c", **kw)
+    return df.rename(columns=mapping)
+
+def _iso_strings(dates: pd.Series) -> pd.Series:
+    idx = isoweek.from_dates(dates)
+    weeks = pd.Series(isoweek.to_str(np.maximum(idx, 0)), index=dates.index, dtype=object)
+    return weeks.where(idx >= 0)
+
+def ensure_week(df: pd.DataFrame) -> pd.DataFrame:
+    """Add/normalize an ISO 'YYYY-Www' week column from whatever the table provides."""
+    cols = set(df.columns)
+    # 1) already has 'week': keep ISO strings, convert date-like values
+    if "week" in cols:
+        wk = df["week"].astype("string")
+        if wk.str.match(_ISO_WEEK.pattern).all():
+            return df
+        d = pd.to_datetime(wk, errors="coerce")
+        df["week"] = _iso_strings(d).where(d.notna(), wk.astype(object))
+        return df
+
+    # 2) target_week present
+    if "target_week" in cols:
+        df["week"] = df["target_week"]
+        return df
+
+    # 3) date/fecha present
+    dcol = _first(cols, WEEK_SOURCES["date"])
+    if dcol:
+        df["week"] = _iso_strings(pd.to_datetime(df[dcol], errors="coerce"))
+        return df
+
+    # 4) year + semana/weeknum present
+    ycol = _first(cols, WEEK_SOURCES["year"])
+    wcol = _first(cols, WEEK_SOURCES["weeknum"])
+    if ycol and wcol:
+        df["week"] = isoweek.to_str(isoweek.from_parts(df[ycol].to_numpy(), df[wcol].to_numpy()))
+        return df
+
+    raise SystemExit("Could not determine 'week'. Provide one of: week | target_week | fecha/date | year+semana.")
+
+def content_hash(path: Path, index: dict) -> str:
+    """Short sha256 of the file's bytes, memoized in `index` by (size, mtime_ns)."""
+    st = os.stat(path)
+    sig = [st.st_size, st.st_mtime_ns]
+    hit = index.get(str(path))
+    if hit and hit["sig"] == sig:
+        return hit["sha"]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    index[str(path)] = {"sig": sig, "sha": h.hexdigest()[:16]}
+    return index[str(path)]["sha"]
+
+def _read_index(cache_dir: str) -> dict:
+    p = Path(cache_dir) / "index.json"
+    return json.loads(p.read_text()) if p.exists() else {}
+
+def _write_index(cache_dir: str, updates: dict) -> None:
+    """Merge `updates` into the index on disk; concurrent loaders each add their entries."""
+    p = Path(cache_dir) / "index.json"
+    with locked(p):
+        index = _read_index(cache_dir)
+        index.update(updates)
+        with atomic_path(p) as tmp:
+            tmp.write_text(json.dumps(index, indent=2))
+
+def load_table(path: Path, kind: str, cache_dir: str | None = CACHE_DIR) -> pd.DataFrame:
+    """Normalized [week, port, <value columns>] for a `kind` CSV ('price', 'landings',
+    'pred_landings'). Unchanged files are served from the parquet cache.
+    """
+    path = Path(path)
+    cached = None
+    if cache_dir:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        index = _read_index(cache_dir)
+        before = dict(index)
+        sha = content_hash(path, index)
+        cached = Path(cache_dir) / f"{path.stem}-{kind}-v{SCHEMA_VERSION}-{sha}.parquet"
+        if index != before:
+            _write_index(cache_dir, {k: v for k, v in index.items() if before.get(k) != v})
+        if cached.exists():
+            return pd.read_parquet(cached)
+
+    sep, header = sniff(path)
+    mapping = column_mapping(header, kind, source=str(path))
+    df = ensure_week(read_csv_fast(path, sep, mapping))
+    required, optional = KINDS[kind]
+    keep = ["week", "port"] + [c for c in required + optional if c in df.columns]
+    df = df[keep].astype({"week": str, "port": str})
+    for c in keep[2:]:
+        df[c] = df[c].astype(np.float64)
+
+    if cached is not None:
+        with atomic_path(cached) as tmp:
+            df.to_parquet(tmp, index=False)
+    return df
@@ -0,0 +1,211 @@
+"""Per-stage timing / memory instrumentation for pipeline runs.
+
+Wrap a stage or sub-step in ``stage()`` and report its row / byte counts:
+
+    with stage("features.build", rows_in=len(df)) as s:
+        ...
+        s.add(rows_out=len(out), bytes_written=lambda: file_bytes(path))
+
+A counter may be given as a zero-argument callable; it is only called while
+recording, so byte counts that need a stat() cost nothing when tracing is off.
+Each stage records wall time, CPU time, peak RSS at exit (and how much it grew
+during the stage), rows in/out and bytes read/written, plus its parent stage.
+Recording is off unless ``FF_TRACE=<path>`` is set (or ``enable()`` is called);
+when off, ``stage()`` returns a shared no-op object, so an instrumented call
+costs one global lookup. On exit the records are merged into the file: plain
+JSON by default, or a Chrome trace (chrome://tracing, Perfetto) when
+``FF_TRACE_FORMAT=chrome``. Only the enabling process writes; stages running
+inside pool workers are covered by the stage wrapping the pool.
+
+    FF_TRACE=outputs/trace.json python -m src.train
+    python -m src.instrument outputs/trace.json      # per-stage summary table
+"""
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from src.fileutil import locked
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage
+    resource = None
+
+TRACE_ENV = "FF_TRACE"
+FORMAT_ENV = "FF_TRACE_FORMAT"
+COUNTERS = ("rows_in", "rows_out", "bytes_read", "bytes_written")
+
+_path: str | None = None
+_format = "json"
+_pid = 0
+_events: list[dict] = []
+_local = threading.local()
+_T0 = time.perf_counter()
+_EPOCH = time.time()
+
+def peak_rss_mb() -> float | None:
+    """Peak resident set size of this process in MB (None where getrusage is unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024.0  # bytes on macOS, KiB on Linux
+
+def file_bytes(*paths) -> int:
+    """Total size of the given files (missing ones count as 0)."""
+    total = 0
+    for p in paths:
+        try:
+            total += os.path.getsize(p)
+        except OSError:
+            pass
+    return total
+
+def _value(v):
+    return v() if callable(v) else v
+
+class _Null:
+    """Stand-in returned while recording is off."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, **counts) -> None:
+        pass
+
+_NULL = _Null()
+
+class Stage:
+    __slots__ = ("name", "counts", "parent", "_t", "_cpu", "_rss")
+
+    def __init__(self, name: str, counts: dict):
+        unknown = set(counts) - set(COUNTERS)
+        if unknown:
+            raise ValueError(f"Unknown stage counter(s): {sorted(unknown)}")
+        self.name, self.counts = name, {k: int(_value(counts.get(k, 0))) for k in COUNTERS}
+
+    def add(self, **counts) -> None:
+        """Accumulate rows_in / rows_out / bytes_read / bytes_written (values or callables)."""
+        for k, v in counts.items():
+            if k not in self.counts:
+                raise ValueError(f"Unknown stage counter: {k}")
+            self.counts[k] += int(_value(v))
+
+    def __enter__(self) -> "Stage":
+        stack = _local.__dict__.setdefault("stack", [])
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self._rss = peak_rss_mb()
+        self._cpu = time.process_time()
+        self._t = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.perf_counter()
+        cpu = time.process_time() - self._cpu
+        peak = peak_rss_mb()
+        _local.stack.pop()
+        _events.append({
+            "name": self.name, "parent": self.parent, "start_s": round(self._t - _T0, 6),
+            "wall_s": round(t1 - self._t, 6), "cpu_s": round(cpu, 6),
+            "peak_rss_mb": None if peak is None else round(peak, 1),
+            "rss_growth_mb": None if peak is None else round(peak - self._rss, 1),
+            **self.counts, "ok": exc_type is None, "tid": threading.get_ident(),
+        })
+        return False
+
+def stage(name: str, **counts):
+    """Context manager recording one stage (a no-op unless recording is enabled)."""
+    if _path is None:
+        return _NULL
+    return Stage(name, counts)
+
+def enabled() -> bool:
+    return _path is not None
+
+def enable(path: str, fmt: str = "json") -> None:
+    """Start recording; records are merged into `path` at interpreter exit."""
+    global _path, _format, _pid
+    if fmt not in ("json", "chrome"):
+        raise ValueError(f"Unknown trace format {fmt!r} (expected json or chrome)")
+    if _path is None:
+        atexit.register(flush)
+    _path, _format, _pid = path, fmt, os.getpid()
+
+def _chrome_events(events: list[dict]) -> list[dict]:
+    base_us = _EPOCH * 1e6
+    return [{
+        "name": e["name"], "cat": "stage", "ph": "X", "pid": _pid, "tid": e["tid"],
+        "ts": round(base_us + e["start_s"] * 1e6), "dur": round(e["wall_s"] * 1e6),
+        "args": {k: v for k, v in e.items() if k not in ("name", "tid", "start_s", "wall_s")},
+    } for e in events]
+
+def flush() -> None:
+    """Merge this process's records into the trace file (atomic replace)."""
+    if _path is None or os.getpid() != _pid or not _events:
+        return
+    p = Path(_path)
+    # concurrent pipeline stages merge into the same file: serialize the read-modify-write
+    with locked(p):
+        try:
+            doc = json.loads(p.read_text()) if p.exists() else {}
+        except ValueError:
+            doc = {}
+        if _format == "chrome":
+            doc.setdefault("traceEvents", []).extend(_chrome_events(_events))
+            doc.setdefault("displayTimeUnit", "ms")
+        else:
+            doc.setdefault("runs", []).append({
+                "argv": sys.argv, "pid": _pid,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(_EPOCH)),
+                "stages": list(_events),
+            })
+        tmp = p.with_name(p.name + ".tmp")
+        tmp.write_text(json.dumps(doc, indent=1))
+        os.replace(tmp, p)
+    _events.clear()
+
+def load_stages(path: str) -> list[dict]:
+    """Stage records from a trace file of either format (one dict per stage)."""
+    doc = json.loads(Path(path).read_text())
+    if "traceEvents" in doc:
+        return [{"name": e["name"], "wall_s": e["dur"] / 1e6, **e.get("args", {})}
+                for e in doc["traceEvents"] if e.get("ph") == "X"]
+    return [st for run in doc.get("runs", []) for st in run["stages"]]
+
+def summarize(stages: list[dict]) -> list[dict]:
+    """Totals per stage name, in first-seen order."""
+    out: dict[str, dict] = {}
+    for st in stages:
+        agg = out.setdefault(st["name"], {"name": st["name"], "calls": 0, "wall_s": 0.0, "cpu_s": 0.0,
+                                          "peak_rss_mb": 0.0, **{k: 0 for k in COUNTERS}})
+        agg["calls"] += 1
+        agg["peak_rss_mb"] = max(agg["peak_rss_mb"], st.get("peak_rss_mb") or 0.0)
+        for k in ("wall_s", "cpu_s", *COUNTERS):
+            agg[k] += st.get(k, 0)
+    return list(out.values())
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarize a stage trace written with FF_TRACE.")
+    ap.add_argument("trace")
+    args = ap.parse_args()
+    print(f"{'stage':34s}{'calls':>6s}{'wall s':>9s}{'cpu s':>9s}{'rss MB':>8s}"
+          f"{'rows in':>11s}{'rows out':>11s}{'MB read':>9s}{'MB written':>11s}")
+    for r in summarize(load_stages(args.trace)):
+        print(f"{r['name']:34s}{r['calls']:6d}{r['wall_s']:9.3f}{r['cpu_s']:9.3f}{r['peak_rss_mb']:8.0f}"
+              f"{r['rows_in']:11,d}{r['rows_out']:11,d}{r['bytes_read'] / 2**20:9.1f}{r['bytes_written'] / 2**20:11.1f}")
+
+if os.environ.get(TRACE_ENV) and multiprocessing.parent_process() is None:  # not in pool workers
+    enable(os.environ[TRACE_ENV], os.environ.get(FORMAT_ENV, "json"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""ISO-week calendar: integer week index + precomputed lookup tables.
+
+Week index 0 is 1900-W01 (Monday 1900-01-01); every later ISO week is +1, so
+week arithmetic and ranges are plain integer ops. Strings, Monday dates, months,
+ISO years and week-of-year numbers for 1900..2199 are built once at import and
+looked up by index, instead of running ``pd.to_datetime(week + "-1", format=
+"%G-W%V-%u")`` per row. String columns are converted by parsing each distinct
+value once.
+"""
+import numpy as np
+import pandas as pd
+
+EPOCH = np.datetime64("1900-01-01", "D")   # Monday of 1900-W01
+_N = (np.datetime64("2200-01-01", "D") - EPOCH).astype(int) // 7
+
+MONDAY = EPOCH + 7 * np.arange(_N)                               # datetime64[D]
+_THURSDAY = MONDAY + 3                                           # decides the ISO year
+YEAR = _THURSDAY.astype("datetime64[Y]").astype(int) + 1970
+WEEK_OF_YEAR = (_THURSDAY - _THURSDAY.astype("datetime64[Y]")).astype(int) // 7 + 1
+MONTH = MONDAY.astype("datetime64[M]").astype(int) % 12 + 1      # month of the Monday
+LABELS = np.array([f"{y}-W{w:02d}" for y, w in zip(YEAR.tolist(), WEEK_OF_YEAR.tolist())], dtype=object)
+_INDEX = {s: i for i, s in enumerate(LABELS)}
+_YEAR0 = int(YEAR[0])
+_YEAR_START = np.flatnonzero(WEEK_OF_YEAR == 1)                  # index of W01, per ISO year
+
+def to_index(weeks):
+    """ISO week string(s) -> int week index (scalar in, scalar out; else an int32 array)."""
+    if isinstance(weeks, str):
+        try:
+            return _INDEX[weeks]
+        except KeyError:
+            raise ValueError(f"Not an ISO week in 1900..2199: {weeks!r}") from None
+    codes, uniq = pd.factorize(pd.Series(weeks, copy=False))
+    if (codes < 0).any():
+        raise ValueError("Missing week values")
+    idx = np.fromiter((to_index(str(w)) for w in uniq), dtype=np.int32, count=len(uniq))
+    return idx[codes]
+
+def to_str(idx):
+    """Week index (or array of them) -> ISO week string(s)."""
+    if np.ndim(idx) == 0:
+        return LABELS[int(idx)]
+    return LABELS[np.asarray(idx)]
+
+def from_parts(year, week) -> np.ndarray:
+    """Index of ISO (year, week-of-year) pairs, vectorized."""
+    year, week = np.asarray(year, dtype=np.int64), np.asarray(week, dtype=np.int64)
+    if ((year < _YEAR0) | (year >= _YEAR0 + len(_YEAR_START))).any():
+        raise ValueError(f"ISO year out of range {_YEAR0}..{_YEAR0 + len(_YEAR_START) - 1}")
+    if ((week < 1) | (week > 53)).any():
+        raise ValueError("Week number out of range for its ISO year")
+    idx = _YEAR_START[year - _YEAR0] + week - 1
+    if (idx >= _N).any() or (WEEK_OF_YEAR[np.minimum(idx, _N - 1)] != week).any():
+        raise ValueError("Week number out of range for its ISO year")
+    return idx
+
+def from_dates(dates) -> np.ndarray:
+    """Index of the ISO week containing each date (NaT -> -1)."""
+    d = pd.to_datetime(pd.Series(dates, copy=False)).to_numpy(dtype="datetime64[D]")
+    nat = np.isnat(d)
+    idx = np.where(nat, 0, (d - EPOCH).astype(np.int64) // 7)
+    if ((idx < 0) | (idx >= _N)).any():
+        raise ValueError(f"Date outside the ISO-week table ({LABELS[0]}..{LABELS[-1]})")
+    return np.where(nat, -1, idx)
+
+def monday(idx) -> np.ndarray:
+    return MONDAY[idx]
+
+def month(idx) -> np.ndarray:
+    return MONTH[idx]
+
+def week_of_year(idx) -> np.ndarray:
+    return WEEK_OF_YEAR[idx]
+
+def iso_year(idx) -> np.ndarray:
+    return YEAR[idx]
+
+def add_weeks(week: str, n: int) -> str:
+    return LABELS[_INDEX[week] + n]
+
+def weeks_between(w0: str, w1: str) -> int:
+    return to_index(w1) - to_index(w0)
+
+def week_range(start: str, end: str) -> list[str]:
+    """Every ISO week from `start` to `end` inclusive."""
+    return LABELS[to_index(start):to_index(end) + 1].tolist()
+
+def categorical(weeks) -> pd.Categorical:
+    """Ordered categorical over the contiguous span of weeks present (gaps kept as categories)."""
+    idx = to_index(weeks)
+    lo = int(idx.min()) if len(idx) else 0
+    span = LABELS[lo:int(idx.max()) + 1] if len(idx) else LABELS[:0]
+    return pd.Categorical.from_codes(idx - lo, categories=pd.Index(span, dtype=str), ordered=True)
@@ -0,0 +1,254 @@
+# src/model_pack.py
+"""Compact artifacts for the random-forest price models.
+
+``PackedForest`` flattens every tree of a fitted RandomForestRegressor /
+RandomForestClassifier into a few concatenated node arrays, each stored in
+the smallest dtype that holds it. Child pointers are tree-relative (uint8 for
+depth-7 trees), features are uint8, and thresholds are float32 rounded down,
+so float32 inputs take the same branch as in sklearn. Leaf values are float32.
+Prediction walks all trees x rows together, one vectorized step per tree
+level. The pack can optionally be pruned to the smallest greedy tree subset
+whose validation MAE stays within a tolerance (trees are chosen on the first
+part of the holdout, MAE is reported on the rest), and is saved with
+compressed joblib.
+
+    python -m src.model_pack --species anchoveta [--prune-tol 0.01]
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+PACK_COMPRESS = ("zlib", 3)
+_MAX_CELLS = 65_536  # trees x rows walked per chunk (small enough to stay in cache)
+
+def _smallest_uint(max_value: int):
+    for dt in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dt).max:
+            return dt
+    return np.uint64
+
+def pack_path(model_path: Path) -> Path:
+    return Path(model_path).with_suffix(".pack.joblib")
+
+class PackedForest:
+    def __init__(self, base, left, right, feature, threshold, value, depth: int,
+                 n_features: int, classes=None):
+        self.base, self.left, self.right = base, left, right
+        self.feature, self.threshold, self.value = feature, threshold, value
+        self.depth, self.n_features, self.classes_ = depth, n_features, classes
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.base)
+
+    @classmethod
+    def from_sklearn(cls, forest) -> "PackedForest":
+        trees = [est.tree_ for est in forest.estimators_]
+        sizes = np.array([t.node_count for t in trees])
+        base = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(_smallest_uint(int(sizes.sum())))
+        child = _smallest_uint(int(sizes.max()) - 1)
+        left, right, feature, thr, value = [], [], [], [], []
+        for t in trees:
+            leaf = t.children_left < 0
+            own = np.arange(t.node_count)
+            # leaves point to themselves with an always-true test, so every row can
+            # take exactly `depth` steps without checking where it stopped
+            left.append(np.where(leaf, own, t.children_left))
+            right.append(np.where(leaf, own, t.children_right))
+            feature.append(np.where(leaf, 0, t.feature))
+            th = t.threshold.astype(np.float32)
+            th = np.where(th > t.threshold, np.nextafter(th, np.float32(-np.inf)), th)  # round down
+            thr.append(np.where(leaf, np.float32(np.inf), th))
+            v = t.value[:, 0, :]
+            if hasattr(forest, "classes_"):
+                v = v / v.sum(axis=1, keepdims=True)
+            value.append(v)
+        n_features = forest.n_features_in_
+        return cls(
+            base=base,
+            left=np.concatenate(left).astype(child), right=np.concatenate(right).astype(child),
+            feature=np.concatenate(feature).astype(_smallest_uint(n_features - 1)),
+            threshold=np.concatenate(thr).astype(np.float32),
+            value=np.concatenate(value).astype(np.float32),
+            depth=int(max(t.max_depth for t in trees)), n_features=n_features,
+            classes=getattr(forest, "classes_", None),
+        )
+
+    def __getstate__(self) -> dict:
+        return {k: v for k, v in self.__dict__.items() if k != "_rt"}  # runtime arrays are rebuilt
+
+    def _sizes(self) -> np.ndarray:
+        return np.diff(np.append(self.base.astype(np.int64), len(self.left)))
+
+    def subset(self, trees) -> "PackedForest":
+        """New pack holding only the given trees (their nodes are copied out)."""
+        trees = np.asarray(trees)
+        sizes = self._sizes()[trees]
+        nodes = np.concatenate([np.arange(b, b + n) for b, n in zip(self.base[trees].astype(np.int64), sizes)])
+        base = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(_smallest_uint(int(sizes.sum())))
+        return PackedForest(base, self.left[nodes], self.right[nodes], self.feature[nodes],
+                            self.threshold[nodes], self.value[nodes], self.depth, self.n_features, self.classes_)
+
+    def _runtime(self) -> tuple:
+        """Absolute child / feature indices in native ints, built once per process."""
+        if "_rt" not in self.__dict__:
+            owner = np.repeat(self.base.astype(np.intp), self._sizes())
+            self._rt = (owner + self.left, owner + self.right, self.feature.astype(np.intp))
+        return self._rt
+
+    def _leaves(self, X32: np.ndarray) -> np.ndarray:
+        left, right, feature = self._runtime()
+        flat = X32.ravel()
+        row_off = (np.arange(len(X32), dtype=np.intp) * X32.shape[1])[None, :]
+        node = np.repeat(self.base.astype(np.intp)[:, None], len(X32), axis=1)
+        for _ in range(self.depth):
+            go_left = flat[row_off + feature[node]] <= self.threshold[node]
+            node = np.where(go_left, left[node], right[node])
+        return node
+
+    def tree_predictions(self, X) -> np.ndarray:
+        """Per-tree outputs: (trees, rows) for a regressor, (trees, rows, classes) for a classifier."""
+        X32 = np.ascontiguousarray(X, dtype=np.float32)
+        step = max(1, _MAX_CELLS // max(self.n_trees, 1))
+        out = [self.value[self._leaves(X32[i:i + step])] for i in range(0, len(X32), step)]
+        vals = np.concatenate(out, axis=1) if out else np.empty((self.n_trees, 0, self.value.shape[1]))
+        return vals if self.classes_ is not None else vals[..., 0]
+
+    def predict_proba(self, X) -> np.ndarray:
+        return self.tree_predictions(X).mean(axis=0, dtype=np.float64)
+
+    def predict(self, X) -> np.ndarray:
+        if self.classes_ is not None:
+            return self.classes_[self.predict_proba(X).argmax(axis=1)]
+        return self.tree_predictions(X).mean(axis=0, dtype=np.float64)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.base, self.left, self.right, self.feature, self.threshold, self.value))
+
+def prune(packed: PackedForest, X_val: np.ndarray, y_val: np.ndarray, tol: float = 0.01,
+          min_trees: int = 50, select_frac: float = 0.5):
+    """Smallest greedy subset of trees (at least `min_trees`, so a tiny validation set
+    cannot pick a single lucky tree) whose MAE is within `tol` (relative) of the full
+    forest's. Trees are added one at a time, each time the one that lowers the running
+    ensemble's MAE most, on the first `select_frac` of the (time-ordered) validation
+    rows; the MAEs returned are measured on the remaining rows, which the selection
+    never saw. Returns (pruned pack, full MAE, pruned MAE).
+    """
+    cut = min(max(int(len(y_val) * select_frac), 1), len(y_val) - 1)
+    if cut < 1:
+        raise ValueError("prune needs at least 2 validation rows (selection + evaluation)")
+    per_tree = packed.tree_predictions(X_val).astype(np.float64)     # (T, n)
+    sel, y_sel = per_tree[:, :cut], y_val[:cut]
+    target = float(np.abs(sel.mean(axis=0) - y_sel).mean()) * (1 + tol)
+    chosen, total = [], np.zeros(cut)
+    free = np.ones(len(per_tree), dtype=bool)
+    while free.any():
+        k = len(chosen) + 1
+        cand = np.abs((total[None, :] + sel) / k - y_sel[None, :]).mean(axis=1)
+        cand[~free] = np.inf
+        best = int(cand.argmin())
+        chosen.append(best)
+        free[best] = False
+        total += sel[best]
+        if k >= min_trees and cand[best] <= target:
+            break
+    held, y_held = per_tree[:, cut:], y_val[cut:]
+    full_mae = float(np.abs(held.mean(axis=0) - y_held).mean())
+    mae = float(np.abs(held[chosen].mean(axis=0) - y_held).mean())
+    return packed.subset(chosen), full_mae, mae
+
+def load_price_model(model_path: Path):
+    """The packed artifact when it is at least as new as the sklearn pickle, else the pickle."""
+    packed = pack_path(model_path)
+    if packed.exists() and os.path.getmtime(packed) >= os.path.getmtime(model_path):
+        return joblib.load(packed)
+    return joblib.load(model_path)
+
+def _timed_load(path: Path, repeats: int = 3) -> float:
+    runs = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        joblib.load(path)
+        runs.append(time.perf_counter() - t)
+    return min(runs)
+
+def _row_latency_us(model, X: np.ndarray, repeats: int = 3) -> float:
+    runs = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        model.predict(X)
+        runs.append(time.perf_counter() - t)
+    return 1e6 * min(runs) / len(X)
+
+def pack_model(model_path: Path, X_val: np.ndarray | None = None, y_val: np.ndarray | None = None,
+               prune_tol: float | None = None, min_trees: int = 50) -> list[dict]:
+    """Write `<model>.pack.joblib` (compressed, packed, optionally pruned) next to the
+    sklearn pickle. Returns report rows for the original and packed artifacts.
+    """
+    model_path = Path(model_path)
+    forest = joblib.load(model_path)
+    packed = PackedForest.from_sklearn(forest)
+    note = ""
+    if prune_tol is not None and isinstance(forest, RandomForestRegressor) and X_val is not None and len(X_val):
+        packed, full_mae, mae = prune(packed, X_val, y_val, prune_tol, min_trees)
+        note = f"pruned {forest.n_estimators}->{packed.n_trees} trees, held-out MAE {full_mae:.4f}->{mae:.4f}"
+    out = pack_path(model_path)
+    joblib.dump(packed, out, compress=PACK_COMPRESS)
+    print(f"Packed {model_path.name} -> {out}")
+
+    X = X_val if X_val is not None and len(X_val) else np.zeros((1, forest.n_features_in_))
+    X = np.repeat(X, max(1, 2000 // len(X)), axis=0)
+    ref = forest.predict(X)
+    diff = np.abs(packed.predict(X).astype(float) - ref.astype(float)).max() if not note else np.nan
+    rows = []
+    for label, path, model in (("sklearn pickle", model_path, forest), ("packed", out, packed)):
+        rows.append({
+            "model": model_path.name, "artifact": label, "trees": len(getattr(model, "estimators_", [])) or model.n_trees,
+            "size_kb": os.path.getsize(path) / 1024, "load_ms": 1000 * _timed_load(path),
+            "predict_us_per_row": _row_latency_us(model, X),
+            "predict_ms_one_row": _row_latency_us(model, X[:1]) / 1000,
+        })
+    rows[-1]["max_abs_diff"] = diff
+    rows[-1]["note"] = note
+    return rows
+
+def main():
+    ap = argparse.ArgumentParser("Pack the random-forest price models into compact artifacts")
+    ap.add_argument("--species", default="anchoveta")
+    ap.add_argument("--model_dir", default="models")
+    ap.add_argument("--features_csv", default=None, help="Default: data/processed/<species>_price_features.csv")
+    ap.add_argument("--prune-tol", type=float, default=None,
+                    help="Prune the regressor to the fewest trees within this relative validation-MAE tolerance")
+    ap.add_argument("--min-trees", type=int, default=50, help="Never prune below this many trees")
+    args = ap.parse_args()
+
+    # validation rows: the same time-ordered 20% holdout price_train evaluates on
+    from src.price_train import load_split, price_model_path
+    features_csv = Path(args.features_csv or f"data/processed/{args.species}_price_features.csv")
+    _, X, y, split = load_split(features_csv)
+    model_dir = Path(args.model_dir)
+    rows = []
+    for kind in ("reg", "clf"):
+        path = price_model_path(model_dir, args.species, kind)
+        if not path.exists():
+            raise SystemExit(f"Missing {path}. Run price_train.py first.")
+        rows += pack_model(path, X[split:], y[split:], args.prune_tol if kind == "reg" else None,
+                           args.min_trees)
+
+    print(f"{'model':28s}{'artifact':16s}{'trees':>6s}{'size KB':>10s}{'load ms':>9s}"
+          f"{'us/row':>9s}{'1-row ms':>10s}{'max diff':>10s}")
+    for r in rows:
+        diff = f"{r['max_abs_diff']:10.1e}" if "max_abs_diff" in r else " " * 10
+        print(f"{r['model']:28s}{r['artifact']:16s}{r['trees']:6d}{r['size_kb']:10.1f}{r['load_ms']:9.1f}"
+              f"{r['predict_us_per_row']:9.2f}{r['predict_ms_one_row']:10.2f}{diff}  {r.get('note', '')}")
+
+if __name__ == "__main__":
+    # run from the importable module so packs pickle as src.model_pack.PackedForest
+    from src.model_pack import main as _main
+    _main()
@@ -0,0 +1,110 @@
+"""Hotspot model artifacts: native XGBoost UBJSON + a small JSON sidecar.
+
+``save_hotspot`` writes ``models/hotspot_xgb.ubj`` next to a sidecar
+(``hotspot_xgb.json``) recording the feature order, a hash of the training
+data and the artifact version. ``load_hotspot`` loads lazily, once per process
+(and again only if the file changes), and ``HotspotModel.predict_p`` scores
+contiguous float32 arrays through ``Booster.inplace_predict`` with no
+DataFrame/DMatrix conversion. The legacy joblib pickle is still readable.
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+NATIVE_PATH = "models/hotspot_xgb.ubj"
+PICKLE_PATH = "models/hotspot_xgb.pkl"
+FEATS = ["sst", "chl", "sst_anom", "month"]
+FORMAT_VERSION = 1
+
+def sidecar_path(path: str) -> Path:
+    return Path(path).with_suffix(".json")
+
+def resolve_model_path(path: str | None = None) -> str:
+    """Explicit path, else the native artifact when present, else the legacy pickle."""
+    if path:
+        return path
+    return NATIVE_PATH if Path(NATIVE_PATH).exists() else PICKLE_PATH
+
+def data_hash(df: pd.DataFrame) -> str:
+    """Content hash of a training frame (row order sensitive)."""
+    h = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha256(h.tobytes()).hexdigest()[:16]
+
+def files_hash(*paths: str) -> str:
+    """Content hash of the training input files (for streamed fits with no frame in memory)."""
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+def save_hotspot(model, path: str = NATIVE_PATH, features: list[str] = FEATS,
+                 training_hash: str | None = None) -> dict:
+    """Write the booster as UBJSON plus its metadata sidecar; returns the metadata."""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    raw = booster.save_raw("ubj")
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(path).with_suffix(".ubj.tmp")
+    tmp.write_bytes(raw)
+    os.replace(tmp, path)
+    meta = {
+        "format": FORMAT_VERSION,
+        "version": hashlib.sha256(raw).hexdigest()[:12],
+        "features": list(features),
+        "training_data_hash": training_hash,
+        "xgboost": xgb.__version__,
+    }
+    sidecar_path(path).write_text(json.dumps(meta, indent=2))
+    return meta
+
+class HotspotModel:
+    def __init__(self, booster: xgb.Booster, meta: dict):
+        self.booster, self.meta = booster, meta
+        self.features = meta["features"]
+
+    @property
+    def version(self) -> str:
+        return self.meta["version"]
+
+    def predict_p(self, X: np.ndarray) -> np.ndarray:
+        """Hotspot probability for rows of X (columns in self.features order)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if len(X) == 0:
+            return np.empty(0, dtype=np.float32)
+        return np.clip(self.booster.inplace_predict(X, validate_features=False), 0.0, 1.0)
+
+    def predict_frame(self, df: pd.DataFrame) -> np.ndarray:
+        X = np.empty((len(df), len(self.features)), dtype=np.float32)
+        for j, c in enumerate(self.features):
+            X[:, j] = df[c].to_numpy(dtype=np.float32)
+        return self.predict_p(X)
+
+@lru_cache(maxsize=4)
+def _load(path: str, size: int, mtime_ns: int) -> HotspotModel:
+    if path.endswith(".pkl"):
+        # legacy pickle: same version as the .ubj the same booster would be saved as
+        booster = joblib.load(path).get_booster()
+        raw = booster.save_raw("ubj")
+        meta = {"format": 0, "version": hashlib.sha256(raw).hexdigest()[:12],
+                "features": FEATS, "training_data_hash": None}
+        return HotspotModel(booster, meta)
+    booster = xgb.Booster()
+    booster.load_model(path)
+    side = sidecar_path(path)
+    meta = json.loads(side.read_text()) if side.exists() else {"format": FORMAT_VERSION, "features": FEATS}
+    meta.setdefault("version", hashlib.sha256(Path(path).read_bytes()).hexdigest()[:12])
+    return HotspotModel(booster, meta)
+
+def load_hotspot(path: str | None = None) -> HotspotModel:
+    """Process-wide cached model; reloads only when the file on disk changes."""
+    path = resolve_model_path(path)
+    st = os.stat(path)
+    return _load(str(path), st.st_size, st.st_mtime_ns)
@@ -0,0 +1,306 @@
+"""Content-hash cached DAG runner for the whole forecasting pipeline.
+
+Every stage declares the files it reads and writes; the DAG follows from which
+stage writes what another reads:
+
+    data_gen -> train -> export_geojson
+    price_features:<species> -> price_train:<species>      (one branch per species)
+
+A stage is skipped when its outputs exist and its key is unchanged. The key
+hashes the stage's command line, its code version (the source of its module
+and every ``src`` module it imports, transitively) and the content of its
+inputs. Input hashes are cached by (size, mtime) in the state file, so
+unchanged files are not re-read. A stage whose upstream re-ran but produced
+identical bytes is skipped as well. Stages run as ``python -m`` subprocesses
+on a thread pool, so independent branches (hotspot training next to the price
+features) run concurrently.
+
+    python -m src.pipeline                       # run whatever is stale
+    python -m src.pipeline --dry-run             # show the plan
+    python -m src.pipeline --only price_train    # just these stages (if stale)
+    python -m src.pipeline --from train          # force train and everything downstream
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from src.ingest import content_hash
+from src.instrument import file_bytes, stage
+
+STATE_PATH = "data/processed/pipeline_state.json"
+SRC_DIR = Path(__file__).resolve().parent
+PRICE_DIR = "data/price"
+LANDINGS_DIR = "data/landings"
+PROCESSED_DIR = "data/processed"
+PUBLISH_DIR = "outputs/predictions"
+
+class Stage:
+    """One pipeline step: `python -m <module> <args>` reading `inputs`, writing `outputs`
+    (files, or directories that only need to exist)."""
+
+    def __init__(self, name: str, module: str, args: list[str] | None = None,
+                 inputs: list[str] | None = None, outputs: list[str] | None = None):
+        self.name, self.module, self.args = name, module, list(args or [])
+        self.inputs, self.outputs = list(inputs or []), list(outputs or [])
+        self.deps: list[str] = []
+
+    @property
+    def group(self) -> str:
+        return self.name.split(":")[0]
+
+    @property
+    def argv(self) -> list[str]:
+        return [sys.executable, "-m", self.module, *self.args]
+
+    def __repr__(self) -> str:
+        return f"Stage({self.name!r})"
+
+def _species(price_dir: str) -> list[str]:
+    return sorted(p.name[:-len("_prices.csv")] for p in Path(price_dir).glob("*_prices.csv"))
+
+def default_stages(publish_dir: str = PUBLISH_DIR, price_dir: str = PRICE_DIR,
+                   landings_dir: str = LANDINGS_DIR, synth: bool = True) -> list[Stage]:
+    """The standard pipeline. With synth=False the features/labels parquet are taken as given."""
+    proc = Path(PROCESSED_DIR)
+    feats, labels, grid = str(proc / "features.parquet"), str(proc / "labels.parquet"), str(proc / "grid.npz")
+    stages = []
+    if synth:
+        stages.append(Stage("data_gen", "src.data_gen",
+                            outputs=[feats, labels, grid, str(proc / "sst_state.npz")]))
+    stages.append(Stage("train", "src.train", inputs=[feats, labels],
+                        outputs=["models/hotspot_xgb.pkl", "models/hotspot_xgb.ubj", "models/hotspot_xgb.json",
+                                 str(proc / "predictions" / "manifest.json")]))
+    stages.append(Stage("export_geojson", "src.export_geojson", ["--all-weeks", "--tiles", "--ranked", "--out", publish_dir],
+                        inputs=[feats, grid, "models/hotspot_xgb.ubj"], outputs=[publish_dir]))
+    for sp in _species(price_dir):
+        pred = Path(landings_dir) / f"{sp}_predicted_landings.csv"
+        if not pred.exists():
+            pred = Path(landings_dir) / "predicted_landings.csv"
+        price_csv, land_csv = Path(price_dir) / f"{sp}_prices.csv", Path(landings_dir) / f"{sp}_landings.csv"
+        features_csv = str(proc / f"{sp}_price_features.csv")
+        stages.append(Stage(f"price_features:{sp}", "src.price_features",
+                            ["--price_csv", str(price_csv), "--land_csv", str(land_csv),
+                             "--pred_csv", str(pred), "--out", features_csv],
+                            inputs=[str(price_csv), str(land_csv)] + ([str(pred)] if pred.exists() else []),
+                            outputs=[features_csv]))
+        stages.append(Stage(f"price_train:{sp}", "src.price_train",
+                            ["--species", sp, "--features_csv", features_csv],
+                            inputs=[features_csv],
+                            outputs=[f"models/{sp}_price_rf.pkl", f"models/{sp}_price_dir_rf.pkl"]))
+    return link(stages)
+
+def link(stages: list[Stage]) -> list[Stage]:
+    """Fill in each stage's deps (the stages writing its inputs); stages come back in topological order."""
+    writer = {}
+    for s in stages:
+        for out in s.outputs:
+            if out in writer:
+                raise ValueError(f"{out} is written by both {writer[out]} and {s.name}")
+            writer[out] = s.name
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        s.deps = sorted({writer[i] for i in s.inputs if i in writer and writer[i] != s.name})
+    order, seen, active = [], set(), set()
+
+    def visit(name: str) -> None:
+        if name in seen:
+            return
+        if name in active:
+            raise ValueError(f"Cycle through stage {name}")
+        active.add(name)
+        for d in by_name[name].deps:
+            visit(d)
+        active.discard(name)
+        seen.add(name)
+        order.append(by_name[name])
+
+    for s in stages:
+        visit(s.name)
+    return order
+
+def descendants(stages: list[Stage], roots: set[str]) -> set[str]:
+    out = set(roots)
+    for s in stages:  # topological order: deps come first
+        if out.intersection(s.deps):
+            out.add(s.name)
+    return out
+
+def _imports(path: Path) -> set[str]:
+    """`src` modules a source file imports (from src.x import ..., from src import x, import src.x)."""
+    mods = set()
+    for node in ast.walk(ast.parse(path.read_text())):
+        if isinstance(node, ast.ImportFrom) and node.module:
+            if node.module == "src":
+                mods.update(a.name for a in node.names)
+            elif node.module.startswith("src."):
+                mods.add(node.module.split(".")[1])
+        elif isinstance(node, ast.Import):
+            mods.update(a.name.split(".")[1] for a in node.names if a.name.startswith("src."))
+    return {m for m in mods if (SRC_DIR / f"{m}.py").exists()}
+
+def code_version(module: str) -> str:
+    """Hash of a module's source plus every src module it reaches through imports."""
+    todo, seen = [module.split(".")[-1]], set()
+    while todo:
+        m = todo.pop()
+        if m not in seen:
+            seen.add(m)
+            todo.extend(_imports(SRC_DIR / f"{m}.py"))
+    h = hashlib.sha256()
+    for m in sorted(seen):
+        h.update(m.encode())
+        h.update((SRC_DIR / f"{m}.py").read_bytes())
+    return h.hexdigest()[:16]
+
+def stage_key(s: Stage, file_index: dict, code: dict) -> str:
+    if s.module not in code:
+        code[s.module] = code_version(s.module)
+    h = hashlib.sha256(json.dumps([s.module, s.args, code[s.module]]).encode())
+    for path in s.inputs:
+        h.update(f"{path}={content_hash(Path(path), file_index) if os.path.isfile(path) else 'missing'}".encode())
+    return h.hexdigest()[:16]
+
+def _read_state(path: str) -> dict:
+    p = Path(path)
+    state = json.loads(p.read_text()) if p.exists() else {}
+    state.setdefault("files", {})
+    state.setdefault("stages", {})
+    return state
+
+def _write_state(path: str, state: dict) -> None:
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    os.replace(tmp, p)
+
+def _execute(s: Stage) -> tuple[int, str, float]:
+    t0 = time.perf_counter()
+    proc = subprocess.run(s.argv, capture_output=True, text=True)
+    return proc.returncode, proc.stdout + proc.stderr, time.perf_counter() - t0
+
+def select(stages: list[Stage], only: list[str] | None = None, start: list[str] | None = None,
+           skip: list[str] | None = None) -> tuple[set[str], set[str]]:
+    """(stages to consider, stages to force). Names match exactly or by group ('price_train'
+    covers every 'price_train:<species>'). --from forces its stages and everything downstream."""
+    names = {s.name for s in stages}
+
+    def resolve(refs):
+        out = set()
+        for r in refs or []:
+            hit = {s.name for s in stages if r in (s.name, s.group)}
+            if not hit:
+                raise SystemExit(f"Unknown stage {r!r}. Stages: {', '.join(sorted(names))}")
+            out |= hit
+        return out
+
+    chosen, forced = set(names), set()
+    if start:
+        forced = descendants(stages, resolve(start))
+        chosen = forced
+    if only:
+        chosen = chosen & resolve(only) if start else resolve(only)
+    return chosen - resolve(skip), forced
+
+def run(stages: list[Stage], only: list[str] | None = None, start: list[str] | None = None,
+        skip: list[str] | None = None, force: bool = False, workers: int | None = None,
+        dry_run: bool = False, state_path: str = STATE_PATH) -> dict[str, str]:
+    """Run the stale stages of the selection, independent ones concurrently.
+    Returns {stage: 'ran' | 'skipped' | 'failed' | 'blocked' | 'stale' (dry run)}.
+    """
+    chosen, forced = select(stages, only, start, skip)
+    if force:
+        forced = set(chosen)
+    todo = [s for s in stages if s.name in chosen]
+    state = _read_state(state_path)
+    code: dict[str, str] = {}
+    status: dict[str, str] = {}
+
+    if dry_run:
+        for s in todo:
+            # downstream of a stale stage counts as stale (its inputs will likely change)
+            fresh = (s.name not in forced and all(os.path.exists(o) for o in s.outputs)
+                     and not any(status.get(d) == "stale" for d in s.deps)
+                     and state["stages"].get(s.name) == stage_key(s, state["files"], code))
+            status[s.name] = "skipped" if fresh else "stale"
+            print(f"  {s.name:32s}{'up to date' if fresh else 'would run'}"
+                  + (f"   (after {', '.join(s.deps)})" if s.deps else ""))
+        return status
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(todo) or 1))
+    pending = {s.name: s for s in todo}
+    running: dict = {}
+    with stage("pipeline.run") as pst, ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            # a stage is ready once none of its (selected) deps is pending or running
+            for name, s in list(pending.items()):
+                waiting = [d for d in s.deps if d in pending or any(r.name == d for r, _ in running.values())]
+                if waiting:
+                    continue
+                del pending[name]
+                failed = [d for d in s.deps if status.get(d) in ("failed", "blocked")]
+                if failed:
+                    status[name] = "blocked"
+                    print(f"[{name}] blocked by failed {', '.join(failed)}")
+                    continue
+                key = stage_key(s, state["files"], code)
+                if (name not in forced and state["stages"].get(name) == key
+                        and all(os.path.exists(o) for o in s.outputs)):
+                    status[name] = "skipped"
+                    print(f"[{name}] up to date")
+                    continue
+                print(f"[{name}] running: {' '.join(s.argv[1:])}", flush=True)
+                running[pool.submit(_execute, s)] = (s, key)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                s, key = running.pop(fut)
+                rc, log, secs = fut.result()
+                if log.strip():
+                    print("\n".join(f"[{s.name}] {line}" for line in log.rstrip().splitlines()))
+                if rc != 0:
+                    status[s.name] = "failed"
+                    state["stages"].pop(s.name, None)
+                    print(f"[{s.name}] FAILED (exit {rc}) after {secs:.1f}s")
+                else:
+                    status[s.name] = "ran"
+                    state["stages"][s.name] = key
+                    print(f"[{s.name}] done in {secs:.1f}s")
+                _write_state(state_path, state)
+        pst.add(bytes_written=lambda: sum(file_bytes(o) for s in todo if status.get(s.name) == "ran" for o in s.outputs))
+    _write_state(state_path, state)
+    return status
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the stale stages of the forecasting pipeline.")
+    ap.add_argument("--only", help="Comma-separated stages (or groups, e.g. price_train) to consider")
+    ap.add_argument("--from", dest="start", help="Comma-separated stages to force, with everything downstream")
+    ap.add_argument("--skip", help="Comma-separated stages to leave out")
+    ap.add_argument("--force", action="store_true", help="Re-run every selected stage")
+    ap.add_argument("--no-synth", action="store_true",
+                    help="Real data: use the existing features/labels parquet instead of data_gen")
+    ap.add_argument("--publish", default=PUBLISH_DIR, help="GeoJSON output folder (e.g. Next.js public/predictions)")
+    ap.add_argument("--workers", type=int, default=None, help="Concurrent stages (default: CPU count)")
+    ap.add_argument("--dry-run", action="store_true", help="Print which stages would run")
+    ap.add_argument("--state", default=STATE_PATH)
+    args = ap.parse_args()
+
+    split = lambda v: [x.strip() for x in v.split(",") if x.strip()] if v else None
+    stages = default_stages(args.publish, synth=not args.no_synth)
+    status = run(stages, split(args.only), split(args.start), split(args.skip), args.force,
+                 args.workers, args.dry_run, args.state)
+    counts = {k: sum(v == k for v in status.values()) for k in dict.fromkeys(status.values())}
+    print("pipeline: " + ", ".join(f"{n} {k}" for k, n in counts.items()))
+    if any(v in ("failed", "blocked") for v in status.values()):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Week-partitioned store of precomputed hotspot probabilities.
+
+One parquet file per ISO week under ``data/processed/predictions/`` holds
+[cell_id, week, p, model_version]. A manifest records the model version and a
+fingerprint of each week's feature rows, so ``refresh`` only re-scores weeks
+whose features changed (or everything, when the model file changes). The app,
+scorer and exporter read from here instead of running the model themselves.
+Scoring goes through ``src.model_store`` (native .ubj when present, else the pickle).
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.features import FEATURES_PATH, load_features, partition_dir
+from src.fileutil import atomic_path, locked
+from src.grid import GRID_PATH, load_grid
+from src.model_store import FEATS, load_hotspot, resolve_model_path
+
+PRED_DIR = "data/processed/predictions"
+
+def _file_sig(path: str) -> list[int]:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def _manifest_path(store_dir: str) -> Path:
+    return Path(store_dir) / "manifest.json"
+
+def _read_manifest(store_dir: str) -> dict:
+    p = _manifest_path(store_dir)
+    return json.loads(p.read_text()) if p.exists() else {}
+
+def _write_manifest(store_dir: str, manifest: dict) -> None:
+    with atomic_path(_manifest_path(store_dir)) as tmp:
+        tmp.write_text(json.dumps(manifest, indent=2))
+
+def week_path(store_dir: str, week: str) -> Path:
+    """The parquet partition holding `week` in the store."""
+    return Path(store_dir) / f"{week}.parquet"
+
+def features_sig(features_path: str = FEATURES_PATH) -> list[int]:
+    """Stat signature of the features table: the base file plus its partition folder
+    (whose mtime moves whenever a week is appended or replaced)."""
+    d = partition_dir(features_path)
+    return _file_sig(features_path) + ([os.stat(d).st_mtime_ns] if d.exists() else [])
+
+def week_fingerprints(feats: pd.DataFrame) -> dict[str, str]:
+    """Order-independent hash of each week's feature rows."""
+    feats = feats.sort_values("week", kind="stable")
+    h = pd.util.hash_pandas_object(feats[["cell_id"] + FEATS], index=False).to_numpy()
+    weeks, starts, counts = np.unique(feats["week"].to_numpy(), return_index=True, return_counts=True)
+    sums = np.add.reduceat(h, starts) if len(h) else np.array([], dtype=np.uint64)
+    return {w: f"{s:016x}-{n}" for w, s, n in zip(weeks, sums, counts)}
+
+def refresh(features_path: str = FEATURES_PATH, model_path: str | None = None,
+            store_dir: str = PRED_DIR, force: bool = False, weeks: list[str] | None = None) -> list[str]:
+    """Bring the store up to date with the model and features; returns weeks re-scored.
+    When neither file changed this costs two stat calls. With `weeks`, only those weeks'
+    features are read and checked; the store stays marked out of sync, so the next full
+    refresh still checks the rest. Writers (refresh, record_week) hold the manifest lock,
+    so concurrent refreshes score each change once.
+    """
+    model_path = resolve_model_path(model_path)
+    if weeks is not None and not Path(GRID_PATH).exists():
+        weeks = None  # legacy features: the grid must be inferred from every week
+    model_sig, feats_sig = _file_sig(model_path), features_sig(features_path)
+    if not force and _in_sync(_read_manifest(store_dir), model_sig, feats_sig):
+        return []
+    with locked(_manifest_path(store_dir)):
+        manifest = _read_manifest(store_dir)  # another writer may have caught up meanwhile
+        if not force and _in_sync(manifest, model_sig, feats_sig):
+            return []
+        return _rescore(manifest, model_sig, feats_sig, features_path, model_path, store_dir, force, weeks)
+
+def _in_sync(manifest: dict, model_sig: list[int], feats_sig: list[int]) -> bool:
+    return manifest.get("model_sig") == model_sig and manifest.get("features_sig") == feats_sig
+
+def _rescore(manifest: dict, model_sig: list[int], feats_sig: list[int], features_path: str,
+             model_path: str, store_dir: str, force: bool, weeks: list[str] | None) -> list[str]:
+    version = manifest["model_version"] if manifest.get("model_sig") == model_sig else load_hotspot(model_path).version
+    feats = load_features(weeks, path=features_path)
+    grid = load_grid(df=feats)
+    if not Path(GRID_PATH).exists():
+        grid.save(GRID_PATH)  # legacy features: persist the inferred index for readers
+    feats = grid.attach(feats).dropna(subset=FEATS)
+    prints = week_fingerprints(feats)
+
+    same_version = manifest.get("model_version") == version
+    old = manifest.get("weeks", {}) if same_version and not force else {}
+    stale = [w for w, fp in prints.items() if old.get(w) != fp or not week_path(store_dir, w).exists()]
+
+    Path(store_dir).mkdir(parents=True, exist_ok=True)
+    gone = set(manifest.get("weeks", {})) - set(prints)
+    if weeks is not None:
+        gone &= set(weeks)
+    for w in gone:
+        week_path(store_dir, w).unlink(missing_ok=True)
+
+    if stale:
+        # one batched float32 inference pass over every stale week
+        out = score_frame(feats[feats["week"].isin(stale)], model_path)
+        for w, g in out.groupby("week", sort=True):
+            with atomic_path(week_path(store_dir, w)) as tmp:
+                g.to_parquet(tmp, index=False)
+
+    if weeks is not None:
+        # other weeks keep their entries only while they were scored by this model version;
+        # the old features signature (if any) can then still be trusted for them
+        kept = {w: fp for w, fp in manifest.get("weeks", {}).items() if w not in gone} if same_version else {}
+        prints = {**kept, **prints}
+        feats_sig = manifest.get("features_sig") if same_version else None
+    _write_manifest(store_dir, {
+        "model_version": version, "model_sig": model_sig,
+        "features_sig": feats_sig, "weeks": prints,
+    })
+    return stale
+
+def score_frame(feats: pd.DataFrame, model_path: str | None = None) -> pd.DataFrame:
+    """[cell_id, week, p, model_version] for feature rows (cell_id attached, no NaNs)."""
+    model = load_hotspot(resolve_model_path(model_path))
+    return pd.DataFrame({
+        "cell_id": feats["cell_id"].to_numpy(dtype=np.int32),
+        "week": feats["week"].to_numpy(),
+        "p": model.predict_frame(feats),
+        "model_version": model.version,
+    })
+
+def record_week(week: str, fingerprint: str, sig_before: list[int], features_path: str = FEATURES_PATH,
+                model_path: str | None = None, store_dir: str = PRED_DIR) -> None:
+    """Enter one freshly scored, appended week in the manifest. When the store was in sync
+    with the features before the append (`sig_before`) and the model is unchanged, the
+    new features signature is recorded too, so the next refresh stays a stat-only no-op;
+    otherwise refresh re-checks every week as usual (and keeps this one if it matches).
+    """
+    model_sig = _file_sig(resolve_model_path(model_path))
+    with locked(_manifest_path(store_dir)):
+        manifest = _read_manifest(store_dir)
+        if manifest.get("features_sig") == sig_before and manifest.get("model_sig") == model_sig:
+            manifest["features_sig"] = features_sig(features_path)
+        manifest.setdefault("weeks", {})[week] = fingerprint
+        _write_manifest(store_dir, manifest)
+
+def load_predictions(weeks: list[str] | None = None, store_dir: str = PRED_DIR,
+                     auto_refresh: bool = True) -> pd.DataFrame:
+    """Read [cell_id, week, p, model_version] for `weeks` (all stored weeks if None),
+    first re-scoring any of them that are stale unless `auto_refresh` is off."""
+    if auto_refresh:
+        refresh(store_dir=store_dir, weeks=weeks)
+    if weeks is None:
+        weeks = sorted(_read_manifest(store_dir).get("weeks", {}))
+    paths = [week_path(store_dir, w) for w in weeks]
+    paths = [p for p in paths if p.exists()]
+    if not paths:
+        return pd.DataFrame({"cell_id": pd.Series(dtype=np.int32), "week": pd.Series(dtype=str),
+                             "p": pd.Series(dtype=float), "model_version": pd.Series(dtype=str)})
+    return pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+
+def attach_predictions(df: pd.DataFrame, store_dir: str = PRED_DIR) -> pd.DataFrame:
+    """Add the stored p to feature rows (joined on week + cell_id)."""
+    preds = load_predictions(sorted(df["week"].unique()), store_dir)
+    return df.merge(preds[["week", "cell_id", "p"]], on=["week", "cell_id"], how="left")
+
+def main():
+    ap = argparse.ArgumentParser(description="Refresh the precomputed hotspot prediction store.")
+    ap.add_argument("--force", action="store_true", help="Re-score every week")
+    args = ap.parse_args()
+    weeks = refresh(force=args.force)
+    print(f"Re-scored {len(weeks)} week(s) -> {PRED_DIR}" if weeks else "Prediction store is up to date.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# src/price_backtest.py
+"""Walk-forward backtest for the price models.
+
+Every weekly origin t refits the regressor and direction classifier on the rows
+of the preceding `window` weeks (expanding if None), then predicts the rows of
+week t. Origins run in parallel on a process pool; the feature matrix from
+price_features is loaded once and handed to each worker once. With warm_trees,
+origins are split into contiguous chains and each origin after a chain's first
+adds `warm_trees` trees to the previous forest (warm_start) instead of refitting
+from scratch. Writes per-week, per-port, per-fold (timing) and per-row tables.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+
+from src import isoweek
+from src.price_features import feature_columns
+from src.price_train import CLF_PARAMS, REG_PARAMS
+
+_DATA: dict = {}  # per-worker feature matrix, set once by _init_worker
+
+def _init_worker(data: dict) -> None:
+    global _DATA
+    _DATA = data
+
+def _forests(trees: int | None, n_jobs: int, warm: bool):
+    reg = {**REG_PARAMS, **({"n_estimators": trees} if trees else {})}
+    clf = {**CLF_PARAMS, **({"n_estimators": trees} if trees else {})}
+    return (RandomForestRegressor(**reg, n_jobs=n_jobs, warm_start=warm),
+            RandomForestClassifier(**clf, n_jobs=n_jobs, warm_start=warm))
+
+def _run_chain(job: tuple) -> list[dict]:
+    """Origins of one chain, in order; refits (or warm-extends) at each origin."""
+    chain, origins, window, trees, warm_trees, n_jobs = job
+    X, y, up, widx = _DATA["X"], _DATA["y"], _DATA["up"], _DATA["widx"]
+    out, reg, clf = [], None, None
+    for t in origins:
+        t0 = time.perf_counter()
+        lo = t - window if window else widx.min()
+        tr = (widx >= lo) & (widx < t)
+        te = np.flatnonzero(widx == t)
+        if reg is None or not warm_trees:
+            reg, clf = _forests(trees, n_jobs, warm=bool(warm_trees))
+        else:
+            reg.n_estimators += warm_trees
+            clf.n_estimators += warm_trees
+        reg.fit(X[tr], y[tr])
+        clf.fit(X[tr], up[tr])
+        t1 = time.perf_counter()
+        pred, pred_up = reg.predict(X[te]), clf.predict(X[te])
+        out.append({
+            "chain": chain, "origin": isoweek.to_str(t), "n_train": int(tr.sum()), "n_test": len(te),
+            "n_trees": reg.n_estimators, "fit_seconds": t1 - t0,
+            "predict_seconds": time.perf_counter() - t1, "rows": te, "pred": pred, "pred_up": pred_up,
+        })
+    return out
+
+def backtest(features_csv: Path, window: int | None = 26, min_train_weeks: int = 8,
+             trees: int | None = None, warm_trees: int = 0, chains: int | None = None,
+             workers: int | None = None) -> dict[str, pd.DataFrame]:
+    """Walk-forward evaluation over every week with >= min_train_weeks of history.
+    Returns {"predictions", "weekly", "ports", "folds"} frames.
+    """
+    df = pd.read_csv(features_csv)
+    widx = isoweek.to_index(df["week"])
+    data = {
+        "X": df[feature_columns()].to_numpy(dtype=float),
+        "y": df["price_next"].to_numpy(dtype=float),
+        "up": (df["price_next"].to_numpy() > df["price_pen_perkg"].to_numpy()).astype(int),
+        "widx": widx,
+    }
+    weeks = np.unique(widx)
+    origins = weeks[weeks >= weeks.min() + min_train_weeks]
+    if not len(origins):
+        raise SystemExit(f"Need more than {min_train_weeks} weeks of features for a backtest")
+
+    cpus = os.cpu_count() or 1
+    if warm_trees:
+        # warm-started forests carry state from origin to origin: parallelize across chains
+        n_chains = max(1, min(chains or cpus, len(origins)))
+        groups = np.array_split(origins, n_chains)
+    else:
+        groups = [[t] for t in origins]
+    workers = max(1, min(workers or cpus, len(groups), cpus))
+    n_jobs = max(1, cpus // workers)
+    jobs = [(i, list(g), window, trees, warm_trees, n_jobs) for i, g in enumerate(groups)]
+    print(f"backtest: {len(origins)} origins in {len(groups)} chain(s) on {workers} workers x {n_jobs} cores")
+
+    t0 = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as pool:
+            results = [f for chain in pool.map(_run_chain, jobs) for f in chain]
+    else:
+        _init_worker(data)
+        results = [f for job in jobs for f in _run_chain(job)]
+    wall = time.perf_counter() - t0
+
+    rows = np.concatenate([f["rows"] for f in results])
+    pred = df.iloc[rows][["week", "port", "price_pen_perkg", "price_next"]].reset_index(drop=True)
+    pred["pred_price_next"] = np.concatenate([f["pred"] for f in results])
+    pred["abs_err"] = (pred["pred_price_next"] - pred["price_next"]).abs()
+    pred["up"] = data["up"][rows]
+    pred["pred_up"] = np.concatenate([f["pred_up"] for f in results])
+    pred["dir_hit"] = (pred["up"] == pred["pred_up"]).astype(int)
+
+    def _errors(by: str) -> pd.DataFrame:
+        return pred.groupby(by, sort=True).agg(
+            n=("abs_err", "size"), mae=("abs_err", "mean"), directional_acc=("dir_hit", "mean"),
+        ).reset_index()
+
+    folds = pd.DataFrame([{k: v for k, v in f.items() if k not in ("rows", "pred", "pred_up")} for f in results])
+    print(f"backtest: MAE={pred['abs_err'].mean():.4f}  directional_acc={pred['dir_hit'].mean():.3f}  "
+          f"wall={wall:.2f}s  fit_total={folds['fit_seconds'].sum():.2f}s")
+    return {"predictions": pred, "weekly": _errors("week"), "ports": _errors("port"), "folds": folds}
+
+def main():
+    ap = argparse.ArgumentParser("Walk-forward backtest of the price models")
+    ap.add_argument("--species", default="anchoveta")
+    ap.add_argument("--features_csv", default=None, help="Default: data/processed/<species>_price_features.csv")
+    ap.add_argument("--window", type=int, default=26, help="Training window in weeks (0 = expanding)")
+    ap.add_argument("--min-train-weeks", type=int, default=8)
+    ap.add_argument("--trees", type=int, default=None, help="Trees per forest (default: price_train's)")
+    ap.add_argument("--warm-trees", type=int, default=0, help="Warm-start: trees added per origin instead of refitting")
+    ap.add_argument("--chains", type=int, default=None, help="Parallel warm-start chains (default: CPU count)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--out_dir", default="outputs")
+    args = ap.parse_args()
+
+    features_csv = Path(args.features_csv or f"data/processed/{args.species}_price_features.csv")
+    tables = backtest(features_csv, args.window or None, args.min_train_weeks, args.trees,
+                      args.warm_trees, args.chains, args.workers)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, table in tables.items():
+        path = out_dir / f"{args.species}_price_backtest_{name}.csv"
+        table.to_csv(path, index=False)
+        print(f"Wrote -> {path}")
+
+if __name__ == "__main__":
+    main()
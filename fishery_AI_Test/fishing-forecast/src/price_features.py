@@ -3,114 +3,86 @@ import argparse
 from pathlib import Path
 import numpy as np
 import pandas as pd
-import unicodedata as ud
-import re
-
-def _norm(s: str) -> str:
-    # normalize: lowercase, no accents, spaces/dashes -> underscores
-    s = "".join(c for c in ud.normalize("NFKD", s) if not ud.combining(c))
-    return s.strip().lower().replace(" ", "_").replace("-", "_")
-
-def _read_flex(path: Path) -> pd.DataFrame:
-    # sep=None lets pandas sniff commas/semicolons/tabs; utf-8-sig handles BOM
-    return pd.read_csv(path, sep=None, engine="python", encoding="utf-8-sig")
-
-def _first(cols, candidates):
-    for c in candidates:
-        if c in cols:
-            return c
-    return None
-
-def _is_iso_week_strings(series: pd.Series) -> bool:
-    s = series.astype(str)
-    # exact ISO like 2024-W30
-    return s.str.match(r"^\d{4}-W\d{2}$").all()
-
-def ensure_week(df: pd.DataFrame) -> pd.DataFrame:
-    cols = set(df.columns)
-    # 1) already has 'week'
-    if "week" in cols:
-        # if it's already ISO 'YYYY-Www', keep as-is; don't try to parse
-        if _is_iso_week_strings(df["week"]):
-            return df
-        # if it's date-like, convert to ISO week
-        try:
-            d = pd.to_datetime(df["week"], errors="coerce")
-            mask = d.notna()
-            if mask.any():
-                iso = d.dt.isocalendar()
-                df.loc[mask, "week"] = [f"{y}-W{w:02d}" for y, w in zip(iso.year, iso.week)]
-        except Exception:
-            pass
-        return df
-
-    # 2) target_week present
-    if "target_week" in cols:
-        df["week"] = df["target_week"]
-        return df
-
-    # 3) date/fecha present
-    dcol = _first(cols, ["fecha", "date", "week_date", "fecha_semana"])
-    if dcol:
-        d = pd.to_datetime(df[dcol], errors="coerce")
-        iso = d.dt.isocalendar()
-        df["week"] = [f"{y}-W{w:02d}" for y, w in zip(iso.year, iso.week)]
-        return df
-
-    # 4) year + semana/weeknum present
-    ycol = _first(cols, ["year", "anio", "ano"])
-    wcol = _first(cols, ["semana", "semana_num", "week_num", "weeknumber", "weekn"])
-    if ycol and wcol:
-        df["week"] = df.apply(lambda r: f"{int(r[ycol])}-W{int(r[wcol]):02d}", axis=1)
-        return df
-
-    raise SystemExit("Could not determine 'week'. Provide one of: week | target_week | fecha/date | year+semana.")
-
-def week_to_date(week_str: str) -> pd.Timestamp:
-    # Monday of ISO week
-    return pd.to_datetime(str(week_str) + "-1", format="%G-W%V-%u")
-
-def add_lags(df: pd.DataFrame, col: str, by="port", lags=(1,2,4,8)) -> pd.DataFrame:
-    g = df.sort_values([by, "week_dt"]).copy()
-    for L in lags:
-        g[f"{col}_lag{L}"] = g.groupby(by)[col].shift(L)
-    return g
-
-def add_rolls(df: pd.DataFrame, col: str, by="port", win=4) -> pd.DataFrame:
-    g = df.sort_values([by, "week_dt"]).copy()
-    g[f"{col}_rollmean{win}"] = g.groupby(by)[col].shift(1).rolling(win).mean().reset_index(level=0, drop=True)
-    g[f"{col}_rollstd{win}"]  = g.groupby(by)[col].shift(1).rolling(win).std().reset_index(level=0, drop=True)
-    return g
-
-def build_features(price_csv: Path, land_csv: Path, pred_csv: Path|None, out_path: Path) -> pd.DataFrame:
-    out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # Load and normalize column names
-    price = _read_flex(price_csv); price.columns = [_norm(c) for c in price.columns]
-    land  = _read_flex(land_csv);  land.columns  = [_norm(c) for c in land.columns]
-    pred = None
-    if pred_csv and Path(pred_csv).exists():
-        pred = _read_flex(pred_csv); pred.columns = [_norm(c) for c in pred.columns]
-
-    # Map common synonyms -> canonical names
-    price = price.rename(columns={
-        _first(price.columns, ["puerto","port_name","harbor"]) or "port": "port",
-        _first(price.columns, ["precio_pen_kg","precio_pen","precio","price"]) or "price_pen_perkg": "price_pen_perkg",
-    })
-    price = ensure_week(price)
-
-    land = land.rename(columns={
-        _first(land.columns, ["puerto","port_name","harbor"]) or "port": "port",
-        _first(land.columns, ["desembarques_ton","capturas_ton","toneladas","landings"]) or "landings_tons": "landings_tons",
-    })
-    land = ensure_week(land)
+from src import isoweek
+from src.ingest import CACHE_DIR, load_table
+from src.instrument import file_bytes, stage
+
+# Per-column lag/rolling configuration; columns are emitted lags first, then rolls
+LAG_SPEC = {"price_pen_perkg": (1, 2, 4, 8), "landings_tons": (1, 2, 4)}
+ROLL_SPEC = {"price_pen_perkg": (4,)}   # mean/std over the previous `win` weeks (excludes current)
+GROUP_KEYS = ("port",)                  # e.g. ("species", "port") for multi-species frames
+EXTRA_FEATURES = ["pred_landings_t1", "woy_sin", "woy_cos", "month"]
+
+def feature_columns(lag_spec: dict = LAG_SPEC, roll_spec: dict = ROLL_SPEC) -> list[str]:
+    cols = []
+    for col in dict.fromkeys([*lag_spec, *roll_spec]):
+        cols += [f"{col}_lag{L}" for L in lag_spec.get(col, ())]
+        for win in roll_spec.get(col, ()):
+            cols += [f"{col}_rollmean{win}", f"{col}_rollstd{win}"]
+    return cols + EXTRA_FEATURES
+
+def _group_shift(x: np.ndarray, pos: np.ndarray, size: np.ndarray, k: int) -> np.ndarray:
+    """x shifted by k rows within contiguous groups (pos = row's index in its group)."""
+    out = np.full(len(x), np.nan)
+    if k > 0:
+        out[k:] = x[:-k]
+        out[pos < k] = np.nan
+    elif k < 0:
+        out[:k] = x[-k:]
+        out[pos - k >= size] = np.nan
+    else:
+        out[:] = x
+    return out
+
+def add_lag_roll_features(df: pd.DataFrame, lag_spec: dict = LAG_SPEC, roll_spec: dict = ROLL_SPEC,
+                          by=GROUP_KEYS, order: str = "week_idx") -> pd.DataFrame:
+    """Every configured lag, rolling mean/std and the next-week price target in one pass:
+    one sort, one grouped row numbering, then pure array shifts per column.
+    Rolling windows are built from the group-aware lags, so they never span two groups.
+    """
+    df = df.sort_values([*by, order], kind="stable").reset_index(drop=True)
+    grp = df.groupby(list(by), sort=False)
+    pos = grp.cumcount().to_numpy()
+    size = grp[order].transform("size").to_numpy()
+    new = {}
+    for col in dict.fromkeys([*lag_spec, *roll_spec]):
+        x = df[col].to_numpy(dtype=float)
+        need = set(lag_spec.get(col, ()))
+        wins = roll_spec.get(col, ())
+        need.update(range(1, max(wins, default=0) + 1))
+        lag = {L: _group_shift(x, pos, size, L) for L in sorted(need)}
+        for L in lag_spec.get(col, ()):
+            new[f"{col}_lag{L}"] = lag[L]
+        for win in wins:
+            w = np.column_stack([lag[L] for L in range(1, win + 1)])  # NaN if any lag is missing
+            new[f"{col}_rollmean{win}"] = w.mean(axis=1)
+            new[f"{col}_rollstd{win}"] = w.std(axis=1, ddof=1) if win > 1 else np.full(len(df), np.nan)
+    new["price_next"] = _group_shift(df["price_pen_perkg"].to_numpy(dtype=float), pos, size, -1)
+    return pd.concat([df, pd.DataFrame(new, index=df.index)], axis=1)
+
+def lookback(lag_spec: dict = LAG_SPEC, roll_spec: dict = ROLL_SPEC) -> int:
+    """Preceding rows per group that the deepest lag / rolling window reaches back."""
+    return max([*(L for v in lag_spec.values() for L in v), *(w for v in roll_spec.values() for w in v)], default=0)
+
+def load_merged(price_csv: Path, land_csv: Path, pred_csv: Path|None,
+                cache_dir: str | None = CACHE_DIR, upto_week: str | None = None,
+                tail_rows: int | None = None) -> pd.DataFrame:
+    """Prices joined with landings and predicted landings t+1, plus week_idx / week_dt.
+    With upto_week, only each port's last `tail_rows` price rows up to that week are kept.
+    """
+    # Sniffed, typed and cached reads -> canonical [week, port, ...] columns
+    with stage("price_features.load") as st:
+        price = load_table(price_csv, "price", cache_dir)
+        land  = load_table(land_csv, "landings", cache_dir)
+        pred = None
+        if pred_csv and Path(pred_csv).exists():
+            pred = load_table(pred_csv, "pred_landings", cache_dir)
+        st.add(rows_out=len(price) + len(land) + (len(pred) if pred is not None else 0),
+               bytes_read=lambda: file_bytes(price_csv, land_csv, *([pred_csv] if pred is not None else [])))
 
     # predicted landings t+1 (optional)
     if pred is not None:
-        pred = pred.rename(columns={
-            _first(pred.columns, ["puerto","port_name","harbor"]) or "port": "port",
-        })
-        pred = ensure_week(pred)
         if "pred_landings_t1" not in pred.columns:
             if "landings_tons" in pred.columns:
                 pred = pred.sort_values(["port","week"])
@@ -126,38 +98,54 @@ def build_features(price_csv: Path, land_csv: Path, pred_csv: Path|None, out_pat
     # Keep only needed columns and merge
     price = price[["week","port","price_pen_perkg"]].copy()
     land  = land[["week","port","landings_tons"]].copy()
+    if upto_week is not None:
+        price = price[isoweek.to_index(price["week"]) <= isoweek.to_index(upto_week)]
+        price = price.sort_values(["port", "week"], kind="stable").groupby("port").tail(tail_rows)
 
     df = price.merge(land, on=["week","port"], how="left").merge(pred, on=["week","port"], how="left")
 
     # 🔧 Create a single week_dt AFTER merge (avoid week_dt_x/week_dt_y)
-    df["week_dt"] = df["week"].apply(week_to_date)
-
-    df = df.sort_values(["port","week_dt"]).reset_index(drop=True)
-
-    # Feature engineering
-    df = df.groupby("port", group_keys=False).apply(add_lags, col="price_pen_perkg", lags=[1,2,4,8])
-    df = df.groupby("port", group_keys=False).apply(add_lags, col="landings_tons", lags=[1,2,4])
-    df = df.groupby("port", group_keys=False).apply(add_rolls, col="price_pen_perkg", win=4)
+    df["week_idx"] = isoweek.to_index(df["week"])
+    df["week_dt"] = isoweek.monday(df["week_idx"].to_numpy())
+    return df
 
-    wk = df["week_dt"].dt.isocalendar().week.astype(int)
+def _add_calendar(df: pd.DataFrame) -> pd.DataFrame:
+    widx = df.pop("week_idx").to_numpy()
+    wk = isoweek.week_of_year(widx)
     df["woy_sin"] = np.sin(2*np.pi*wk/52.0)
     df["woy_cos"] = np.cos(2*np.pi*wk/52.0)
-    df["month"]   = df["week_dt"].dt.month
+    df["month"]   = isoweek.month(widx)
+    return df
 
-    df["price_next"] = df.groupby("port")["price_pen_perkg"].shift(-1)
+def build_features(price_csv: Path, land_csv: Path, pred_csv: Path|None, out_path: Path,
+                   cache_dir: str | None = CACHE_DIR) -> pd.DataFrame:
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    df = load_merged(price_csv, land_csv, pred_csv, cache_dir)
+
+    # Feature engineering: all lags/rolls per port + price_next in one sorted pass
+    with stage("price_features.lags", rows_in=len(df)):
+        df = add_lag_roll_features(df)
+    df = _add_calendar(df)
 
-    features = [
-        "price_pen_perkg_lag1","price_pen_perkg_lag2","price_pen_perkg_lag4","price_pen_perkg_lag8",
-        "price_pen_perkg_rollmean4","price_pen_perkg_rollstd4",
-        "landings_tons_lag1","landings_tons_lag2","landings_tons_lag4",
-        "pred_landings_t1","woy_sin","woy_cos","month"
-    ]
+    features = feature_columns()
     model_df = df.dropna(subset=features + ["price_next"]).reset_index(drop=True)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    model_df.to_csv(out_path, index=False)
+    with stage("price_features.write", rows_in=len(df), rows_out=len(model_df)) as st:
+        model_df.to_csv(out_path, index=False)
+        st.add(bytes_written=lambda: file_bytes(out_path))
     print(f"Wrote features -> {out_path}  rows={len(model_df)}")
     return model_df
 
+def week_features(price_csv: Path, land_csv: Path, pred_csv: Path|None, week: str,
+                  cache_dir: str | None = CACHE_DIR) -> pd.DataFrame:
+    """Feature rows of one week (one per port with complete features), computed from only
+    the trailing rows each port needs, so the cost does not grow with history.
+    price_next is NaN for the newest week; these are the rows to forecast from.
+    """
+    df = load_merged(price_csv, land_csv, pred_csv, cache_dir, upto_week=week, tail_rows=lookback() + 1)
+    df = _add_calendar(add_lag_roll_features(df))
+    return df[df["week"] == week].dropna(subset=feature_columns()).reset_index(drop=True)
+
 def main():
     ap = argparse.ArgumentParser("Build weekly price features")
     ap.add_argument("--species", default="anchoveta")
@@ -165,8 +153,10 @@ def main():
     ap.add_argument("--land_csv",  default="data/landings/anchoveta_landings.csv")
     ap.add_argument("--pred_csv",  default="data/landings/predicted_landings.csv")
     ap.add_argument("--out",       default="data/processed/anchoveta_price_features.csv")
+    ap.add_argument("--no-cache",  action="store_true", help=f"Re-parse the CSVs instead of using {CACHE_DIR}")
     args = ap.parse_args()
-    build_features(Path(args.price_csv), Path(args.land_csv), Path(args.pred_csv), Path(args.out))
+    build_features(Path(args.price_csv), Path(args.land_csv), Path(args.pred_csv), Path(args.out),
+                   cache_dir=None if args.no_cache else CACHE_DIR)
 
 if __name__ == "__main__":
     main()
@@ -1,72 +1,113 @@
 # src/price_train.py
 import argparse, os, json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
-from sklearn.metrics import mean_absolute_error
 import joblib
 
-def train_and_forecast(features_csv: Path, species: str,
-                       model_dir: Path, out_dir: Path,
-                       publish_dir: Path|None = None):
-    model_dir.mkdir(parents=True, exist_ok=True)
-    out_dir.mkdir(parents=True, exist_ok=True)
-    if publish_dir:
-        publish_dir.mkdir(parents=True, exist_ok=True)
+from src import isoweek
+from src.instrument import file_bytes, stage
+from src.model_pack import PACK_COMPRESS, PackedForest, load_price_model
+from src.price_features import build_features, feature_columns
+
+PRICE_DIR     = "data/price"
+LANDINGS_DIR  = "data/landings"
+PROCESSED_DIR = "data/processed"
 
+REG_PARAMS = dict(n_estimators=500, max_depth=7, random_state=0)
+CLF_PARAMS = dict(n_estimators=400, max_depth=7, random_state=0)
+QUANTILES  = (0.1, 0.5, 0.9)   # per-tree empirical quantiles stored with each forecast
+DEFAULT_SIGMA = 0.15           # rough 1-sigma band when the holdout is too small to measure one
+
+def load_split(features_csv: Path):
+    """(df, X, y, split): the feature table, its matrices, and where the holdout starts."""
     df = pd.read_csv(features_csv)
-    features = [
-        "price_pen_perkg_lag1","price_pen_perkg_lag2","price_pen_perkg_lag4","price_pen_perkg_lag8",
-        "price_pen_perkg_rollmean4","price_pen_perkg_rollstd4",
-        "landings_tons_lag1","landings_tons_lag2","landings_tons_lag4",
-        "pred_landings_t1","woy_sin","woy_cos","month"
-    ]
-    X = df[features].values
+    X = df[feature_columns()].values
     y = df["price_next"].values
-
     # time-ordered split (last 20% as holdout)
     split = int(len(df)*0.8)
-    X_tr, X_te = X[:split], X[split:]
-    y_tr, y_te = y[:split], y[split:]
-
-    # Regressor for next-week price
-    reg = RandomForestRegressor(n_estimators=500, max_depth=7, random_state=0)
-    reg.fit(X_tr, y_tr)
-    y_pred = reg.predict(X_te)
-    mae = float(mean_absolute_error(y_te, y_pred))
-
-    # Direction classifier (Up/Down vs current)
-    curr = df["price_pen_perkg"].values
-    dir_up = (y > curr).astype(int)
-    clf = RandomForestClassifier(n_estimators=400, max_depth=7, random_state=0)
-    clf.fit(X_tr, dir_up[:split])
-    dir_pred = clf.predict(X_te)
-    dir_acc = float((dir_pred == dir_up[split:]).mean())
-
-    # Save models
-    reg_path = model_dir / f"{species}_price_rf.pkl"
-    cls_path = model_dir / f"{species}_price_dir_rf.pkl"
-    joblib.dump(reg, reg_path)
-    joblib.dump(clf, cls_path)
-    print(f"Saved models -> {reg_path.name}, {cls_path.name}")
-
+    return df, X, y, split
+
+def price_model_path(model_dir: Path, species: str, kind: str) -> Path:
+    """Pickle of one species' regressor (kind='reg') or direction classifier (kind='clf')."""
+    return model_dir / (f"{species}_price_rf.pkl" if kind == "reg" else f"{species}_price_dir_rf.pkl")
+
+def fit_model(features_csv: Path, species: str, kind: str, model_dir: Path, n_jobs: int = 1):
+    """Fit + save one species' next-week price regressor (kind='reg') or Up/Down
+    direction classifier (kind='clf'). Returns (model, holdout metric).
+    """
+    df, X, y, split = load_split(features_csv)
+    with stage(f"price_train.fit_{kind}", rows_in=split, bytes_read=lambda: file_bytes(features_csv)) as st:
+        if kind == "reg":
+            model = RandomForestRegressor(**REG_PARAMS, n_jobs=n_jobs)
+            model.fit(X[:split], y[:split])
+            resid = y[split:] - model.predict(X[split:])
+            metric = float(np.mean(np.abs(resid)))
+            extra = {"sigma": float(np.std(resid)) if len(resid) > 1 else DEFAULT_SIGMA}
+        else:
+            # Direction classifier (Up/Down vs current)
+            dir_up = (y > df["price_pen_perkg"].values).astype(int)
+            model = RandomForestClassifier(**CLF_PARAMS, n_jobs=n_jobs)
+            model.fit(X[:split], dir_up[:split])
+            metric = float((model.predict(X[split:]) == dir_up[split:]).mean())
+            extra = {}
+        model_dir.mkdir(parents=True, exist_ok=True)
+        path = price_model_path(model_dir, species, kind)
+        joblib.dump(model, path, compress=PACK_COMPRESS)
+        # holdout metric next to the model, for forecasts made later without refitting
+        _metric_path(path).write_text(json.dumps({"metric": metric, **extra}))
+        st.add(bytes_written=lambda: file_bytes(path))
+    return model, metric
+
+def _metric_path(model_path: Path) -> Path:
+    return Path(model_path).with_suffix(".metric.json")
+
+def load_metric(model_path: Path) -> float:
+    """Holdout metric saved by fit_model (NaN for models fitted before it was recorded)."""
+    p = _metric_path(model_path)
+    return float(json.loads(p.read_text())["metric"]) if p.exists() else float("nan")
+
+def load_sigma(model_path: Path) -> float:
+    """1-sigma of the regressor's holdout residuals saved by fit_model (DEFAULT_SIGMA if absent)."""
+    p = _metric_path(model_path)
+    return float(json.loads(p.read_text()).get("sigma", DEFAULT_SIGMA)) if p.exists() else DEFAULT_SIGMA
+
+def tree_predictions(reg: RandomForestRegressor, X: np.ndarray) -> np.ndarray:
+    """(n_trees, n_rows) per-tree predictions in one batched pass: X is validated and
+    cast to float32 once, then each tree predicts every row without re-checking it.
+    """
+    if isinstance(reg, PackedForest):
+        return reg.tree_predictions(X)
+    X32 = np.ascontiguousarray(X, dtype=np.float32)
+    return np.stack([est.predict(X32, check_input=False) for est in reg.estimators_])
+
+def forecast(features_csv: Path, species: str, reg, clf, mae: float, dir_acc: float,
+             sigma: float = DEFAULT_SIGMA) -> pd.DataFrame:
+    df = pd.read_csv(features_csv)
     # Forecast next week for each port (use the last available row per port)
-    last_rows = df.groupby("port", as_index=False).tail(1).copy()
-    pred_vals = reg.predict(last_rows[features].values)
-    dir_vals  = clf.predict(last_rows[features].values)
+    return forecast_rows(df.groupby("port", as_index=False).tail(1).copy(), species, reg, clf, mae, dir_acc, sigma)
+
+def forecast_rows(last_rows: pd.DataFrame, species: str, reg, clf, mae: float, dir_acc: float,
+                  sigma: float = DEFAULT_SIGMA) -> pd.DataFrame:
+    """Next-week forecast per port from each port's latest feature row.
+    lower_1sd / upper_1sd are the point forecast -/+ `sigma`, the 1-sigma of the
+    regressor's holdout residuals (same width for every port); price_p10/p50/p90
+    are per-port quantiles of the individual trees' predictions.
+    """
+    features = feature_columns()
+    with stage("price_train.predict", rows_in=len(last_rows)):
+        per_tree = tree_predictions(reg, last_rows[features].values)
+        pred_vals = per_tree.mean(axis=0)
+        dir_vals  = clf.predict(last_rows[features].values)
 
     # Compute the target ISO week (last week + 1)
-    def week_to_date(week_str: str) -> pd.Timestamp:
-        return pd.to_datetime(week_str + "-1", format="%G-W%V-%u")
     last_week = last_rows["week"].iloc[0]
-    target_week_dt = week_to_date(last_week) + pd.Timedelta(days=7)
-    iso = target_week_dt.isocalendar()
-    target_week = f"{iso.year}-W{iso.week:02d}"
+    target_week = isoweek.add_weeks(last_week, 1)
 
-    # Rough uncertainty: 1-sigma of validation residuals
-    resid = y_te - y_pred
-    sigma = float(np.std(resid)) if len(resid) > 1 else 0.15
+    # Per-port spread of the trees (same pass as the point forecast)
+    qs = np.quantile(per_tree, QUANTILES, axis=0)
 
     out = pd.DataFrame({
         "species": species.capitalize(),
@@ -78,26 +119,112 @@ def train_and_forecast(features_csv: Path, species: str,
         "directional_acc_val": round(dir_acc, 3),
         "lower_1sd": np.round(pred_vals - sigma, 3),
         "upper_1sd": np.round(pred_vals + sigma, 3),
-    }).sort_values("port")
-
-    # Save outputs
-    csv_path  = out_dir / f"{species}_price_forecast_{target_week}.csv"
-    json_path = out_dir / f"{species}_price_forecast_{target_week}.json"
-    out.to_csv(csv_path, index=False)
-    out.to_json(json_path, orient="records", indent=2)
+    })
+    for q, vals in zip(QUANTILES, qs):
+        out[f"price_p{round(q * 100):02d}"] = np.round(vals, 3)
+    return out.sort_values("port")
+
+def _write_forecast(out: pd.DataFrame, name: str, out_dir: Path, publish_dir: Path|None) -> None:
+    csv_path  = out_dir / f"{name}.csv"
+    json_path = out_dir / f"{name}.json"
+    with stage("price_train.write", rows_in=len(out)) as st:
+        out.to_csv(csv_path, index=False)
+        out.to_json(json_path, orient="records", indent=2)
+        st.add(bytes_written=lambda: file_bytes(csv_path, json_path))
     print(f"Wrote -> {csv_path.name} and {json_path.name}")
 
     # Optional: publish JSON to Next.js public/prices
     if publish_dir:
-        pub_json = publish_dir / f"{species}_price_forecast_{target_week}.json"
+        pub_json = publish_dir / f"{name}.json"
         out.to_json(pub_json, orient="records", indent=2)
         print(f"Published to Next public -> {pub_json}")
 
+def train_and_forecast(features_csv: Path, species: str,
+                       model_dir: Path, out_dir: Path,
+                       publish_dir: Path|None = None, n_jobs: int = 1):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if publish_dir:
+        publish_dir.mkdir(parents=True, exist_ok=True)
+
+    reg, mae = fit_model(features_csv, species, "reg", model_dir, n_jobs)
+    clf, dir_acc = fit_model(features_csv, species, "clf", model_dir, n_jobs)
+    print(f"Saved models -> {price_model_path(model_dir, species, 'reg').name}, {price_model_path(model_dir, species, 'clf').name}")
+
+    out = forecast(features_csv, species, reg, clf, mae, dir_acc, load_sigma(price_model_path(model_dir, species, "reg")))
+    _write_forecast(out, f"{species}_price_forecast_{out['target_week'].iloc[0]}", out_dir, publish_dir)
     return out
 
+def discover_species(price_dir: str = PRICE_DIR) -> list[str]:
+    """Species with a `<species>_prices.csv` under price_dir."""
+    return sorted(p.name[:-len("_prices.csv")] for p in Path(price_dir).glob("*_prices.csv"))
+
+def species_features(species: str, price_dir: str = PRICE_DIR, landings_dir: str = LANDINGS_DIR,
+                     processed_dir: str = PROCESSED_DIR) -> Path:
+    """Build `<species>_price_features.csv` from the species' price/landings CSVs.
+    Predicted landings come from `<species>_predicted_landings.csv`, else the shared file.
+    """
+    land = Path(landings_dir)
+    pred = land / f"{species}_predicted_landings.csv"
+    if not pred.exists():
+        pred = land / "predicted_landings.csv"
+    out = Path(processed_dir) / f"{species}_price_features.csv"
+    build_features(Path(price_dir) / f"{species}_prices.csv", land / f"{species}_landings.csv", pred, out)
+    return out
+
+def _fit_job(job: tuple) -> tuple:
+    features_csv, species, kind, model_dir, n_jobs = job
+    _, metric = fit_model(features_csv, species, kind, model_dir, n_jobs)
+    return species, kind, metric
+
+def train_all(species: list[str] | None = None, model_dir: Path = Path("models"),
+              out_dir: Path = Path("outputs"), publish_dir: Path|None = None,
+              workers: int | None = None, price_dir: str = PRICE_DIR,
+              landings_dir: str = LANDINGS_DIR, processed_dir: str = PROCESSED_DIR) -> pd.DataFrame:
+    """Train every species' regressor and direction classifier concurrently.
+    The (species, model) fits run on a process pool; cores are split between pool
+    workers and each forest's n_jobs. Per-species forecasts are written as before,
+    plus one consolidated `price_forecast_<week>` table covering all species.
+    """
+    species = species or discover_species(price_dir)
+    if not species:
+        raise SystemExit(f"No *_prices.csv found under {price_dir}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if publish_dir:
+        publish_dir.mkdir(parents=True, exist_ok=True)
+    with stage("price_train.features"):
+        csvs = {sp: species_features(sp, price_dir, landings_dir, processed_dir) for sp in species}
+
+    cpus = os.cpu_count() or 1
+    n_fits = 2 * len(species)
+    workers = max(1, min(workers or cpus, n_fits, cpus))
+    n_jobs = max(1, cpus // workers)
+    jobs = [(csvs[sp], sp, kind, model_dir, n_jobs) for sp in species for kind in ("reg", "clf")]
+    print(f"training {len(species)} species ({n_fits} forests) on {workers} workers x {n_jobs} cores")
+    with stage("price_train.fit_all"):
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_fit_job, jobs))
+        else:
+            results = [_fit_job(j) for j in jobs]
+    metrics = {(sp, kind): m for sp, kind, m in results}
+
+    outs = []
+    for sp in species:
+        reg = load_price_model(price_model_path(model_dir, sp, "reg"))
+        clf = load_price_model(price_model_path(model_dir, sp, "clf"))
+        out = forecast(csvs[sp], sp, reg, clf, metrics[(sp, "reg")], metrics[(sp, "clf")],
+                       load_sigma(price_model_path(model_dir, sp, "reg")))
+        _write_forecast(out, f"{sp}_price_forecast_{out['target_week'].iloc[0]}", out_dir, publish_dir)
+        outs.append(out)
+    allout = pd.concat(outs, ignore_index=True)
+    _write_forecast(allout, f"price_forecast_{allout['target_week'].max()}", out_dir, publish_dir)
+    return allout
+
 def main():
     ap = argparse.ArgumentParser("Train price model and export next-week forecast")
-    ap.add_argument("--species", default="anchoveta")
+    ap.add_argument("--species", default="anchoveta", help="Species name, or a comma-separated list")
+    ap.add_argument("--all-species", action="store_true", help=f"Train every <species>_prices.csv in {PRICE_DIR}")
+    ap.add_argument("--workers", type=int, default=None, help="Pool size for multi-species runs (default: CPU count)")
     ap.add_argument("--features_csv", default="data/processed/anchoveta_price_features.csv")
     ap.add_argument("--model_dir",    default="models")
     ap.add_argument("--out_dir",      default="outputs")
@@ -105,8 +232,14 @@ def main():
     args = ap.parse_args()
 
     publish_dir = Path(args.publish) if args.publish else None
+    species = [s.strip() for s in args.species.split(",") if s.strip()]
+    if args.all_species or len(species) > 1:
+        train_all(None if args.all_species else species,
+                  model_dir=Path(args.model_dir), out_dir=Path(args.out_dir),
+                  publish_dir=publish_dir, workers=args.workers)
+        return
     train_and_forecast(Path(args.features_csv),
-                       species=args.species,
+                       species=species[0],
                        model_dir=Path(args.model_dir),
                        out_dir=Path(args.out_dir),
                        publish_dir=publish_dir)
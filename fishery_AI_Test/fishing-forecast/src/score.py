@@ -1,29 +1,172 @@
+import argparse
+import heapq
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
-import joblib
 
-def haversine_km(lat1, lon1, lat2, lon2):
-    R = 6371.0
-    p1 = np.radians(lat1)
-    p2 = np.radians(lat2)
-    dlat = p2 - p1
-    dlon = np.radians(lon2 - lon1)
-    a = np.sin(dlat/2.0)**2 + np.cos(p1)*np.cos(p2)*np.sin(dlon/2.0)**2
-    return 2*R*np.arcsin(np.sqrt(a))
+from src.grid import haversine_km, load_grid
+from src.model_store import load_hotspot
+from src.predictions import load_predictions
+
+# Port presets (approx coords)
+PORTS = {
+    "Paita": (-5.09, -81.11),
+    "Chimbote": (-9.07, -78.59),
+    "Callao": (-12.06, -77.15),
+    "Pisco": (-13.71, -76.22),
+    "Matarani": (-17.00, -72.10),
+}
+DEFAULT_LAMS = (0.0, 0.01, 0.02, 0.05)
+
+def _top_k(score: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest values along the last axis, best first (argpartition + small sort)."""
+    k = min(k, score.shape[-1])
+    if k == 0:
+        return np.empty(score.shape[:-1] + (0,), dtype=np.int64)
+    idx = np.argpartition(-score, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(score, idx, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(idx, order, axis=-1)
 
 def score_week(model_path: str, weekly_features: pd.DataFrame,
-               port_lat: float, port_lon: float, lam: float=0.02) -> pd.DataFrame:
-    """Load model and compute Top-10 cells using distance-aware score.
-    weekly_features must contain: sst, chl, sst_anom, month, lat, lon.
+               port_lat: float, port_lon: float, lam: float=0.02,
+               max_range_km: float | None = None, grid=None) -> pd.DataFrame:
+    """Compute Top-10 cells using distance-aware score.
+    weekly_features must contain lat, lon and either a precomputed p (e.g. from
+    src.predictions) or sst, chl, sst_anom, month, in which case the model is loaded.
+    With max_range_km, only cells the grid index finds within range of the port
+    are scored at all.
     Returns DataFrame with [lat, lon, p, dist_km, score].
     """
-    model = joblib.load(model_path)
     feats = ["sst","chl","sst_anom","month"]
-    df = weekly_features.dropna(subset=feats).copy()
+    df = weekly_features
+    if max_range_km is not None:
+        grid = load_grid(df=df) if grid is None else grid
+        df = grid.attach(df)
+        df = df[np.isin(df["cell_id"].to_numpy(), grid.within(port_lat, port_lon, max_range_km, ocean_only=False))]
+    df = df.dropna(subset=["p"] if "p" in df.columns else feats).copy()
     if df.empty:
         return df
-    proba = model.predict_proba(df[feats].values)[:,1]
-    df["p"] = proba
+    if "p" not in df.columns:
+        df["p"] = load_hotspot(model_path).predict_frame(df)
     df["dist_km"] = haversine_km(port_lat, port_lon, df["lat"].values, df["lon"].values)
     df["score"] = df["p"] - lam * df["dist_km"]
-    return df.sort_values("score", ascending=False).head(10)[["lat","lon","p","dist_km","score"]]
+    return df.iloc[_top_k(df["score"].to_numpy(), 10)][["lat","lon","p","dist_km","score"]]
+
+def skyline(p: np.ndarray, dist: np.ndarray, k: int = 10, block: int = 256) -> np.ndarray:
+    """Positions of every cell that is in the top k by p - λ·dist for some λ >= 0,
+    ordered by p descending (nearer first on ties).
+    A cell with k others at least as good on both p and distance can never rank, so
+    only cells nearer than the k-th nearest of all higher-p cells are kept. Blocks of
+    cells are screened against the current k-th distance before the exact heap pass.
+    """
+    order = np.lexsort((dist, -p))
+    heap: list[float] = []   # negated k smallest distances among the cells seen so far
+    keep = []
+    for b in range(0, order.size, block):
+        chunk = order[b:b + block]
+        if len(heap) == k:
+            chunk = chunk[dist[chunk] < -heap[0]]
+        for pos in chunk.tolist():
+            if len(heap) < k:
+                heapq.heappush(heap, -dist[pos])
+            elif dist[pos] < -heap[0]:
+                heapq.heapreplace(heap, -dist[pos])
+            else:
+                continue
+            keep.append(pos)
+    return np.asarray(keep, dtype=np.int64)
+
+def port_ranking(p: np.ndarray, dist: np.ndarray, k: int = 10,
+                 lams=DEFAULT_LAMS) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """(skyline positions, {f"{λ:g}": top-k as indices into the skyline}) for one port."""
+    rows = skyline(p, dist, k)
+    pp, dd = p[rows], dist[rows]
+    lams = np.asarray(lams, dtype=float)
+    top = _top_k(pp[None, :] - lams[:, None] * dd[None, :], k)
+    return rows, {f"{lam:g}": t for lam, t in zip(lams, top)}
+
+_DIST_CACHE: dict[tuple, np.ndarray] = {}
+
+def port_distances(grid, ports: dict = PORTS) -> np.ndarray:
+    """(ports x cells) distance matrix in km, computed once per grid and port set."""
+    key = (grid.key, tuple((name, *ll) for name, ll in ports.items()))
+    if key not in _DIST_CACHE:
+        plat = np.array([ll[0] for ll in ports.values()])[:, None]
+        plon = np.array([ll[1] for ll in ports.values()])[:, None]
+        _DIST_CACHE[key] = haversine_km(plat, plon, grid.lat[None, :], grid.lon[None, :])
+    return _DIST_CACHE[key]
+
+def _ranked_frame(week, ports, lams, top, ids, p, d, score) -> pd.DataFrame:
+    # top: (L, P, K) positions into ids/p and the last axis of d (P, n) / score (L, P, n)
+    L, P, K = top.shape
+    li, pi = np.meshgrid(np.arange(L), np.arange(P), indexing="ij")
+    li, pi = np.repeat(li.ravel(), K), np.repeat(pi.ravel(), K)
+    col = top.ravel()
+    return pd.DataFrame({
+        "week": week, "port": np.asarray(ports)[pi], "lam": lams[li],
+        "rank": np.tile(np.arange(1, K + 1), L * P),
+        "cell_id": ids[col], "p": p[col], "dist_km": d[pi, col], "score": score[li, pi, col],
+    })
+
+def rank_batch(preds: pd.DataFrame, grid, ports: dict = PORTS,
+               lams=(0.02,), k: int = 10, max_range_km: float | None = None) -> pd.DataFrame:
+    """Top-k cells for every (week, port, λ) in one vectorized pass per week.
+    preds holds [week, cell_id, p] (e.g. from src.predictions.load_predictions).
+    With max_range_km each port only ranks the cells the grid index finds within
+    range, instead of the whole coast.
+    Returns a tidy frame keyed by (week, port, lam, rank) with
+    [cell_id, lat, lon, p, dist_km, score].
+    """
+    lams = np.asarray(lams, dtype=float)
+    names = list(ports)
+    dist = port_distances(grid, ports)                          # (P, C)
+    near = None
+    if max_range_km is not None:
+        near = [grid.within(la, lo, max_range_km, ocean_only=False) for la, lo in ports.values()]
+    out = []
+    for week, g in preds.groupby("week", sort=True):
+        ids = g["cell_id"].to_numpy()
+        p = g["p"].to_numpy(dtype=float)
+        if near is None:
+            d = dist[:, ids]                                    # (P, n)
+            score = p[None, None, :] - lams[:, None, None] * d[None, :, :]   # (L, P, n)
+            out.append(_ranked_frame(week, names, lams, _top_k(score, k), ids, p, d, score))
+            continue
+        lut = np.full(grid.n_cells, np.nan)
+        lut[ids] = p
+        for pi, name in enumerate(names):
+            cells = near[pi][~np.isnan(lut[near[pi]])]
+            d = dist[pi, cells][None, :]                        # (1, n_near)
+            pp = lut[cells]
+            score = pp[None, None, :] - lams[:, None, None] * d[None, :, :]  # (L, 1, n_near)
+            out.append(_ranked_frame(week, [name], lams, _top_k(score, k), cells, pp, d, score))
+    cols = ["week","port","lam","rank","cell_id","lat","lon","p","dist_km","score"]
+    if not out:
+        return pd.DataFrame(columns=cols)
+    ranked = pd.concat(out, ignore_index=True)
+    cell = ranked["cell_id"].to_numpy()
+    ranked["lat"], ranked["lon"] = grid.lat[cell], grid.lon[cell]
+    return ranked[cols]
+
+def main():
+    ap = argparse.ArgumentParser(description="Rank Top-k hotspot cells for every port, λ and week.")
+    ap.add_argument("--weeks", help="Comma-separated ISO weeks (default: every stored week)")
+    ap.add_argument("--lams", default=",".join(map(str, DEFAULT_LAMS)), help="Comma-separated distance penalties")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--max-range-km", type=float, default=None, help="Only rank cells within this range of each port")
+    ap.add_argument("--out", default="outputs/hotspot_rankings.csv")
+    args = ap.parse_args()
+
+    weeks = [w.strip() for w in args.weeks.split(",") if w.strip()] if args.weeks else None
+    preds = load_predictions(weeks)
+    grid = load_grid()
+    preds = preds[grid.ocean[preds["cell_id"].to_numpy()]]
+    ranked = rank_batch(preds, grid, PORTS, [float(x) for x in args.lams.split(",")], args.k,
+                        max_range_km=args.max_range_km)
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    ranked.to_csv(args.out, index=False)
+    print(f"Wrote {args.out}  rows={len(ranked)}")
+
+if __name__ == "__main__":
+    main()
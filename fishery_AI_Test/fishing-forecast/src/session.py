@@ -0,0 +1,94 @@
+"""Resident scoring session for interactive use (the Streamlit app).
+
+Holds the features table (sliced by week), the grid index, per-week hotspot
+probabilities and per-port distance vectors in memory, so a UI rerun only
+pays for what actually changed: a new week loads its p once, and a port or
+λ change just recomputes ``score = p - λ·dist`` over cached vectors.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from src.features import FEATURES_PATH, load_features
+from src.grid import haversine_km, load_grid
+from src.model_store import HotspotModel, load_hotspot
+from src.predictions import load_predictions
+
+class ScoringSession:
+    def __init__(self, features_path: str = FEATURES_PATH, model_path: str | None = None,
+                 max_weeks: int = 16):
+        feats = load_features(path=features_path)
+        self.grid = load_grid(df=feats)
+        feats = self.grid.ocean_rows(feats).sort_values(["week", "cell_id"], kind="stable")
+        self.features = feats.reset_index(drop=True)
+        weeks, starts = np.unique(self.features["week"].to_numpy(), return_index=True)
+        bounds = np.append(starts, len(self.features))
+        self._slices = {w: slice(bounds[i], bounds[i + 1]) for i, w in enumerate(weeks)}
+        self.model_path = model_path
+        self._model = None
+        self._p: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._dist: dict[tuple[float, float], np.ndarray] = {}
+        self.max_weeks = max_weeks
+
+    @property
+    def weeks(self) -> list[str]:
+        return list(self._slices)
+
+    @property
+    def model(self) -> HotspotModel:
+        if self._model is None:
+            self._model = load_hotspot(self.model_path)
+        return self._model
+
+    def week_frame(self, week: str) -> pd.DataFrame:
+        """Ocean-side feature rows for `week` (empty if the week is unknown)."""
+        sl = self._slices.get(week)
+        return self.features.iloc[sl] if sl is not None else self.features.iloc[:0]
+
+    def probabilities(self, week: str) -> np.ndarray:
+        """p for each row of week_frame(week); read from the prediction store once, then cached."""
+        if week in self._p:
+            self._p.move_to_end(week)
+            return self._p[week]
+        dfw = self.week_frame(week)
+        preds = load_predictions([week])
+        p = np.full(len(dfw), np.nan)
+        if not preds.empty:
+            lut = np.full(self.grid.n_cells, np.nan)
+            lut[preds["cell_id"].to_numpy()] = preds["p"].to_numpy()
+            p = lut[dfw["cell_id"].to_numpy()]
+        missing = np.isnan(p)
+        if missing.any():
+            # store lags behind (or is absent): score just the missing rows with the warm model
+            p[missing] = self.model.predict_frame(dfw.loc[missing])
+        self._p[week] = p
+        if len(self._p) > self.max_weeks:
+            self._p.popitem(last=False)
+        return p
+
+    def distances(self, port_lat: float, port_lon: float) -> np.ndarray:
+        """Distance (km) from the port to every grid cell, indexed by cell_id."""
+        key = (float(port_lat), float(port_lon))
+        if key not in self._dist:
+            self._dist[key] = haversine_km(port_lat, port_lon, self.grid.lat, self.grid.lon)
+        return self._dist[key]
+
+    def top_k(self, week: str, port_lat: float, port_lon: float, lam: float = 0.02,
+              k: int = 10, max_range_km: float | None = None) -> pd.DataFrame:
+        """Distance-aware Top-k for one week/port/λ: [lat, lon, p, dist_km, score].
+        With max_range_km, cells out of reach of the port are never ranked.
+        """
+        dfw = self.week_frame(week)
+        p = self.probabilities(week)
+        ids = dfw["cell_id"].to_numpy()
+        if max_range_km is not None:
+            keep = np.isin(ids, self.grid.within(port_lat, port_lon, max_range_km))
+            dfw, p, ids = dfw[keep], p[keep], ids[keep]
+        dist = self.distances(port_lat, port_lon)[ids]
+        score = p - lam * dist
+        order = np.argsort(-score, kind="stable")[:k]
+        return pd.DataFrame({
+            "lat": dfw["lat"].to_numpy()[order], "lon": dfw["lon"].to_numpy()[order],
+            "p": p[order], "dist_km": dist[order], "score": score[order],
+        }, index=dfw.index[order])
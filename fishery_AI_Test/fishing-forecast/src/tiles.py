@@ -0,0 +1,160 @@
+"""Zoom-level pyramid of hotspot probabilities in a compact binary encoding.
+
+Level 0 is the grid itself; level L merges 2^L x 2^L blocks of grid cells into
+one tile holding the max and mean p (and the count) of the cells that have a
+prediction. Levels stop once a single tile covers every cell, or at MAX_LEVEL.
+
+On disk, per week, next to the GeoJSON: ``<week>.tiles.json`` (header) and
+``<week>.tiles.bin`` (blob). For every level the header gives the tile origin and
+step, the zoom from which the level is worth drawing, ``row_ptr`` (first tile of
+each tile row) and the byte range of each column in the blob:
+
+    i, j      uint16   tile row/col; center = (lat0 + i*step, lon0 + j*step)
+    p_max     uint16   round(p * P_SCALE)
+    p_mean    uint16   round(p * P_SCALE)
+    n         uint16   cells aggregated
+
+Tiles are sorted row-major, so a viewer reads one level, or a latitude band of
+it, with plain range reads and no parsing.
+"""
+import json
+import math
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+MAX_LEVEL = 7            # 128 x 128 cells per tile; keeps n within uint16
+P_SCALE = 65535
+TILE_PX = 4              # a level is drawn from the zoom where its tiles span this many pixels
+COLUMNS = ("i", "j", "p_max", "p_mean", "n")
+FORMAT = "ff-tiles/1"
+
+GridSpec = namedtuple("GridSpec", "lat_min lon_min step n_lat n_lon")
+
+def grid_spec(grid) -> GridSpec:
+    """The raster layout of a GridIndex, small enough to ship to worker processes."""
+    return GridSpec(grid.lat_min, grid.lon_min, grid.step, grid.n_lat, grid.n_lon)
+
+def tile_paths(out_dir, week: str) -> tuple[Path, Path]:
+    """(header, blob) paths for `week` in `out_dir`."""
+    return Path(out_dir) / f"{week}.tiles.json", Path(out_dir) / f"{week}.tiles.bin"
+
+def min_zoom(step: float) -> float:
+    """Web-map zoom at which a `step`-degree tile spans TILE_PX pixels at the equator."""
+    return round(math.log2(TILE_PX * 360.0 / (256.0 * step)), 2)
+
+class Level:
+    """One pyramid level: tile geometry plus the (i, j, p_max, p_mean, n) columns."""
+
+    def __init__(self, level: int, lat0: float, lon0: float, step: float, n_rows: int, n_cols: int,
+                 i: np.ndarray, j: np.ndarray, p_max: np.ndarray, p_mean: np.ndarray, n: np.ndarray):
+        self.level, self.lat0, self.lon0, self.step = level, lat0, lon0, step
+        self.n_rows, self.n_cols = n_rows, n_cols
+        self.i, self.j, self.p_max, self.p_mean, self.n = i, j, p_max, p_mean, n
+
+    @property
+    def lat(self) -> np.ndarray:
+        return self.lat0 + self.step * self.i
+
+    @property
+    def lon(self) -> np.ndarray:
+        return self.lon0 + self.step * self.j
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame({"lat": self.lat, "lon": self.lon, "p_max": self.p_max,
+                             "p_mean": self.p_mean, "n": self.n})
+
+def build_pyramid(grid, lat: np.ndarray, lon: np.ndarray, p: np.ndarray,
+                  max_level: int = MAX_LEVEL) -> list[Level]:
+    """Aggregate per-cell p (at cell centers lat/lon of `grid`) into every level.
+    `grid` is a GridIndex or GridSpec; cells with NaN p are left out.
+    """
+    p = np.clip(np.asarray(p, dtype=float), 0.0, 1.0)
+    ok = np.isfinite(p)
+    i0 = np.rint((np.asarray(lat)[ok] - grid.lat_min) / grid.step).astype(np.int64)
+    j0 = np.rint((np.asarray(lon)[ok] - grid.lon_min) / grid.step).astype(np.int64)
+    p = p[ok]
+    levels = []
+    for lv in range(max_level + 1):
+        size = 1 << lv
+        n_rows, n_cols = -(-grid.n_lat // size), -(-grid.n_lon // size)
+        key = (i0 >> lv) * n_cols + (j0 >> lv)
+        order = np.argsort(key, kind="stable")
+        key, ps = key[order], p[order]
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if key.size else np.empty(0, np.int64)
+        counts = np.diff(np.append(starts, key.size))
+        half = (size - 1) / 2  # tile center, in cells from its first row/col
+        levels.append(Level(
+            lv, grid.lat_min + grid.step * half, grid.lon_min + grid.step * half, grid.step * size,
+            n_rows, n_cols, key[starts] // n_cols, key[starts] % n_cols,
+            np.maximum.reduceat(ps, starts) if ps.size else ps,
+            np.add.reduceat(ps, starts) / counts if ps.size else ps, counts))
+        if starts.size <= 1:
+            break
+    return levels
+
+def _quant(p: np.ndarray) -> np.ndarray:
+    return np.rint(np.asarray(p) * P_SCALE).astype("<u2")
+
+def write_tiles(header_path, blob_path, week: str, levels: list[Level], blob_name: str | None = None) -> int:
+    """Write the header and blob for one week; returns the blob size in bytes.
+    `blob_name` is what the header points at (default: blob_path's name)."""
+    header = {"format": FORMAT, "week": week, "bin": blob_name or Path(blob_path).name,
+              "p_scale": P_SCALE, "dtype": "<u2", "levels": []}
+    offset = 0
+    with open(blob_path, "wb") as f:
+        for lv in levels:
+            cols = {"i": lv.i.astype("<u2"), "j": lv.j.astype("<u2"), "p_max": _quant(lv.p_max),
+                    "p_mean": _quant(lv.p_mean), "n": lv.n.astype("<u2")}
+            spans = {}
+            for name in COLUMNS:
+                buf = cols[name].tobytes()
+                f.write(buf)
+                spans[name] = [offset, len(buf)]
+                offset += len(buf)
+            header["levels"].append({
+                "level": lv.level, "lat0": lv.lat0, "lon0": lv.lon0, "step": lv.step,
+                "n_rows": lv.n_rows, "n_cols": lv.n_cols, "tiles": int(lv.i.size),
+                "min_zoom": min_zoom(lv.step),
+                "row_ptr": np.searchsorted(lv.i, np.arange(lv.n_rows + 1)).tolist(),
+                "columns": spans,
+            })
+    Path(header_path).write_text(json.dumps(header, separators=(",", ":")))
+    return offset
+
+def pick_level(header: dict, zoom: float) -> dict:
+    """The finest level whose tiles are still TILE_PX wide at `zoom` (the coarsest if none)."""
+    levels = sorted(header["levels"], key=lambda lv: lv["level"])
+    return next((lv for lv in levels if lv["min_zoom"] <= zoom), levels[-1])
+
+def read_tiles(header_path, level: int | None = None, zoom: float | None = None,
+               lat_range: tuple[float, float] | None = None) -> Level:
+    """Read one level (by number, or the one `zoom` calls for), optionally only the
+    tile rows overlapping `lat_range`; only those bytes of the blob are read."""
+    header_path = Path(header_path)
+    header = json.loads(header_path.read_text())
+    if level is not None:
+        meta = next((lv for lv in header["levels"] if lv["level"] == level), None)
+        if meta is None:
+            raise ValueError(f"{header_path} has levels 0..{len(header['levels']) - 1}, not {level}")
+    else:
+        meta = pick_level(header, zoom if zoom is not None else 0.0)
+    r0, r1 = 0, meta["n_rows"]
+    if lat_range is not None:
+        lo = (min(lat_range) - meta["lat0"]) / meta["step"]
+        hi = (max(lat_range) - meta["lat0"]) / meta["step"]
+        r0, r1 = min(max(int(np.floor(lo + 0.5)), 0), r1), min(max(int(np.floor(hi + 0.5)) + 1, 0), r1)
+    t0, t1 = meta["row_ptr"][r0], meta["row_ptr"][r1]
+    dt = np.dtype(header["dtype"])
+    cols = {}
+    with open(header_path.parent / header["bin"], "rb") as f:
+        for name in COLUMNS:
+            offset, _ = meta["columns"][name]
+            f.seek(offset + t0 * dt.itemsize)
+            cols[name] = np.frombuffer(f.read((t1 - t0) * dt.itemsize), dtype=dt)
+    scale = float(header["p_scale"])
+    return Level(meta["level"], meta["lat0"], meta["lon0"], meta["step"], meta["n_rows"], meta["n_cols"],
+                 cols["i"].astype(np.int64), cols["j"].astype(np.int64),
+                 cols["p_max"] / scale, cols["p_mean"] / scale, cols["n"].astype(np.int64))
@@ -1,17 +1,72 @@
+import argparse
+import itertools
+import json
+import math
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import numpy as np
+import pyarrow.parquet as pq
+import xgboost as xgb
 from sklearn.model_selection import TimeSeriesSplit
 from xgboost import XGBClassifier
 import joblib
 import os
+import tempfile
+import time
+
+from src.features import FEATURES_PATH, load_features
+from src.instrument import file_bytes, peak_rss_mb, stage
+from src.model_store import FEATS, data_hash, files_hash, save_hotspot
+from src.predictions import refresh
 
-FEATURES_PATH = "data/processed/features.parquet"
 LABELS_PATH   = "data/processed/labels.parquet"
 MODEL_PATH    = "models/hotspot_xgb.pkl"
 
+# Same hyper-parameters as the in-memory XGBClassifier, in native xgb.train form
+BOOSTER_PARAMS = {
+    "max_depth": 5,
+    "eta": 0.05,
+    "subsample": 0.9,
+    "colsample_bytree": 0.9,
+    "lambda": 1.0,
+    "objective": "binary:logistic",
+    "tree_method": "hist",
+    "nthread": 4,
+}
+N_ROUNDS = 400
+
+TUNING_PATH = "outputs/hotspot_tuning.csv"
+# Candidate space for `train.py tune` (sampled without replacement)
+SEARCH_SPACE = {
+    "max_depth": [3, 4, 5, 6, 8],
+    "eta": [0.03, 0.05, 0.1, 0.2],
+    "subsample": [0.7, 0.8, 0.9, 1.0],
+    "colsample_bytree": [0.7, 0.9, 1.0],
+    "min_child_weight": [1, 5, 10],
+    "lambda": [0.5, 1.0, 5.0],
+}
+
+def _join_keys(features_cols, labels_cols) -> list[str]:
+    # Join on the integer cell key when both tables carry it; fall back to float lat/lon
+    return ["week","cell_id"] if {"cell_id"} <= set(features_cols) & set(labels_cols) else ["week","lat","lon"]
+
+def _save_model(model, save_to: str, training_hash: str | None) -> None:
+    """Pickle (legacy readers) + native UBJSON with sidecar (what inference loads)."""
+    os.makedirs(os.path.dirname(save_to), exist_ok=True)
+    native = os.path.splitext(save_to)[0] + ".ubj"
+    with stage("train.save") as st:
+        joblib.dump(model, save_to)
+        meta = save_hotspot(model, native, FEATS, training_hash)
+        st.add(bytes_written=lambda: file_bytes(save_to, native))
+    print(f"Saved model to {save_to} and {native} (version {meta['version']})")
+
 def train_hotspot(features_df: pd.DataFrame, labels_df: pd.DataFrame, save_to: str=MODEL_PATH):
-    df = features_df.merge(labels_df, on=["week","lat","lon"], how="inner").dropna()
-    feats = ["sst","chl","sst_anom","month"]
-    X = df[feats].values
+    keys = _join_keys(features_df.columns, labels_df.columns)
+    with stage("train.join", rows_in=len(features_df) + len(labels_df)) as st:
+        df = features_df.merge(labels_df[keys + ["hotspot"]], on=keys, how="inner").dropna()
+        st.add(rows_out=len(df))
+    X = df[FEATS].values
     y = df["hotspot"].values
     model = XGBClassifier(
         n_estimators=400,
@@ -23,20 +78,230 @@ def train_hotspot(features_df: pd.DataFrame, labels_df: pd.DataFrame, save_to: s
         objective="binary:logistic",
         n_jobs=4
     )
-    # For hackathon speed: fit once. (Optionally add TimeSeriesSplit CV)
-    model.fit(X, y)
-    import os
-    os.makedirs(os.path.dirname(save_to), exist_ok=True)
-    joblib.dump(model, save_to)
-    print(f"Saved model to {save_to}")
+    # For hackathon speed: fit once. (`train.py tune` runs TimeSeriesSplit CV + search)
+    with stage("train.fit", rows_in=len(X)):
+        model.fit(X, y)
+    _save_model(model, save_to, data_hash(df[FEATS + ["hotspot"]]))
+    return model
+
+class WeekBatches(xgb.DataIter):
+    """Streams the features parquet row group by row group (week chunks), joining
+    each batch to its labels via a week-filtered read, as float32 arrays.
+    """
+
+    def __init__(self, features_path: str = FEATURES_PATH, labels_path: str = LABELS_PATH,
+                 batch_rows: int = 1_000_000, cache_prefix: str | None = None):
+        self._pf = pq.ParquetFile(features_path)
+        self._labels_path = labels_path
+        label_cols = pq.ParquetFile(labels_path).schema_arrow.names
+        self._keys = _join_keys(self._pf.schema_arrow.names, label_cols)
+        # group consecutive row groups into batches of ~batch_rows
+        self._batches, cur, rows = [], [], 0
+        for i in range(self._pf.num_row_groups):
+            cur.append(i)
+            rows += self._pf.metadata.row_group(i).num_rows
+            if rows >= batch_rows:
+                self._batches.append(cur)
+                cur, rows = [], 0
+        if cur:
+            self._batches.append(cur)
+        self.n_batches = len(self._batches)
+        self._it = 0
+        self.rows = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data) -> bool:
+        if self._it >= len(self._batches):
+            return False
+        feats = self._pf.read_row_groups(self._batches[self._it], columns=self._keys + FEATS).to_pandas()
+        labels = pd.read_parquet(self._labels_path, columns=self._keys + ["hotspot"],
+                                 filters=[("week", "in", list(feats["week"].unique()))])
+        df = feats.merge(labels, on=self._keys, how="inner").dropna()
+        input_data(data=np.ascontiguousarray(df[FEATS].to_numpy(dtype=np.float32)),
+                   label=df["hotspot"].to_numpy(dtype=np.float32))
+        self.rows += len(df)
+        self._it += 1
+        return True
+
+    def reset(self) -> None:
+        self._it = 0
+        self.rows = 0
+
+def train_hotspot_streaming(features_path: str = FEATURES_PATH, labels_path: str = LABELS_PATH,
+                            save_to: str = MODEL_PATH, batch_rows: int = 1_000_000,
+                            external_memory: bool = False):
+    """Out-of-core training: never materializes the full feature/label join.
+    Batches go through a DataIter into a QuantileDMatrix (or an external-memory
+    matrix paged to a temp dir). Prints peak RSS and throughput for sizing.
+    """
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        it = WeekBatches(features_path, labels_path, batch_rows,
+                         cache_prefix=os.path.join(cache_dir, "xgb") if external_memory else None)
+        with stage("train.build_matrix", bytes_read=lambda: file_bytes(features_path, labels_path)) as st:
+            if not external_memory:
+                dtrain = xgb.QuantileDMatrix(it, max_bin=256)
+            elif hasattr(xgb, "ExtMemQuantileDMatrix"):
+                dtrain = xgb.ExtMemQuantileDMatrix(it, max_bin=256)
+            else:
+                dtrain = xgb.DMatrix(it)
+            n_rows, n_batches = dtrain.num_row(), it.n_batches
+            st.add(rows_out=n_rows)
+        t_build = time.perf_counter() - t0
+        with stage("train.boost", rows_in=n_rows):
+            booster = xgb.train(BOOSTER_PARAMS, dtrain, num_boost_round=N_ROUNDS)
+        t_train = time.perf_counter() - t0 - t_build
+        del dtrain, it  # release external-memory pages before the cache dir goes away
+
+    # Wrap as XGBClassifier so pickle readers keep calling predict_proba
+    model = XGBClassifier()
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    _save_model(model, save_to, files_hash(features_path, labels_path))
+    print(f"rows={n_rows}  batches={n_batches}  build={t_build:.2f}s  train={t_train:.2f}s  "
+          f"throughput={n_rows / max(t_build + t_train, 1e-9):,.0f} rows/s"
+          + (f"  peak_rss={peak:,.0f} MB" if (peak := peak_rss_mb()) is not None else ""))
     return model
 
+def _join(features_df: pd.DataFrame, labels_df: pd.DataFrame) -> pd.DataFrame:
+    keys = _join_keys(features_df.columns, labels_df.columns)
+    return features_df.merge(labels_df[keys + ["hotspot"]], on=keys, how="inner").dropna()
+
+def rolling_origin_folds(weeks: np.ndarray, n_splits: int = 4, max_train_weeks: int | None = None):
+    """(train_weeks, val_weeks) pairs over sorted ISO weeks; each origin trains on the
+    past (optionally a rolling window) and validates on the following block of weeks.
+    """
+    uniq = np.sort(np.unique(weeks))
+    for tr, va in TimeSeriesSplit(n_splits=n_splits, max_train_size=max_train_weeks).split(uniq):
+        yield uniq[tr], uniq[va]
+
+def _fold_matrices(df: pd.DataFrame, n_splits: int, max_train_weeks: int | None) -> list[tuple]:
+    """(train, val) QuantileDMatrix per rolling origin; val shares train's bin cuts."""
+    folds = []
+    for tr_w, va_w in rolling_origin_folds(df["week"].to_numpy(), n_splits, max_train_weeks):
+        tr, va = df[df["week"].isin(tr_w)], df[df["week"].isin(va_w)]
+        dtr = xgb.QuantileDMatrix(tr[FEATS].to_numpy(np.float32), tr["hotspot"].to_numpy(np.float32), max_bin=256)
+        dva = xgb.QuantileDMatrix(va[FEATS].to_numpy(np.float32), va["hotspot"].to_numpy(np.float32), ref=dtr)
+        folds.append((dtr, dva))
+    return folds
+
+def _eval_candidate(folds: list[tuple], job: tuple) -> dict:
+    cid, params, rounds, early_stop = job
+    t0 = time.perf_counter()
+    logloss, auc, best_it = [], [], []
+    for dtr, dva in folds:
+        hist: dict = {}
+        booster = xgb.train({**params, "eval_metric": ["auc", "logloss"]}, dtr, num_boost_round=rounds,
+                            evals=[(dva, "val")], early_stopping_rounds=early_stop,
+                            evals_result=hist, verbose_eval=False)
+        i = booster.best_iteration
+        logloss.append(hist["val"]["logloss"][i])
+        auc.append(hist["val"]["auc"][i])
+        best_it.append(i + 1)
+    return {"candidate": cid, "rounds": rounds, **{k: v for k, v in params.items() if k in SEARCH_SPACE},
+            "val_logloss": float(np.mean(logloss)), "val_auc": float(np.mean(auc)),
+            "best_iteration": int(np.mean(best_it)), "fit_seconds": time.perf_counter() - t0}
+
+def tune_hotspot(features_df: pd.DataFrame, labels_df: pd.DataFrame, n_candidates: int = 16,
+                 n_splits: int = 4, max_train_weeks: int | None = None, min_rounds: int = 50,
+                 max_rounds: int = 800, halving: int = 3, workers: int | None = None,
+                 seed: int = 0, results_path: str = TUNING_PATH, save_to: str = MODEL_PATH):
+    """Rolling-origin CV + successive-halving search over SEARCH_SPACE.
+    Each fold's train/val matrices are built once, up front, and shared by every
+    candidate: fits run on a thread pool (XGBoost releases the GIL while boosting and
+    only reads the matrices). Rungs grow the boosting budget by `halving`x and keep the
+    best 1/halving of candidates (early stopping also trims each fit). Cores are split
+    between pool threads and per-fit XGBoost threads. Writes the results table and
+    refits the best configuration on all data.
+    """
+    with stage("train.join", rows_in=len(features_df) + len(labels_df)) as st:
+        df = _join(features_df, labels_df)
+        st.add(rows_out=len(df))
+    rng = np.random.default_rng(seed)
+    grid = list(itertools.product(*SEARCH_SPACE.values()))
+    picks = rng.choice(len(grid), size=min(n_candidates, len(grid)), replace=False)
+    cands = {i: dict(zip(SEARCH_SPACE, grid[g])) for i, g in enumerate(picks)}
+
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, len(cands), cpus))
+    nthread = max(1, cpus // workers)
+    base = {"objective": "binary:logistic", "tree_method": "hist", "nthread": nthread, "seed": seed}
+
+    rows = []
+    with stage("train.fold_matrices", rows_in=len(df)):
+        folds = _fold_matrices(df, n_splits, max_train_weeks)
+    print(f"tuning {len(cands)} candidates x {len(folds)} folds on {workers} workers x {nthread} threads")
+
+    alive, rounds, rung = list(cands), min_rounds, 0
+    with stage("train.search", rows_in=len(df)), ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            early_stop = max(10, rounds // 10)
+            jobs = [(c, {**base, **cands[c]}, rounds, early_stop) for c in alive]
+            res = sorted(pool.map(functools.partial(_eval_candidate, folds), jobs), key=lambda r: r["val_logloss"])
+            for r in res:
+                r["rung"] = rung
+            rows.extend(res)
+            print(f"rung {rung}: {len(res)} candidates @ {rounds} rounds, best logloss={res[0]['val_logloss']:.4f}")
+            if len(res) == 1 or rounds >= max_rounds:
+                break
+            alive = [r["candidate"] for r in res[:max(1, math.ceil(len(res) / halving))]]
+            rounds, rung = min(rounds * halving, max_rounds), rung + 1
+    del folds
+
+    results = pd.DataFrame(rows)
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    results.to_csv(results_path, index=False)
+    print(f"Wrote tuning results -> {results_path}  rows={len(results)}")
+
+    best = res[0]
+    params = cands[best["candidate"]]
+    model = XGBClassifier(
+        n_estimators=best["best_iteration"], max_depth=params["max_depth"], learning_rate=params["eta"],
+        subsample=params["subsample"], colsample_bytree=params["colsample_bytree"],
+        min_child_weight=params["min_child_weight"], reg_lambda=params["lambda"],
+        objective="binary:logistic", n_jobs=cpus, random_state=seed,
+    )
+    with stage("train.fit", rows_in=len(df)):
+        model.fit(df[FEATS].to_numpy(np.float32), df["hotspot"].to_numpy())
+    print(f"Best {json.dumps(params)} rounds={best['best_iteration']}")
+    _save_model(model, save_to, data_hash(df[FEATS + ["hotspot"]]))
+    return model, results
+
 def main():
+    ap = argparse.ArgumentParser(description="Train the hotspot classifier.")
+    ap.add_argument("--streaming", action="store_true",
+                    help="Out-of-core training: stream parquet row groups through an XGBoost DataIter")
+    ap.add_argument("--external-memory", action="store_true",
+                    help="With --streaming, page the training matrix to disk instead of a QuantileDMatrix")
+    ap.add_argument("--batch-rows", type=int, default=1_000_000, help="Target rows per streamed batch")
+    sub = ap.add_subparsers(dest="command")
+    tune = sub.add_parser("tune", help="Rolling-origin CV + successive-halving hyperparameter search")
+    tune.add_argument("--candidates", type=int, default=16)
+    tune.add_argument("--splits", type=int, default=4, help="Rolling origins over ISO weeks")
+    tune.add_argument("--max-train-weeks", type=int, default=None, help="Rolling training window (default: expanding)")
+    tune.add_argument("--min-rounds", type=int, default=50)
+    tune.add_argument("--max-rounds", type=int, default=800)
+    tune.add_argument("--workers", type=int, default=None, help="Pool size (default: CPU count, capped by candidates)")
+    tune.add_argument("--seed", type=int, default=0)
+    tune.add_argument("--results", default=TUNING_PATH)
+    args = ap.parse_args()
+
     if not os.path.exists(FEATURES_PATH) or not os.path.exists(LABELS_PATH):
         raise FileNotFoundError("Missing features or labels parquet. Run data_gen.py first or provide real data.")
-    feats = pd.read_parquet(FEATURES_PATH)
-    labels = pd.read_parquet(LABELS_PATH)
-    train_hotspot(feats, labels)
+    if args.command == "tune":
+        tune_hotspot(load_features(), pd.read_parquet(LABELS_PATH),
+                     n_candidates=args.candidates, n_splits=args.splits,
+                     max_train_weeks=args.max_train_weeks, min_rounds=args.min_rounds,
+                     max_rounds=args.max_rounds, workers=args.workers, seed=args.seed,
+                     results_path=args.results)
+    elif args.streaming:
+        train_hotspot_streaming(FEATURES_PATH, LABELS_PATH, MODEL_PATH, args.batch_rows, args.external_memory)
+    else:
+        feats = load_features()
+        labels = pd.read_parquet(LABELS_PATH)
+        train_hotspot(feats, labels)
+    with stage("train.refresh_predictions"):
+        weeks = refresh(FEATURES_PATH)
+    print(f"Refreshed prediction store ({len(weeks)} week(s) scored)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,223 @@
+"""Incremental weekly update: ingest, score and publish one new week.
+
+    python -m src.update --week 2024-W41 --sst sst.csv --chl chl.csv [--out public/predictions]
+    python -m src.update --week 2024-W41 --sst sst.npy --chl chl.npz   # gridded stacks (see src.gridded)
+    python -m src.update --week 2024-W41 --synthetic          # demo: synthetic fields for the week
+
+1. The week's SST/Chl rows become one partition next to the features table
+   (``features_weeks/<week>.parquet``); the SST anomaly comes from the saved
+   rolling window (``AnomalyState``), not from re-reading history.
+2. Only that partition is scored, with the resident hotspot model, and entered
+   in the prediction store.
+3. Only that week's GeoJSON (with its tile pyramid and per-port ranked lists) is
+   exported and, for every species whose price CSV already has the week, a
+   next-week price forecast is made from the trailing rows its lags need, using
+   the saved price models (no refit).
+
+Every file is written under a temporary name and all are renamed into place at
+the end (``latest.json`` in the GeoJSON folder last), so readers never see a
+half-published week. Cost is O(grid cells + ports), whatever the history length.
+Re-running the most recent week replaces it, starting from the state saved
+before it.
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src import isoweek
+from src.data_gen import synth_fields, week_rngs
+from src.export_geojson import ranked_path, write_fc, write_ranked
+from src.features import (FEATURES_PATH, PREV_STATE_PATH, STATE_PATH, AnomalyState,
+                          append_week_features, partition_path)
+from src.grid import load_grid
+from src.gridded import METHODS, is_gridded, week_frame
+from src.instrument import file_bytes, stage
+from src.model_pack import load_price_model
+from src.predictions import (PRED_DIR, features_sig, record_week, score_frame, week_fingerprints,
+                             week_path)
+from src.price_features import week_features
+from src.price_train import (LANDINGS_DIR, PRICE_DIR, discover_species, forecast_rows, load_metric,
+                             load_sigma, price_model_path)
+from src.score import PORTS, port_distances
+from src.tiles import build_pyramid, tile_paths, write_tiles
+
+PUBLISH_DIR = "outputs/predictions"
+PRICE_OUT_DIR = "outputs"
+
+class Batch:
+    """Files written under temporary names, renamed into place together on commit
+    (in the order they were requested) or removed if the block fails."""
+
+    def __init__(self):
+        self._moves: list[tuple[Path, Path]] = []
+
+    def path(self, final) -> Path:
+        final = Path(final)
+        final.parent.mkdir(parents=True, exist_ok=True)
+        # hidden, and not matching *.parquet / *.geojson globs; np.savez insists on .npz
+        tmp = final.with_name(f".{final.name}.tmp" + (".npz" if final.suffix == ".npz" else ""))
+        self._moves.append((tmp, final))
+        return tmp
+
+    @property
+    def pending(self) -> list[Path]:
+        return [tmp for tmp, _ in self._moves]
+
+    def __enter__(self) -> "Batch":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            for tmp, final in self._moves:
+                os.replace(tmp, final)
+        else:
+            for tmp, _ in self._moves:
+                tmp.unlink(missing_ok=True)
+        return False
+
+def read_field(path: str, week: str | None = None, grid=None, method: str = "nearest") -> pd.DataFrame:
+    """[lat, lon, value] or [cell_id, value] rows (optionally with week) from CSV or parquet,
+    or `week` of a gridded stack regridded onto `grid`."""
+    if is_gridded(path):
+        return week_frame(path, week, grid, method)
+    return pd.read_parquet(path) if str(path).endswith(".parquet") else pd.read_csv(path)
+
+def synthetic_fields(week: str, grid, seed: int = 0) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """The same fields data_gen would generate for `week`, as [cell_id, value] rows."""
+    sst, chl = synth_fields(grid.lat, grid.lon, [week], week_rngs([week], seed))
+    ids = np.arange(grid.n_cells, dtype=np.int32)
+    return (pd.DataFrame({"cell_id": ids, "value": sst[0]}),
+            pd.DataFrame({"cell_id": ids, "value": chl[0]}))
+
+def _start_state(week: str) -> tuple[AnomalyState, AnomalyState]:
+    """(state to advance, state to keep as 'before the newest week')."""
+    state = AnomalyState.load(STATE_PATH)
+    if state.last_week == week:
+        if not Path(PREV_STATE_PATH).exists():
+            raise SystemExit(f"{week} is already in the history and no earlier state was saved")
+        state = AnomalyState.load(PREV_STATE_PATH)
+    elif state.last_week is not None and isoweek.weeks_between(state.last_week, week) < 1:
+        raise SystemExit(f"{week} is before the last appended week {state.last_week}; only the newest week can be redone")
+    return state, AnomalyState(state.tail.copy(), state.last_week, state.window)
+
+def _price_forecasts(week: str, batch: Batch, species: list[str], out_dir: Path,
+                     publish_dir: Path | None, model_dir: Path) -> list[str]:
+    names = []
+    for sp in species:
+        reg_path, clf_path = price_model_path(model_dir, sp, "reg"), price_model_path(model_dir, sp, "clf")
+        if not reg_path.exists() or not clf_path.exists():
+            print(f"[{sp}] no price models in {model_dir}; run price_train first")
+            continue
+        land = Path(LANDINGS_DIR)
+        pred = land / f"{sp}_predicted_landings.csv"
+        if not pred.exists():
+            pred = land / "predicted_landings.csv"
+        rows = week_features(Path(PRICE_DIR) / f"{sp}_prices.csv", land / f"{sp}_landings.csv", pred, week)
+        if rows.empty:
+            print(f"[{sp}] no complete price features for {week}; skipped")
+            continue
+        out = forecast_rows(rows, sp, load_price_model(reg_path), load_price_model(clf_path),
+                            load_metric(reg_path), load_metric(clf_path), load_sigma(reg_path))
+        name = f"{sp}_price_forecast_{out['target_week'].iloc[0]}"
+        out.to_csv(batch.path(out_dir / f"{name}.csv"), index=False)
+        for d in [out_dir] + ([publish_dir] if publish_dir else []):
+            out.to_json(batch.path(d / f"{name}.json"), orient="records", indent=2)
+        names.append(name)
+    return names
+
+def update_week(week: str, sst_df: pd.DataFrame, chl_df: pd.DataFrame, out_dir: str = PUBLISH_DIR,
+                price_out_dir: str = PRICE_OUT_DIR, price_publish_dir: str | None = None,
+                species: list[str] | None = None, model_dir: str = "models") -> dict:
+    """Append, score and publish one week; returns the published manifest."""
+    isoweek.to_index(week)  # validates the label
+    grid = load_grid()
+    state, before = _start_state(week)
+    sig_before = features_sig(FEATURES_PATH)
+    out_dir, price_out_dir = Path(out_dir), Path(price_out_dir)
+
+    with stage("update.week") as st, Batch() as batch:
+        with stage("update.features", rows_in=len(sst_df) + len(chl_df)) as s:
+            feats = append_week_features(state, week, sst_df, chl_df, grid)
+            feats.to_parquet(batch.path(partition_path(week)), index=False)
+            s.add(rows_out=len(feats))
+        if feats.empty:
+            raise SystemExit(f"No cells with both SST and Chl for {week}")
+
+        with stage("update.score", rows_in=len(feats)):
+            scored = score_frame(feats)
+            scored.to_parquet(batch.path(week_path(PRED_DIR, week)), index=False)
+            fingerprint = week_fingerprints(feats)[week]
+
+        with stage("update.geojson") as s:
+            ids = scored["cell_id"].to_numpy()
+            keep = grid.ocean[ids]
+            geojson = out_dir / f"{week}.geojson"
+            lon, lat, p = grid.lon[ids[keep]], grid.lat[ids[keep]], scored["p"].to_numpy(dtype=float)[keep]
+            write_fc(batch.path(geojson), lon, lat, p)
+            header, blob = tile_paths(out_dir, week)
+            write_tiles(batch.path(header), batch.path(blob), week, build_pyramid(grid, lat, lon, p), blob.name)
+            for (port, ll), dist in zip(PORTS.items(), port_distances(grid)[:, ids[keep]]):
+                write_ranked(batch.path(ranked_path(out_dir, week, port)), week, port, ll, lon, lat, p, dist)
+            s.add(rows_out=int(keep.sum()))
+
+        with stage("update.prices"):
+            prices = _price_forecasts(week, batch, species if species is not None else discover_species(),
+                                      price_out_dir, Path(price_publish_dir) if price_publish_dir else None,
+                                      Path(model_dir))
+
+        manifest = {
+            "week": week, "geojson": geojson.name, "cells": int(keep.sum()),
+            "model_version": str(scored["model_version"].iloc[0]),
+            "price_forecasts": [f"{n}.json" for n in prices],
+            "published_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        # the anomaly state goes in after every output and just before latest.json: if the
+        # commit stops partway, the state has not advanced and a rerun redoes the whole week
+        before.save(batch.path(PREV_STATE_PATH))
+        state.save(batch.path(STATE_PATH))
+        batch.path(out_dir / "latest.json").write_text(json.dumps(manifest, indent=2))
+        st.add(bytes_written=lambda: file_bytes(*batch.pending))
+
+    record_week(week, fingerprint, sig_before)
+    return manifest
+
+def main():
+    ap = argparse.ArgumentParser(description="Append, score and publish one new week.")
+    ap.add_argument("--week", required=True, help="ISO week like 2024-W41")
+    ap.add_argument("--sst", help="SST for the week: CSV/parquet with lat, lon, value (or cell_id, value), "
+                                  "or a gridded .npy/.npz/raw stack")
+    ap.add_argument("--chl", help="Chl for the week, same layout")
+    ap.add_argument("--method", choices=METHODS, default="nearest", help="Regridding for gridded stacks")
+    ap.add_argument("--synthetic", action="store_true", help="Use data_gen's synthetic fields for the week")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default=PUBLISH_DIR, help="GeoJSON folder (e.g. Next.js public/predictions)")
+    ap.add_argument("--price-out", default=PRICE_OUT_DIR)
+    ap.add_argument("--publish-prices", default="", help="Optional Next.js public/prices folder")
+    ap.add_argument("--species", default=None, help=f"Comma-separated (default: every species in {PRICE_DIR})")
+    args = ap.parse_args()
+
+    if args.synthetic:
+        sst_df, chl_df = synthetic_fields(args.week, load_grid(), args.seed)
+    elif args.sst and args.chl:
+        grid = load_grid()
+        try:
+            sst_df, chl_df = (read_field(p, args.week, grid, args.method) for p in (args.sst, args.chl))
+        except KeyError as e:
+            raise SystemExit(e.args[0])
+    else:
+        raise SystemExit("Provide --sst and --chl, or --synthetic")
+    species = [s.strip() for s in args.species.split(",") if s.strip()] if args.species else None
+
+    t0 = time.perf_counter()
+    m = update_week(args.week, sst_df, chl_df, args.out, args.price_out, args.publish_prices or None, species)
+    print(f"Published {args.week}: {m['geojson']} ({m['cells']} cells)"
+          + (f", {', '.join(m['price_forecasts'])}" if m["price_forecasts"] else "")
+          + f"  in {time.perf_counter() - t0:.2f}s")
+
+if __name__ == "__main__":
+    main()